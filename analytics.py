@@ -0,0 +1,118 @@
+import math
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+# --- Per-Company Aggregates ---
+# Dashboard figures per company, kept up to date from the change feed of the
+# shared backend instead of groupbys over full frames on every rerun. Each
+# change is applied in O(1): the old version of the record is subtracted and
+# the new one added. They are built once from the tables when attached.
+# Approval latency covers the requests in the live table (archived ones drop out).
+
+PRODUCT_FIELDS = ['products', 'total_stock', 'inventory_value']
+REQUEST_FIELDS = ['pending_requests', 'resolved_requests', 'approval_latency_seconds']
+COLUMNS = ['company', *PRODUCT_FIELDS, 'pending_requests', 'resolved_requests', 'avg_approval_hours']
+
+
+def _number(value):
+    """Returns value as a float, 0 for empty values."""
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return 0.0
+    return 0.0 if math.isnan(value) else value
+
+
+def _latency(request):
+    """Seconds from request to approval/rejection, or None if not resolved."""
+    if request.get('status') not in ('Approved', 'Rejected'):
+        return None
+    try:
+        return (datetime.fromisoformat(str(request['approval_date']))
+                - datetime.fromisoformat(str(request['request_date']))).total_seconds()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class CompanyAggregates:
+    """Materialized per-company product and request figures, maintained from a ChangeFeed."""
+
+    def __init__(self):
+        self._companies = {}
+        self._lock = threading.Lock()
+
+    def _totals(self, company):
+        if company not in self._companies:
+            self._companies[company] = dict.fromkeys(PRODUCT_FIELDS + REQUEST_FIELDS, 0)
+        return self._companies[company]
+
+    def _add_product(self, product, sign):
+        totals = self._totals(product.get('company'))
+        stock = _number(product.get('stock'))
+        totals['products'] += sign
+        totals['total_stock'] += sign * stock
+        totals['inventory_value'] += sign * stock * _number(product.get('price'))
+
+    def _add_request(self, request, sign):
+        totals = self._totals(request.get('company'))
+        if request.get('status') == 'Pending':
+            totals['pending_requests'] += sign
+        latency = _latency(request)
+        if latency is not None:
+            totals['resolved_requests'] += sign
+            totals['approval_latency_seconds'] += sign * latency
+
+    def __call__(self, change):
+        """Applies one Change of the feed."""
+        add = {'products_df': self._add_product, 'product_requests_df': self._add_request}.get(change.table)
+        if add is None:
+            return
+        with self._lock:
+            if change.old is not None:
+                add(change.old, -1)
+            if change.new is not None:
+                add(change.new, 1)
+
+    def attach(self, backend):
+        """Builds the aggregates from the tables of a SharedBackend and subscribes to its feed,
+        atomically with respect to writes."""
+        with backend.lock:
+            products = backend.table('products_df').frame()
+            requests = backend.table('product_requests_df').frame()
+            with self._lock:
+                self._build(products, requests)
+            backend.feed.subscribe(self)
+        return self
+
+    def _build(self, products, requests):
+        """Computes the aggregates from full frames, with one groupby per table."""
+        self._companies = {}
+        stock = pd.to_numeric(products['stock'], errors='coerce').fillna(0)
+        value = stock * pd.to_numeric(products['price'], errors='coerce').fillna(0)
+        by_company = pd.DataFrame({'products': 1, 'total_stock': stock, 'inventory_value': value}).groupby(products['company'])
+        for company, row in by_company.sum().iterrows():
+            self._totals(company).update(row.to_dict())
+        resolved = requests['status'].isin(['Approved', 'Rejected'])
+        latency = (pd.to_datetime(requests['approval_date'].where(resolved), format='ISO8601', errors='coerce')
+                   - pd.to_datetime(requests['request_date'], format='ISO8601', errors='coerce')).dt.total_seconds()
+        by_company = pd.DataFrame({
+            'pending_requests': requests['status'] == 'Pending',
+            'resolved_requests': latency.notna(),
+            'approval_latency_seconds': latency.fillna(0),
+        }).groupby(requests['company'])
+        for company, row in by_company.sum().iterrows():
+            self._totals(company).update(row.to_dict())
+
+    def snapshot(self, company=None):
+        """Returns one row per company (or only `company`) as a DataFrame."""
+        with self._lock:
+            rows = [dict(totals, company=name) for name, totals in self._companies.items()
+                    if company is None or name == company]
+        df = pd.DataFrame(rows, columns=['company', *PRODUCT_FIELDS, *REQUEST_FIELDS])
+        df['avg_approval_hours'] = (df['approval_latency_seconds'] / 3600 / df['resolved_requests']).where(df['resolved_requests'] > 0)
+        df = df.astype({'products': int, 'total_stock': int, 'pending_requests': int, 'resolved_requests': int})
+        df['inventory_value'] = df['inventory_value'].round(2)
+        df = df[(df['products'] > 0) | (df['pending_requests'] > 0) | (df['resolved_requests'] > 0)]  # Drop emptied companies
+        return df[COLUMNS].sort_values('company', ignore_index=True)
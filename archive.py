@@ -0,0 +1,99 @@
+import os
+from datetime import datetime, timedelta
+from urllib.parse import quote
+
+import pandas as pd
+
+from store import CHUNKSIZE, ROW_VERSION, TABLES, Schema
+
+# --- Product Request Archive ---
+# Resolved (Approved/Rejected) requests older than a configurable age are moved
+# out of the live request table into compressed Parquet files, partitioned by
+# company, so the live table only holds open and recently resolved requests.
+# The archive is read on demand with pyarrow (an optional dependency).
+
+DEFAULT_ARCHIVE_DIR = 'archive'
+DEFAULT_MAX_AGE_DAYS = 30
+RESOLVED_STATUSES = ['Approved', 'Rejected']
+NUMERIC_COLUMNS = ['product_version', 'old_price', 'new_price', 'old_stock', 'new_stock', 'row_version']  # Everything else is a string
+
+
+def _archive_schema(pa):
+    """Fixed schema of the archive files, so all-empty columns do not change it between files."""
+    return pa.schema([
+        (col, pa.float64() if col in NUMERIC_COLUMNS else pa.string())
+        for col in TABLES['product_requests_df']['columns'] if col != 'company'
+    ])
+
+
+def expired_requests(store, max_age, limit=None):
+    """Returns (at most limit) resolved requests approved/rejected before now - max_age."""
+    cutoff = (datetime.now() - max_age).isoformat()
+    resolved = store.find(status=RESOLVED_STATUSES)
+    expired = resolved[resolved['approval_date'].astype(str) < cutoff]
+    return expired if limit is None else expired.head(limit)
+
+
+def write_archive(rows, archive_dir, name):
+    """Writes requests to the archive, as a Parquet file called name in the partition of each company."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    for company, rows in rows.groupby('company', sort=False):
+        partition_dir = os.path.join(archive_dir, f"company={quote(str(company), safe='')}")
+        os.makedirs(partition_dir, exist_ok=True)
+        rows = rows.drop(columns=['company']).astype({col: 'float64' for col in NUMERIC_COLUMNS})
+        table = pa.Table.from_pandas(rows, schema=_archive_schema(pa), preserve_index=False)
+        pq.write_table(table, os.path.join(partition_dir, f"{name}.parquet"), compression='zstd')
+
+
+def archive_resolved_requests(store, archive_dir=DEFAULT_ARCHIVE_DIR, max_age=timedelta(days=DEFAULT_MAX_AGE_DAYS)):
+    """Moves resolved requests approved/rejected before now - max_age into the archive.
+    Returns the number of archived requests."""
+    import pyarrow  # noqa: F401  Fail before anything is read if the archive cannot be written
+
+    expired = expired_requests(store, max_age)
+    if expired.empty:
+        return 0
+    write_archive(expired, archive_dir, f"requests-{datetime.now().strftime('%Y%m%dT%H%M%S%f')}")
+    store.delete_many(expired[store.key].tolist())
+    return len(expired)
+
+
+def _archive_dataset(archive_dir, company, filters):
+    """Returns (pyarrow dataset, filter expression) over the archive, or (None, None) if it is empty."""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    if not os.path.isdir(archive_dir) or not os.listdir(archive_dir):
+        return None, None
+    schema = _archive_schema(pa).append(pa.field('company', pa.string()))
+    dataset = ds.dataset(archive_dir, schema=schema, format='parquet', partitioning='hive')
+    expression = None
+    for col, value in dict(filters, **({'company': company} if company is not None else {})).items():
+        condition = ds.field(col) == value
+        expression = condition if expression is None else expression & condition
+    return dataset, expression
+
+
+def query_archive(archive_dir=DEFAULT_ARCHIVE_DIR, company=None, **filters):
+    """Returns archived requests, optionally for one company and matching column == value filters."""
+    dataset, expression = _archive_dataset(archive_dir, company, filters)
+    if dataset is None:
+        return pd.DataFrame()
+    return dataset.to_table(filter=expression).to_pandas()
+
+
+def iter_archive(archive_dir=DEFAULT_ARCHIVE_DIR, company=None, chunksize=CHUNKSIZE, **filters):
+    """Yields archived requests like query_archive, in chunks of at most chunksize rows with the
+    columns and types of the live request table."""
+    dataset, expression = _archive_dataset(archive_dir, company, filters)
+    if dataset is None:
+        return
+    table = TABLES['product_requests_df']
+    schema = Schema(table.get('dtypes'))
+    for batch in dataset.to_batches(filter=expression, batch_size=chunksize):
+        if batch.num_rows:
+            chunk = batch.to_pandas()[table['columns']]
+            chunk[ROW_VERSION] = chunk[ROW_VERSION].fillna(1)  # Archived before requests had versions
+            yield schema.conform(chunk)
@@ -0,0 +1,211 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# --- Initial User Data (Hardcoded for demonstration) ---
+# Only used to seed a credential store. Passwords are kept as salted hashes after startup.
+HARDCODED_USERS = {
+    "superadmin@mail.com": {"password": "superpassword", "role": "Super Admin", "company": "Global"},
+    "admin1@companyA.com": {"password": "adminpasswordA", "role": "Admin", "company": "Company A"},
+    "user1@companyA.com": {"password": "userpasswordA", "role": "User", "company": "Company A"},
+    "admin2@companyB.com": {"password": "adminpasswordB", "role": "Admin", "company": "Company B"},
+    "user2@companyB.com": {"password": "userpasswordB", "role": "User", "company": "Company B"},
+}
+
+# --- Password Hashing ---
+# Passwords are stored as salted PBKDF2-SHA256 hashes:
+#   pbkdf2_sha256$<iterations>$<salt>$<hash>
+# The cost (iterations) is tunable. Hashes made with a different cost are
+# transparently rehashed with the current one on the next successful login.
+#
+# Bulk-imported users are hashed with IMPORT_ITERATIONS instead, because an
+# import of thousands of users at the default cost would take hours of CPU.
+# This is a trade-off: until a user first logs in, their hash is about 60x
+# cheaper to brute-force if the credential store leaks. It cannot be upgraded
+# in the background, since rehashing needs the plaintext, which is only
+# available at login. Imported passwords are therefore meant to be temporary
+# (hand them out with a request to log in soon) and should not be reused.
+
+ALGORITHM = 'pbkdf2_sha256'
+DEFAULT_ITERATIONS = int(os.environ.get('CRUD_PBKDF2_ITERATIONS', '600000'))
+IMPORT_ITERATIONS = 10_000  # Bulk-imported temporary passwords, rehashed on first login (see above)
+SALT_BYTES = 16
+
+# Hashing takes hundreds of milliseconds by design, so it runs in a bounded
+# thread pool (hashlib releases the GIL) instead of the Streamlit script thread.
+VERIFY_WORKERS = 4
+MAX_PENDING = 64      # Verifications queued or running at once; further logins are refused
+VERIFY_TIMEOUT = 10   # Seconds to wait for a verification
+
+SESSION_TTL = 30 * 60  # Seconds a session token is valid; refreshed while the session is active
+
+
+def _b64(data):
+    return base64.b64encode(data).decode('ascii')
+
+
+def hash_password(password, iterations=DEFAULT_ITERATIONS):
+    """Returns the salted hash of a password."""
+    salt = secrets.token_bytes(SALT_BYTES)
+    digest = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return f"{ALGORITHM}${iterations}${_b64(salt)}${_b64(digest)}"
+
+
+def verify_password(password, password_hash):
+    """Checks a password against a hash made by hash_password."""
+    try:
+        algorithm, iterations, salt, digest = password_hash.split('$')
+    except (AttributeError, ValueError):
+        return False
+    if algorithm != ALGORITHM:
+        return False
+    candidate = hashlib.pbkdf2_hmac('sha256', password.encode(), base64.b64decode(salt), int(iterations))
+    return hmac.compare_digest(candidate, base64.b64decode(digest))
+
+
+def needs_rehash(password_hash, iterations=DEFAULT_ITERATIONS):
+    """Returns True if a hash was not made with the current algorithm and cost."""
+    return not password_hash.startswith(f"{ALGORITHM}${iterations}$")
+
+
+class LoginBusy(Exception):
+    """Raised when too many logins are being verified at once."""
+
+
+# --- Credential Store ---
+# Login users (email -> password hash, role, company), shared by all sessions.
+# After a successful login the session gets a signed token, so reruns check an
+# HMAC instead of running the KDF again.
+
+class CredentialStore:
+    """Thread-safe login credentials with salted password hashes."""
+
+    def __init__(self, iterations=DEFAULT_ITERATIONS, workers=VERIFY_WORKERS, max_pending=MAX_PENDING):
+        self.iterations = iterations
+        self._users = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='password-hash')
+        self._pending = threading.BoundedSemaphore(max_pending)
+        self._secret = secrets.token_bytes(32)  # Per process: tokens do not survive a restart
+        self._dummy_hash = hash_password(secrets.token_hex(8), iterations)
+
+    def __contains__(self, email):
+        with self._lock:
+            return email in self._users
+
+    def __len__(self):
+        with self._lock:
+            return len(self._users)
+
+    def _run(self, fn, *args):
+        """Runs fn in the hashing pool and waits for its result. Raises LoginBusy if the pool is
+        full or fn takes longer than VERIFY_TIMEOUT."""
+        if not self._pending.acquire(timeout=VERIFY_TIMEOUT):
+            raise LoginBusy("Too many logins at once, please try again.")
+        try:
+            future = self._pool.submit(fn, *args)
+        except BaseException:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())  # Held until fn is done, even after a timeout
+        try:
+            return future.result(timeout=VERIFY_TIMEOUT)
+        except TimeoutError:
+            raise LoginBusy("Logins are slow right now, please try again.") from None
+
+    def hash_many(self, passwords, iterations=None):
+        """Hashes passwords in parallel in the pool."""
+        iterations = iterations or self.iterations
+        return list(self._pool.map(lambda password: hash_password(password, iterations), passwords))
+
+    def add(self, email, password, role, company, iterations=None):
+        """Adds a user. Returns False if the email is already taken."""
+        password_hash = self._run(hash_password, password, iterations or self.iterations)
+        with self._lock:
+            if email in self._users:
+                return False
+            self._users[email] = {'password_hash': password_hash, 'role': role, 'company': company}
+            return True
+
+    def add_many(self, users, iterations=None):
+        """Adds users given as {email: {'password', 'role', 'company'}}, hashing in parallel."""
+        hashes = self.hash_many([details['password'] for details in users.values()], iterations)
+        self.register({email: {'password_hash': password_hash, 'role': details['role'], 'company': details['company']}
+                       for (email, details), password_hash in zip(users.items(), hashes)})
+
+    def register(self, users):
+        """Adds users given as {email: {'password_hash', 'role', 'company'}} with already hashed passwords."""
+        with self._lock:
+            self._users.update((email, dict(details)) for email, details in users.items())
+
+    def update(self, email, **fields):
+        """Changes the role/company of a user. Returns False if not found."""
+        with self._lock:
+            if email not in self._users:
+                return False
+            self._users[email].update(fields)
+            return True
+
+    def remove(self, email):
+        with self._lock:
+            self._users.pop(email, None)
+
+    def user(self, email):
+        """Returns {'role', 'company'} of a user, or None."""
+        with self._lock:
+            details = self._users.get(email)
+            return {'role': details['role'], 'company': details['company']} if details else None
+
+    def authenticate(self, email, password):
+        """Verifies a login off-thread. Returns {'role', 'company'} or None.
+        Rehashes the password if it was hashed with another cost."""
+        with self._lock:
+            details = self._users.get(email)
+            password_hash = details['password_hash'] if details else self._dummy_hash  # Same timing for unknown emails
+        if not self._run(verify_password, password, password_hash) or details is None:
+            return None
+        if needs_rehash(password_hash, self.iterations):
+            self._replace_hash(email, password_hash, self._run(hash_password, password, self.iterations))
+        return self.user(email)
+
+    def _replace_hash(self, email, old_hash, new_hash):
+        """Stores a rehashed password, unless the password changed in the meantime."""
+        with self._lock:
+            if self._users.get(email, {}).get('password_hash') == old_hash:
+                self._users[email]['password_hash'] = new_hash
+
+    # --- Session Tokens ---
+
+    def _sign(self, payload):
+        return hmac.new(self._secret, payload.encode(), hashlib.sha256).hexdigest()
+
+    def issue_token(self, email, ttl=SESSION_TTL):
+        """Returns a signed token for email, valid for ttl seconds."""
+        payload = f"{email}|{int(time.time()) + ttl}"
+        return f"{payload}|{self._sign(payload)}"
+
+    def check_token(self, token, ttl=SESSION_TTL):
+        """Validates a session token without running the KDF.
+
+        Returns (user, token) with the user's current role/company and the token
+        to keep (refreshed once half its lifetime has passed), or (None, None) if
+        the token is invalid, expired or its user no longer exists.
+        """
+        try:
+            email, expires, signature = token.rsplit('|', 2)
+            expires = int(expires)
+        except (AttributeError, ValueError):
+            return None, None
+        if not hmac.compare_digest(signature, self._sign(f"{email}|{expires}")) or expires < time.time():
+            return None, None
+        user = self.user(email)
+        if user is None:
+            return None, None
+        if expires - time.time() < ttl / 2:
+            token = self.issue_token(email, ttl)
+        return user, token
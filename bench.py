@@ -0,0 +1,242 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from analytics import CompanyAggregates
+from service import Actor, CrudService
+from store import OPTION_LABELS, SharedBackend, ViewCache, open_backend, option_labels
+
+# --- Benchmarks ---
+# Generates synthetic multi-tenant data and times the hot paths of the app
+# headlessly: the service calls behind add_record/update_record/delete_record,
+# the company-filtered table pages, the record picker options and their labels,
+# the search box, the pending request queue of the approvals page, and a rerun
+# of a table page answered from the view cache (hit) or computed (miss). Results (latency percentiles and peak
+# memory) are printed as JSON and can be checked against a stored baseline.
+#
+#   python bench.py --rows 1M --skew 1.2 --output results.json
+#   python bench.py --rows 1M --baseline baseline.json   # exits 1 on regression
+
+DEFAULT_ROWS = '10k'
+DEFAULT_COMPANIES = 100
+DEFAULT_SKEW = 1.0         # Zipf exponent of the company sizes (0 = uniform)
+DEFAULT_REPEAT = 200
+DEFAULT_TOLERANCE = 0.25   # Allowed slowdown of p50/p90 against the baseline
+MIN_REGRESSION_MS = 0.1    # Smaller slowdowns are timer noise
+PENDING_RATIO = 0.1
+PERCENTILES = [50, 90, 99]
+PAGE_SIZE = 50
+PICKER_LIMIT = 50
+
+WORDS = ['Laptop', 'Mouse', 'Server', 'Keyboard', 'Monitor', 'Cable', 'Router', 'Switch', 'Printer', 'Scanner',
+         'Tablet', 'Phone', 'Camera', 'Speaker', 'Headset', 'Dock', 'Charger', 'Drive', 'Adapter', 'Webcam']
+
+
+def parse_size(text):
+    """Parses sizes like 10k, 2.5M or 10000."""
+    text = str(text).strip().lower()
+    factor = {'k': 1_000, 'm': 1_000_000}.get(text[-1:], 1)
+    return int(float(text.rstrip('km')) * factor)
+
+
+def company_sizes(rows, companies, skew, rng):
+    """Assigns rows to companies with Zipf-distributed sizes. Returns company names per row."""
+    weights = 1 / np.arange(1, companies + 1) ** skew
+    names = np.array([f"Company {i:04d}" for i in range(companies)], dtype=object)
+    return names[rng.choice(companies, size=rows, p=weights / weights.sum())]
+
+
+def generate(rows, companies=DEFAULT_COMPANIES, skew=DEFAULT_SKEW, seed=0):
+    """Generates {table: DataFrame} with `rows` products, rows/10 users and rows/2 product requests."""
+    rng = np.random.default_rng(seed)
+    product_company = company_sizes(rows, companies, skew, rng)
+    products = pd.DataFrame({
+        'id': 'p' + pd.Series(np.arange(rows)).astype(str),
+        'product_name': pd.Series(np.array(WORDS, dtype=object)[rng.integers(0, len(WORDS), rows)])
+                        + ' ' + pd.Series(rng.integers(0, 100_000, rows)).astype(str),
+        'price': rng.uniform(1, 5000, rows).round(2),
+        'stock': rng.integers(0, 1000, rows),
+        'company': product_company,
+    })
+    n_users = max(rows // 10, companies)
+    users = pd.DataFrame({
+        'id': 'u' + pd.Series(np.arange(n_users)).astype(str),
+        'name': 'User ' + pd.Series(np.arange(n_users)).astype(str),
+        'email': 'user' + pd.Series(np.arange(n_users)).astype(str) + '@example.com',
+        'company': company_sizes(n_users, companies, skew, rng),
+        'role': np.where(rng.random(n_users) < 0.1, 'Admin', 'User'),
+    })
+    n_requests = rows // 2
+    target = rng.integers(0, rows, n_requests)
+    is_update = rng.random(n_requests) < 0.8
+    status = np.where(rng.random(n_requests) < PENDING_RATIO, 'Pending',
+                      np.where(rng.random(n_requests) < 0.8, 'Approved', 'Rejected'))
+    start = datetime.now() - timedelta(days=60)
+    request_date = pd.Series(start + pd.to_timedelta(rng.integers(0, 60 * 86400, n_requests), unit='s'))
+    requests = pd.DataFrame({
+        'request_id': 'r' + pd.Series(np.arange(n_requests)).astype(str),
+        'product_id': products['id'].to_numpy()[target],
+        'company': product_company[target],
+        'request_type': np.where(is_update, 'Update', 'Delete'),
+        'old_stock': products['stock'].to_numpy()[target].astype(float),
+        'new_stock': np.where(is_update, rng.integers(0, 1000, n_requests), np.nan),
+        'requested_by_email': 'user0@example.com',
+        'status': status,
+        'admin_notes': '',
+        'request_date': request_date.dt.strftime('%Y-%m-%dT%H:%M:%S'),
+        'approval_date': np.where(status == 'Pending', '', request_date.dt.strftime('%Y-%m-%dT%H:%M:%S')),
+    })
+    return {'users_df': users, 'products_df': products, 'product_requests_df': requests}
+
+
+def peak_memory_mb():
+    """Peak resident memory of this process in MB, or None where it cannot be read."""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def timed(fn, repeat):
+    """Calls fn repeat times. Returns latency statistics in milliseconds."""
+    latencies = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        fn(i)
+        latencies.append((time.perf_counter() - started) * 1000)
+    latencies = np.array(latencies)
+    stats = {f'p{p}': round(float(np.percentile(latencies, p)), 3) for p in PERCENTILES}
+    stats.update(mean=round(float(latencies.mean()), 3), max=round(float(latencies.max()), 3), n=repeat)
+    return stats
+
+
+def run(data, storage='memory', path=None, repeat=DEFAULT_REPEAT, seed=0):
+    """Loads the data into a backend and times the hot paths. Returns the results dict."""
+    rng = np.random.default_rng(seed)
+    backend = SharedBackend(open_backend(storage, path))
+    started = time.perf_counter()
+    for df_name, df in data.items():
+        backend.table(df_name).insert_many(df)
+    load_seconds = time.perf_counter() - started
+    CompanyAggregates().attach(backend)  # Like the app, so writes include the change feed
+
+    service = CrudService(backend)
+    products = backend.table('products_df')
+    requests = backend.table('product_requests_df')
+    # The largest company is the worst case for company-scoped views
+    company = data['products_df']['company'].value_counts().index[0]
+    admin = Actor('admin@example.com', 'Admin', company)
+    company_ids = data['products_df'].loc[data['products_df']['company'] == company, 'id'].to_numpy()
+    targets = rng.permutation(company_ids)
+    added = []
+    prefixes = [word[:3] for word in WORDS]
+    queries = [f"{word[:4 + i % 3]} {i}" if i % 2 else word[1:4] for i, word in enumerate(WORDS)]
+    products.search(queries[0], {'company': company}, limit=PAGE_SIZE)  # Builds the company's search index
+
+    def add(i):
+        ids, _ = service.create(admin, 'products_df', [{'product_name': f"Bench {i}", 'price': 9.99, 'stock': i}])
+        added.extend(ids)
+
+    def update(i):
+        service.update(admin, 'products_df', [{'id': targets[i % len(targets)], 'stock': i}])
+
+    def delete(i):
+        service.delete(admin, 'products_df', [added[i]])
+
+    def company_page(i):
+        return products.page({'company': company}, None, 'price', i % 2 == 0, offset=(i % 10) * PAGE_SIZE, limit=PAGE_SIZE)
+
+    views = ViewCache()
+
+    def cached_page(i, cache):
+        """A table page through the view cache, keyed like crud.cached_view."""
+        key = ('products_df', products.version_of(company), admin.role, admin.company, 'page', i)
+        return cache.get(key, lambda: company_page(i))
+
+    picker_rows = products.prefix_search(prefixes[0], {'company': company}, limit=PICKER_LIMIT)
+
+    cases = {
+        'add_record': add,
+        'update_record': update,
+        'delete_record': delete,
+        'company_filter_page': company_page,
+        'paged_table_cache_hit': lambda i: cached_page(0, views),  # Only the first call computes the page
+        'paged_table_cache_miss': lambda i: cached_page(i, ViewCache()),
+        'company_filter_count': lambda i: products.count(company=company),
+        'picker_options': lambda i: products.prefix_search(prefixes[i % len(prefixes)], {'company': company},
+                                                           limit=PICKER_LIMIT),
+        'picker_option_labels': lambda i: option_labels(products, 'products_df', prefixes[i % len(prefixes)],
+                                                        {'company': company}, limit=PICKER_LIMIT),
+        'option_labels_only': lambda i: OPTION_LABELS['products_df'](picker_rows),
+        'search_box': lambda i: products.search(queries[i % len(queries)], {'company': company}, limit=PAGE_SIZE),
+        'pending_requests_page': lambda i: requests.page({'company': company, 'status': 'Pending'}, None,
+                                                         'request_date', True, offset=0, limit=PAGE_SIZE),
+        'pending_requests_count': lambda i: requests.count(company=company, status='Pending'),
+    }
+    results = {name: timed(fn, min(repeat, len(added)) if name == 'delete_record' else repeat)
+               for name, fn in cases.items()}
+    return {
+        'storage': storage,
+        'rows': {df_name: len(df) for df_name, df in data.items()},
+        'hot_company_products': int(len(company_ids)),
+        'load_seconds': round(load_seconds, 3),
+        'peak_memory_mb': peak_memory_mb(),
+        'cases': results,
+    }
+
+
+def regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Returns messages for the cases whose p50 or p90 got slower than baseline * (1 + tolerance),
+    by at least MIN_REGRESSION_MS."""
+    messages = []
+    for name, stats in results['cases'].items():
+        base = baseline.get('cases', {}).get(name)
+        if not base:
+            continue
+        for stat in ['p50', 'p90']:
+            if stats[stat] > max(base[stat] * (1 + tolerance), base[stat] + MIN_REGRESSION_MS):
+                messages.append(f"{name} {stat}: {stats[stat]:.3f} ms vs baseline {base[stat]:.3f} ms")
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the CRUD hot paths on synthetic multi-tenant data.")
+    parser.add_argument('--rows', default=DEFAULT_ROWS, help="Number of products, e.g. 10k, 1M, 10M")
+    parser.add_argument('--companies', type=int, default=DEFAULT_COMPANIES)
+    parser.add_argument('--skew', type=float, default=DEFAULT_SKEW, help="Zipf exponent of company sizes")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument('--storage', default='memory', choices=['memory', 'sqlite'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--baseline', help="Fail if slower than the results stored in this JSON file")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    data = generate(parse_size(args.rows), args.companies, args.skew, args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'bench.db') if args.storage == 'sqlite' else None
+        results = run(data, args.storage, path, args.repeat, args.seed)
+    results.update(skew=args.skew, companies=args.companies)
+    print(json.dumps(results, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = regressions(results, json.load(f), args.tolerance)
+        if failures:
+            print("Regressions against baseline:", *failures, sep='\n  ', file=sys.stderr)
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,20 +1,39 @@
 import streamlit as st
 import pandas as pd
+import hashlib
+import json
+import os
 import uuid
-from datetime import datetime
+from datetime import datetime, timedelta
+
+from analytics import CompanyAggregates
+from archive import query_archive
+from auth import HARDCODED_USERS, CredentialStore, LoginBusy
+from export import EXPORT_FORMATS, available_formats, export_bytes
+from ingest import allowed_roles_for_creation
+from jobs import ACTIVE_STATES, DONE, FAILED, JOB_HANDLERS, QUEUED, RUNNING, JobExecutor, JobTable, job_file
+from metrics import METRICS, profiled
+from service import CONFLICT, Actor, CrudService, start_http_server
+from store import (PRODUCT_CHANGED, ROW_VERSION, TABLES, SharedBackend, ViewCache, open_backend, option_labels,
+                   request_changes)
 
 # --- Global Data Storage (In-memory DataFrames & Users) ---
-# In a real app, these would be persisted in a database (e.g., SQLite, PostgreSQL)
-
-# --- Initial User Data (Hardcoded for demonstration) ---
-# In a real app, this would be hashed passwords and proper user management
-HARDCODED_USERS = {
-    "superadmin@mail.com": {"password": "superpassword", "role": "Super Admin", "company": "Global"},
-    "admin1@companyA.com": {"password": "adminpasswordA", "role": "Admin", "company": "Company A"},
-    "user1@companyA.com": {"password": "userpasswordA", "role": "User", "company": "Company A"},
-    "admin2@companyB.com": {"password": "adminpasswordB", "role": "Admin", "company": "Company B"},
-    "user2@companyB.com": {"password": "userpasswordB", "role": "User", "company": "Company B"},
-}
+# All sessions of a server process share one set of tables (see SharedBackend).
+# By default they are kept in memory. Set CRUD_STORAGE=sqlite (and optionally
+# CRUD_SQLITE_PATH) to persist them in a SQLite file instead, or
+# CRUD_STORAGE=multiprocess to run several server processes on one SQLite file,
+# each with an in-memory copy kept current with the others' writes.
+STORAGE_BACKEND = os.environ.get('CRUD_STORAGE', 'memory')
+SQLITE_PATH = os.environ.get('CRUD_SQLITE_PATH', 'crud.db')
+# Resolved product requests older than this are moved to a Parquet archive
+ARCHIVE_DIR = os.environ.get('CRUD_ARCHIVE_DIR', 'archive')
+ARCHIVE_AFTER_DAYS = int(os.environ.get('CRUD_ARCHIVE_AFTER_DAYS', '30'))
+ARCHIVE_INTERVAL = timedelta(hours=1)
+# Set CRUD_HTTP_PORT to also serve the JSON API of the service (see service.py) on that local port
+HTTP_PORT = os.environ.get('CRUD_HTTP_PORT')
+# Set CRUD_METRICS_EXPORT to a .prom (Prometheus text) or .jsonl file to export the span timings there
+METRICS_EXPORT = os.environ.get('CRUD_METRICS_EXPORT')
+METRICS_EXPORT_INTERVAL = 15 # Seconds
 
 # --- Initialize Session State for DataFrames and Login ---
 if 'logged_in' not in st.session_state:
@@ -23,44 +42,76 @@ if 'logged_in' not in st.session_state:
     st.session_state.user_role = None
     st.session_state.user_company = None
 
-if 'users_df' not in st.session_state:
-    st.session_state.users_df = pd.DataFrame(
-        columns=['id', 'name', 'email', 'company', 'role']
-    )
-    # Add initial users from HARDCODED_USERS (simulate database init)
-    for email, details in HARDCODED_USERS.items():
-        st.session_state.users_df.loc[len(st.session_state.users_df)] = {
+def seed_tables(backend):
+    """Adds the demo users and products to a new, empty database (simulate database init).
+    Tables emptied later are left empty."""
+    with backend.lock:  # Other processes may open the same file at the same time
+        if len(backend.credentials) == 0:
+            backend.credentials.add_many(HARDCODED_USERS)
+        if len(backend.table('users_df')) > 0:
+            return
+        backend.table('users_df').insert_many([{
             'id': str(uuid.uuid4()),
             'name': email.split('@')[0].capitalize(),
             'email': email,
             'company': details['company'],
             'role': details['role']
-        }
-
-if 'products_df' not in st.session_state:
-    st.session_state.products_df = pd.DataFrame(
-        columns=['id', 'product_name', 'price', 'stock', 'company']
-    )
-    st.session_state.products_df.loc[len(st.session_state.products_df)] = {'id': str(uuid.uuid4()), 'product_name': 'Laptop A', 'price': 1200.00, 'stock': 50, 'company': 'Company A'}
-    st.session_state.products_df.loc[len(st.session_state.products_df)] = {'id': str(uuid.uuid4()), 'product_name': 'Mouse A', 'price': 25.50, 'stock': 200, 'company': 'Company A'}
-    st.session_state.products_df.loc[len(st.session_state.products_df)] = {'id': str(uuid.uuid4()), 'product_name': 'Server B', 'price': 5000.00, 'stock': 10, 'company': 'Company B'}
-    st.session_state.products_df.loc[len(st.session_state.products_df)] = {'id': str(uuid.uuid4()), 'product_name': 'Keyboard B', 'price': 75.00, 'stock': 150, 'company': 'Company B'}
-
-
-# Product Request Statuses: 'Pending', 'Approved', 'Rejected'
-if 'product_requests_df' not in st.session_state:
-    st.session_state.product_requests_df = pd.DataFrame(
-        columns=['request_id', 'product_id', 'request_type', 'old_data', 'new_data', 'requested_by_email', 'status', 'admin_notes', 'request_date', 'approval_date']
-    )
+        } for email, details in HARDCODED_USERS.items()])
+        if len(backend.table('products_df')) == 0:
+            backend.table('products_df').insert_many([
+                {'id': str(uuid.uuid4()), 'product_name': 'Laptop A', 'price': 1200.00, 'stock': 50, 'company': 'Company A'},
+                {'id': str(uuid.uuid4()), 'product_name': 'Mouse A', 'price': 25.50, 'stock': 200, 'company': 'Company A'},
+                {'id': str(uuid.uuid4()), 'product_name': 'Server B', 'price': 5000.00, 'stock': 10, 'company': 'Company B'},
+                {'id': str(uuid.uuid4()), 'product_name': 'Keyboard B', 'price': 75.00, 'stock': 150, 'company': 'Company B'},
+            ])
+
+@st.cache_resource
+def get_shared_backend(kind, path):
+    """Opens the backend once per server process; all sessions share it. Seeds a new database."""
+    backend = open_backend(kind, path)
+    credentials = getattr(backend, 'credentials', None)  # Stored in the file by the SQLite backends
+    backend = SharedBackend(backend, credentials if credentials is not None else CredentialStore())
+    seed_tables(backend)
+    return backend
+
+@st.cache_resource
+def get_service(kind, path):
+    """The business rules layer over the shared backend; all pages go through it."""
+    service = CrudService(get_shared_backend(kind, path))
+    if HTTP_PORT:
+        start_http_server(service, port=int(HTTP_PORT))
+    return service
+
+@st.cache_resource
+def get_job_executor(kind, path):
+    """Runs the long operations of all sessions in the background (see jobs.py).
+    The job table is kept in the SQLite file when the data is."""
+    jobs = JobTable(None if kind == 'memory' else path)
+    return JobExecutor(jobs, get_service(kind, path), JOB_HANDLERS).start()
+
+@st.cache_resource
+def get_company_aggregates(kind, path):
+    """Per-company dashboard figures, maintained from the change feed of the shared backend."""
+    return CompanyAggregates().attach(get_shared_backend(kind, path))
+
+if 'backend' not in st.session_state:
+    st.session_state.backend = get_shared_backend(STORAGE_BACKEND, SQLITE_PATH)
 
 
 # --- Authentication Functions ---
+@METRICS.timed('auth.login')
 def authenticate(email, password):
-    if email in HARDCODED_USERS and HARDCODED_USERS[email]['password'] == password:
+    try:
+        user = st.session_state.backend.credentials.authenticate(email, password)
+    except LoginBusy as e:
+        st.warning(str(e))
+        return
+    if user:
+        st.session_state.auth_token = st.session_state.backend.credentials.issue_token(email)
         st.session_state.logged_in = True
         st.session_state.current_user = email
-        st.session_state.user_role = HARDCODED_USERS[email]['role']
-        st.session_state.user_company = HARDCODED_USERS[email]['company']
+        st.session_state.user_role = user['role']
+        st.session_state.user_company = user['company']
         st.success(f"Welcome, {st.session_state.user_role} from {st.session_state.user_company}!")
         # CHANGE THIS LINE:
         st.rerun() # Rerun to show the main app
@@ -68,6 +119,7 @@ def authenticate(email, password):
         st.error("Invalid email or passwordd.")
 
 def logout():
+    st.session_state.auth_token = None
     st.session_state.logged_in = False
     st.session_state.current_user = None
     st.session_state.user_role = None
@@ -76,441 +128,662 @@ def logout():
     # Change this line:
     st.rerun() # This is the fix!
 
+@METRICS.timed('auth.check_session')
+def check_session():
+    """Validates the session token on every rerun (an HMAC check, no password hashing)
+    and picks up role/company changes. Ends the session if the token expired or the user was removed."""
+    if not st.session_state.logged_in:
+        return
+    user, token = st.session_state.backend.credentials.check_token(st.session_state.get('auth_token'))
+    if user is None:
+        st.session_state.auth_token = None
+        st.session_state.logged_in = False
+        st.session_state.current_user = None
+        st.session_state.user_role = None
+        st.session_state.user_company = None
+        st.warning("Your session has expired. Please log in again.")
+        return
+    st.session_state.auth_token = token
+    st.session_state.user_role = user['role']
+    st.session_state.user_company = user['company']
+
 
 # --- Helper Functions for Data Manipulation ---
 
+def get_store(df_name):
+    """Returns the record store backing the specified table."""
+    return st.session_state.backend.table(df_name)
+
+def get_df(df_name):
+    """Returns the live rows of the specified table as a DataFrame."""
+    return get_store(df_name).frame()
+
+def current_actor():
+    """Returns the logged-in user as a service Actor."""
+    return Actor(st.session_state.current_user, st.session_state.user_role, st.session_state.user_company)
+
+def crud_service():
+    return get_service(STORAGE_BACKEND, SQLITE_PATH)
+
+def report(applied, rejected, message):
+    """Shows the outcome of a single-record service call. Returns True if it was applied."""
+    if applied:
+        st.success(message)
+        return True
+    st.error(f"Not saved: {rejected['reason'].iloc[0]}." if not rejected.empty else "Record not found.")
+    return False
+
+@METRICS.timed('data.add_record')
 def add_record(df_name, new_data):
     """Adds a new record to the specified DataFrame."""
-    df = st.session_state[df_name]
-    new_data['id'] = str(uuid.uuid4()) # Generate unique ID
-    new_df = pd.concat([df, pd.DataFrame([new_data])], ignore_index=True)
-    st.session_state[df_name] = new_df
-    st.success(f"Record added successfully!")
+    return report(*crud_service().create(current_actor(), df_name, [new_data]), "Record added successfully!")
 
-def update_record(df_name, record_id, updated_data):
-    """Updates an existing record in the specified DataFrame."""
-    df = st.session_state[df_name]
-    if record_id in df['id'].values:
-        idx = df[df['id'] == record_id].index[0]
-        for key, value in updated_data.items():
-            st.session_state[df_name].at[idx, key] = value
-        st.success("Record updated successfully!")
-    else:
-        st.error("Record not found.")
+def show_current(df_name, record_id, message):
+    """Shows an error and the current values of a record that changed under the user."""
+    st.error(message)
+    current = get_store(df_name).get_many([record_id])
+    if not current.empty:
+        st.dataframe(current.drop(columns=[ROW_VERSION]), use_container_width=True, hide_index=True)
 
+@METRICS.timed('data.update_record')
+def update_record(df_name, record_id, updated_data):
+    """Updates an existing record in the specified DataFrame. If updated_data holds the
+    row_version the record was loaded with and it changed since, nothing is saved."""
+    key = get_store(df_name).key
+    applied, rejected = crud_service().update(current_actor(), df_name, [dict(updated_data, **{key: record_id})])
+    if not applied and (rejected['reason'] == CONFLICT).any():
+        show_current(df_name, record_id, "Not saved: someone else changed this record after you opened it. "
+                                          "Its current values are shown below, review them and submit again.")
+        return False
+    return report(applied, rejected, "Record updated successfully!")
+
+def loaded_version(form_key, record_id, record):
+    """Returns the row_version a record had when its form was first shown. The form submits it
+    with the update (the rerun of a submit re-reads the record, so that version would always match)."""
+    loaded = st.session_state.get(f"{form_key}_loaded")
+    if loaded is None or loaded[0] != record_id:
+        loaded = st.session_state[f"{form_key}_loaded"] = (record_id, int(record[ROW_VERSION]))
+    return loaded[1]
+
+@METRICS.timed('data.delete_record')
 def delete_record(df_name, record_id):
     """Deletes a record from the specified DataFrame."""
-    df = st.session_state[df_name]
-    initial_rows = len(df)
-    st.session_state[df_name] = df[df['id'] != record_id].reset_index(drop=True)
-    if len(st.session_state[df_name]) < initial_rows:
-        st.success("Record deleted successfully!")
-    else:
-        st.error("Record not found or could not be deleted.")
+    return report(*crud_service().delete(current_actor(), df_name, [record_id]), "Record deleted successfully!")
+
+@METRICS.timed('data.propose_change')
+def propose_change(product_id, request_type, new_data=None):
+    """Files a product change request for approval."""
+    proposal = dict(new_data or {}, product_id=product_id, request_type=request_type)
+    return report(*crud_service().propose(current_actor(), [proposal]),
+                  f"Product {'update' if request_type == 'Update' else 'deletion'} request submitted for approval!")
+
+VIEW_CACHE_SIZE = 256
+
+def cached_view(df_name, view, compute, *params):
+    """Returns compute(), memoized per (table, version, role, company, view, params).
+    Every write to a table bumps its version, so cached views never go stale;
+    reruns that only change widgets reuse them without touching the data.
+    Views scoped to one company use its version, if the store keeps one per company."""
+    cache = st.session_state.setdefault('view_cache', ViewCache(VIEW_CACHE_SIZE))
+    company = None if st.session_state.user_role == "Super Admin" else st.session_state.user_company
+    key = (df_name, get_store(df_name).version_of(company), st.session_state.user_role, st.session_state.user_company, view, params)
+    return cache.get(key, METRICS.timed(f'store.{df_name}.{view}')(compute)) # Timed on cache misses only
+
+def frozen(filters):
+    """Returns a hashable form of a filter dict, for cache keys."""
+    return tuple(sorted((col, tuple(value) if isinstance(value, list) else value) for col, value in (filters or {}).items()))
+
+def count_records(df_name, filters):
+    """Returns the number of records matching the filters (cached)."""
+    return cached_view(df_name, 'count', lambda: get_store(df_name).count(**filters), frozen(filters))
+
+def distinct_values(df_name, column):
+    """Returns the distinct values of a column (cached)."""
+    return cached_view(df_name, 'distinct', lambda: get_store(df_name).distinct(column), column)
+
+def company_scope():
+    """Returns the store filters limiting the current user to their own company."""
+    return CrudService.scope(current_actor())
+
+PAGE_SIZES = [25, 50, 100, 500]
+INTERNAL_COLUMNS = [ROW_VERSION, 'product_version']  # Bookkeeping, not shown in tables
+
+@METRICS.timed('ui.paged_table')
+def paged_table(df_name, key, filters, columns=None, empty_message="No records found."):
+    """Shows one page of a table. Filtering, sorting and paging run in the store,
+    so only the rows of the current page are sent to the browser."""
+    store = get_store(df_name)
+    columns = columns or [col for col in store.columns if col not in INTERNAL_COLUMNS]
+    col_filter_col, col_filter_text, col_sort, col_order, col_size = st.columns([2, 3, 2, 1, 1])
+    with col_filter_col:
+        filter_col = st.selectbox("Filter column", columns, key=f"{key}_filter_col")
+    with col_filter_text:
+        filter_text = st.text_input("Contains", key=f"{key}_filter_text").strip()
+    with col_sort:
+        sort_by = st.selectbox("Sort by", [""] + columns, key=f"{key}_sort_by")
+    with col_order:
+        descending = st.checkbox("Desc", key=f"{key}_desc")
+    with col_size:
+        page_size = st.selectbox("Rows", PAGE_SIZES, key=f"{key}_page_size")
+
+    search = {filter_col: filter_text} if filter_text else None
+    page_key = f"{key}_page"
+    page_number = st.session_state.get(page_key, 1)
+    def load_page(page_number):
+        return cached_view(df_name, 'page', lambda: store.page(filters, search, sort_by or None, not descending,
+                                                               offset=(page_number - 1) * page_size, limit=page_size),
+                           frozen(filters), frozen(search), sort_by, descending, page_number, page_size)
+    page_df, total = load_page(page_number)
+    page_count = max(1, -(-total // page_size))
+    if page_number > page_count: # The table shrank or the filter changed, show the last page
+        page_number = page_count
+        page_df, total = load_page(page_number)
+    st.session_state[page_key] = page_number
+    if total == 0:
+        st.info(empty_message if not filter_text else "No records match the filter.")
+        return total
+    with METRICS.span('render.dataframe'):
+        st.dataframe(page_df[columns], use_container_width=True, hide_index=True)
+    col_page, col_info = st.columns([1, 4])
+    with col_page:
+        st.number_input("Page", min_value=1, max_value=page_count, step=1, key=page_key)
+    with col_info:
+        first_row = (page_number - 1) * page_size + 1
+        st.caption(f"Rows {first_row}–{first_row + len(page_df) - 1} of {total}")
+    return total
+
+SEARCH_LIMIT = 50
+
+@METRICS.timed('ui.search_box')
+def search_box(df_name, key, filters, label, columns=None):
+    """Search box over the table's search index (see TABLES), showing the best matches first."""
+    store = get_store(df_name)
+    columns = columns or [col for col in store.columns if col not in INTERNAL_COLUMNS]
+    text = st.text_input(label, key=f"{key}_text").strip()
+    if not text:
+        return
+    matches = cached_view(df_name, 'search', lambda: store.search(text, filters, SEARCH_LIMIT), text, frozen(filters))
+    if matches.empty:
+        st.info("No matches found.")
+        return
+    st.dataframe(matches[columns], use_container_width=True, hide_index=True)
+    st.caption(f"Best {len(matches)} matches" if len(matches) == SEARCH_LIMIT else f"{len(matches)} matches")
+
+PICKER_LIMIT = 50
+
+SEARCH_LABELS = {'users_df': "email", 'products_df': "product name", 'product_requests_df': "request ID"}
+
+def picker_options(df_name, prefix, filters, exclude=None, limit=PICKER_LIMIT):
+    """Returns {record id: label} for the first prefix matches (cached)."""
+    store = get_store(df_name)
+    return cached_view(df_name, 'options', lambda: option_labels(store, df_name, prefix, filters, exclude, limit),
+                       prefix, frozen(filters), frozen(exclude), limit)
+
+@METRICS.timed('ui.record_picker')
+def record_picker(df_name, label, key, filters, exclude=None):
+    """Typeahead picker: a prefix search box plus a selectbox of the first matches.
+    The options are record ids, so records with identical labels cannot be mixed up."""
+    prefix = st.text_input(f"Search by {SEARCH_LABELS[df_name]}", key=f"{key}_search").strip()
+    options = picker_options(df_name, prefix, filters, exclude)
+    selected_id = st.selectbox(label, [""] + list(options), format_func=lambda record_id: options.get(record_id, ""), key=key)
+    if len(options) >= PICKER_LIMIT:
+        st.caption(f"Showing the first {PICKER_LIMIT} matches. Type to narrow them down.")
+    return selected_id or None
+
+def submit_job(kind, payload, label, key=None, job_id=None):
+    """Queues a background job for the current user. Returns its id, or None if the same
+    job (by key) is already queued or running."""
+    job_id = job_id or str(uuid.uuid4())
+    submitted = get_job_executor(STORAGE_BACKEND, SQLITE_PATH).submit(kind, payload, current_actor(), label, key, job_id=job_id)
+    if submitted != job_id:
+        st.info(f"{label} is already in progress, see Jobs in the sidebar.")
+        return None
+    st.success(f"{label} started, see Jobs in the sidebar for its progress.")
+    return job_id
+
+def digest(*parts):
+    """Returns a short fingerprint of the parts, for job keys."""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:16]
+
+@METRICS.timed('ui.bulk_import')
+def bulk_import_ui(df_name, label):
+    """File uploader that bulk-loads a CSV/Parquet file into the specified table, as a background job."""
+    with st.expander(f"📥 Bulk Import {label} (CSV/Parquet)"):
+        uploaded_file = st.file_uploader("File", type=["csv", "parquet"], key=f"bulk_import_{df_name}")
+        if st.button("Import", key=f"bulk_import_{df_name}_button"):
+            if uploaded_file is None:
+                st.warning("Please choose a file to import.")
+                return
+            file_format = 'parquet' if uploaded_file.name.lower().endswith('.parquet') else 'csv'
+            job_id = str(uuid.uuid4())
+            path = job_file(job_id, f".{file_format}")  # The job reads it from disk, also when resumed
+            with open(path, 'wb') as f:
+                f.write(uploaded_file.getbuffer())
+            payload = {'df_name': df_name, 'path': path, 'format': file_format}
+            key = f"import:{df_name}:{hashlib.sha256(uploaded_file.getbuffer()).hexdigest()[:16]}"
+            if submit_job('import', payload, f"Import of {uploaded_file.name}", key, job_id) is None:
+                os.remove(path)
+
+EXPORT_LABELS = {'csv': "CSV", 'parquet': "Parquet", 'arrow': "Arrow IPC"}
+
+@METRICS.timed('ui.export')
+def export_ui(df_name, label, filters, archive_dir=None):
+    """Download button streaming the rows of a table the user may see to CSV, Parquet or Arrow IPC.
+    The file is only generated when the button is clicked, off the script thread."""
+    with st.expander(f"📤 Export {label}"):
+        file_format = st.selectbox("Format", available_formats(), format_func=EXPORT_LABELS.get, key=f"export_{df_name}_format")
+        backend = st.session_state.backend
+        st.download_button(
+            "Download", key=f"export_{df_name}_button", on_click="ignore", mime=EXPORT_FORMATS[file_format],
+            file_name=f"{TABLES[df_name]['table']}-{datetime.now():%Y%m%d}.{file_format}",
+            data=lambda: export_bytes(backend, df_name, file_format, filters, archive_dir=archive_dir),
+        )
 
 
 # --- CRUD UI Functions for Users ---
 
-def user_crud_ui():
-    st.header("👥 User Management")
+def lazy_tabs(key, sections):
+    """Shows sections ({label: render function}) as tabs and runs only the function of the open tab.
+    Switching tabs reruns the page, so the other tabs never build their widgets or options."""
+    tabs = st.tabs(list(sections), key=key, on_change="rerun")
+    for tab, render in zip(tabs, sections.values()):
+        if tab.open:
+            with tab:
+                render()
 
+def add_user_tab():
     current_user_role = st.session_state.user_role
     current_user_company = st.session_state.user_company
 
-    # Filter users based on company and role
-    if current_user_role == "Super Admin":
-        display_df = st.session_state.users_df.copy()
-    else: # Admin can only see users from their company
-        display_df = st.session_state.users_df[st.session_state.users_df['company'] == current_user_company].copy()
-
-    st.subheader("Current Users")
-    if not display_df.empty:
-        st.dataframe(display_df, use_container_width=True)
-    else:
-        st.info("No users found for your company.")
+    st.subheader("Add New User")
+    # Admin cannot create Super Admins or other Admins
+    allowed_roles = allowed_roles_for_creation(current_user_role)
+    
+    # Admin can only create users for their company
+    if current_user_role == "Admin":
+        st.info(f"You can only add users to your company: **{current_user_company}**")
+    
+    with st.form("add_user_form", clear_on_submit=True):
+        name = st.text_input("Name", key="add_user_name")
+        email = st.text_input("Email", key="add_user_email")
+        
+        # Company selection: Super Admin can choose, Admin is fixed
+        if current_user_role == "Super Admin":
+            company = st.selectbox("Company", options=distinct_values('users_df', 'company') + ["New Company"], key="add_user_company")
+            if company == "New Company":
+                company = st.text_input("Enter New Company Name", key="new_company_name").strip()
+        else: # Admin
+            company = current_user_company
+            st.text_input("Company (fixed for your role)", value=company, disabled=True)
+
+        role = st.selectbox("Role", allowed_roles, key="add_user_role")
+        password = st.text_input("Temporary Password", type="password", key="add_user_password")
+        
+        submitted = st.form_submit_button("Add User")
+        if submitted:
+            if name and email and company and role and password:
+                # The service also registers the login credentials
+                if add_record('users_df', {'name': name, 'email': email, 'company': company, 'role': role, 'password': password}):
+                    st.rerun()
+            else:
+                st.warning("Please fill in all fields.")
 
-    st.markdown("---")
+    bulk_import_ui('users_df', "Users")
 
-    # Only Super Admin and Admin can add/update/delete users (with restrictions for Admin)
-    if current_user_role in ["Super Admin", "Admin"]:
-        tab1, tab2, tab3 = st.tabs(["➕ Add User", "✏️ Update User", "🗑️ Delete User"])
-
-        with tab1:
-            st.subheader("Add New User")
-            # Admin cannot create Super Admins or other Admins
-            allowed_roles_for_creation = ["User"]
-            if current_user_role == "Super Admin":
-                allowed_roles_for_creation = ["User", "Admin", "Super Admin"]
-            
-            # Admin can only create users for their company
-            if current_user_role == "Admin":
-                st.info(f"You can only add users to your company: **{current_user_company}**")
-            
-            with st.form("add_user_form", clear_on_submit=True):
-                name = st.text_input("Name", key="add_user_name")
-                email = st.text_input("Email", key="add_user_email")
+def update_user_tab():
+    current_user_role = st.session_state.user_role
+    scope = company_scope()
+
+    st.subheader("Update Existing User")
+    if count_records('users_df', scope) > 0:
+        # Filter selectable users for update: Admin cannot edit other admins/superadmins
+        if current_user_role == "Admin":
+            updatable_users = dict(scope, role="User")
+        else: # Super Admin can update anyone
+            updatable_users = scope
+
+        selected_user_id = record_picker('users_df', "Select User to Update", "update_user_select", updatable_users)
+
+        if selected_user_id:
+            current_user_data = get_store('users_df').get(selected_user_id)
+            row_version = loaded_version("update_user_form", selected_user_id, current_user_data)
+            with st.form("update_user_form"):
+                updated_name = st.text_input("Name", value=current_user_data['name'], key="update_user_name")
+                updated_email = st.text_input("Email", value=current_user_data['email'], key="update_user_email", disabled=True) # Email usually not editable
                 
-                # Company selection: Super Admin can choose, Admin is fixed
+                # Company: Super Admin can change, Admin is fixed
                 if current_user_role == "Super Admin":
-                    company = st.selectbox("Company", options=list(st.session_state.users_df['company'].unique()) + ["New Company"], key="add_user_company")
-                    if company == "New Company":
-                        company = st.text_input("Enter New Company Name", key="new_company_name").strip()
-                else: # Admin
-                    company = current_user_company
-                    st.text_input("Company (fixed for your role)", value=company, disabled=True)
-
-                role = st.selectbox("Role", allowed_roles_for_creation, key="add_user_role")
-                password = st.text_input("Temporary Password", type="password", key="add_user_password")
-                
-                submitted = st.form_submit_button("Add User")
-                if submitted:
-                    if name and email and company and role and password:
-                        if email in HARDCODED_USERS:
-                            st.warning("User with this email already exists.")
-                        else:
-                            # Add to in-memory HARDCODED_USERS for login simulation
-                            HARDCODED_USERS[email] = {"password": password, "role": role, "company": company}
-                            add_record('users_df', {'name': name, 'email': email, 'company': company, 'role': role})
-                            st.experimental_rerun()
-                    else:
-                        st.warning("Please fill in all fields.")
-
-        with tab2:
-            st.subheader("Update Existing User")
-            if not display_df.empty:
-                # Filter selectable users for update: Admin cannot edit other admins/superadmins
-                if current_user_role == "Admin":
-                    updatable_users = display_df[~display_df['role'].isin(["Admin", "Super Admin"])]
-                else: # Super Admin can update anyone
-                    updatable_users = display_df
-
-                user_options = updatable_users.apply(lambda row: f"{row['name']} ({row['email']})", axis=1).tolist()
-                user_ids_map = {f"{row['name']} ({row['email']})": row['id'] for _, row in updatable_users.iterrows()}
-
-                selected_user_option = st.selectbox("Select User to Update", [""] + user_options, key="update_user_select")
-                selected_user_id = user_ids_map.get(selected_user_option)
-
-                if selected_user_id:
-                    current_user_data = st.session_state.users_df[st.session_state.users_df['id'] == selected_user_id].iloc[0]
-                    with st.form("update_user_form"):
-                        updated_name = st.text_input("Name", value=current_user_data['name'], key="update_user_name")
-                        updated_email = st.text_input("Email", value=current_user_data['email'], key="update_user_email", disabled=True) # Email usually not editable
-                        
-                        # Company: Super Admin can change, Admin is fixed
-                        if current_user_role == "Super Admin":
-                            updated_company = st.selectbox("Company", options=list(st.session_state.users_df['company'].unique()), index=list(st.session_state.users_df['company'].unique()).index(current_user_data['company']), key="update_user_company")
-                        else:
-                            updated_company = current_user_data['company']
-                            st.text_input("Company (fixed for your role)", value=updated_company, disabled=True)
-
-                        # Role: Admin cannot change role of other admins/superadmins, and cannot promote to Admin/Super Admin
-                        allowed_roles_for_update = ["User"]
-                        if current_user_role == "Super Admin":
-                            allowed_roles_for_update = ["User", "Admin", "Super Admin"]
-                        elif current_user_role == "Admin" and current_user_data['role'] == "User": # Admin can change their own user's role if it's 'User'
-                             allowed_roles_for_update = ["User"] # Admin can only keep it as User
-
-                        updated_role = st.selectbox("Role", allowed_roles_for_update, index=allowed_roles_for_update.index(current_user_data['role']) if current_user_data['role'] in allowed_roles_for_update else 0, key="update_user_role")
-                        
-                        update_submitted = st.form_submit_button("Update User")
-                        if update_submitted:
-                            updated_data = {
-                                'name': updated_name,
-                                'company': updated_company,
-                                'role': updated_role
-                            }
-                            update_record('users_df', selected_user_id, updated_data)
-                            # Update HARDCODED_USERS as well for login consistency
-                            HARDCODED_USERS[current_user_data['email']]['role'] = updated_role
-                            HARDCODED_USERS[current_user_data['email']]['company'] = updated_company
-                            st.experimental_rerun()
+                    updated_company = st.selectbox("Company", options=distinct_values('users_df', 'company'), index=distinct_values('users_df', 'company').index(current_user_data['company']), key="update_user_company")
                 else:
-                    st.info("No user selected to update.")
-            else:
-                st.info("No users to update.")
-
-        with tab3:
-            st.subheader("Delete User")
-            if not display_df.empty:
-                # Filter selectable users for deletion: Admin cannot delete other admins/superadmins
-                if current_user_role == "Admin":
-                    deletable_users = display_df[~display_df['role'].isin(["Admin", "Super Admin"])]
-                else: # Super Admin can delete anyone except themselves
-                    deletable_users = display_df[display_df['email'] != st.session_state.current_user] # Cannot delete self
-
-                user_options = deletable_users.apply(lambda row: f"{row['name']} ({row['email']})", axis=1).tolist()
-                user_ids_map = {f"{row['name']} ({row['email']})": row['id'] for _, row in deletable_users.iterrows()}
-
-                selected_user_option_delete = st.selectbox("Select User to Delete", [""] + user_options, key="delete_user_select")
-                selected_user_id_delete = user_ids_map.get(selected_user_option_delete)
-
-                if st.button("Delete User", key="delete_user_button"):
-                    if selected_user_id_delete:
-                        # Find the email of the user to delete
-                        email_to_delete = st.session_state.users_df[st.session_state.users_df['id'] == selected_user_id_delete]['email'].iloc[0]
-                        
-                        delete_record('users_df', selected_user_id_delete)
-                        # Remove from HARDCODED_USERS as well
-                        if email_to_delete in HARDCODED_USERS:
-                            del HARDCODED_USERS[email_to_delete]
-                        st.experimental_rerun()
-                    else:
-                        st.warning("Please select a user to delete.")
+                    updated_company = current_user_data['company']
+                    st.text_input("Company (fixed for your role)", value=updated_company, disabled=True)
+
+                # Role: Admin cannot change role of other admins/superadmins, and cannot promote to Admin/Super Admin
+                allowed_roles_for_update = ["User"]
+                if current_user_role == "Super Admin":
+                    allowed_roles_for_update = ["User", "Admin", "Super Admin"]
+                elif current_user_role == "Admin" and current_user_data['role'] == "User": # Admin can change their own user's role if it's 'User'
+                     allowed_roles_for_update = ["User"] # Admin can only keep it as User
+
+                updated_role = st.selectbox("Role", allowed_roles_for_update, index=allowed_roles_for_update.index(current_user_data['role']) if current_user_data['role'] in allowed_roles_for_update else 0, key="update_user_role")
+                
+                update_submitted = st.form_submit_button("Update User")
+                if update_submitted:
+                    updated_data = {
+                        'name': updated_name,
+                        'company': updated_company,
+                        'role': updated_role,
+                        ROW_VERSION: row_version
+                    }
+                    saved = update_record('users_df', selected_user_id, updated_data) # Credentials follow along
+                    del st.session_state["update_user_form_loaded"] # The next submit builds on the current version
+                    if saved:
+                        st.rerun()
+        else:
+            st.info("No user selected to update.")
+    else:
+        st.info("No users to update.")
+
+def delete_user_tab():
+    scope = company_scope()
+
+    st.subheader("Delete User")
+    if count_records('users_df', scope) > 0:
+        # Filter selectable users for deletion: Admin cannot delete other admins/superadmins
+        if st.session_state.user_role == "Admin":
+            selected_user_id_delete = record_picker('users_df', "Select User to Delete", "delete_user_select",
+                                                    dict(scope, role="User"))
+        else: # Super Admin can delete anyone except themselves
+            selected_user_id_delete = record_picker('users_df', "Select User to Delete", "delete_user_select",
+                                                    scope, exclude={'email': st.session_state.current_user}) # Cannot delete self
+
+        if st.button("Delete User", key="delete_user_button"):
+            if selected_user_id_delete:
+                if delete_record('users_df', selected_user_id_delete): # Credentials are removed as well
+                    st.rerun()
             else:
-                st.info("No users to delete.")
+                st.warning("Please select a user to delete.")
+    else:
+        st.info("No users to delete.")
+
+@METRICS.timed('ui.users')
+def user_crud_ui():
+    st.header("👥 User Management")
+
+    st.subheader("Current Users")
+    # Admin can only see users from their company
+    search_box('users_df', "users_search", company_scope(), "🔍 Search users by name or email")
+    paged_table('users_df', "users_table", company_scope(), empty_message="No users found for your company.")
+    if st.session_state.user_role in ["Super Admin", "Admin"]:
+        export_ui('users_df', "Users", company_scope())
+
+    st.markdown("---")
+
+    # Only Super Admin and Admin can add/update/delete users (with restrictions for Admin)
+    if st.session_state.user_role in ["Super Admin", "Admin"]:
+        lazy_tabs("user_tabs", {"➕ Add User": add_user_tab, "✏️ Update User": update_user_tab, "🗑️ Delete User": delete_user_tab})
     else:
         st.warning("You do not have permission to manage users.")
 
 
 # --- CRUD UI Functions for Products ---
 
-def product_crud_ui():
-    st.header("📦 Product Management")
-
+def add_product_tab():
     current_user_role = st.session_state.user_role
     current_user_company = st.session_state.user_company
 
-    # Filter products based on company
-    if current_user_role == "Super Admin":
-        display_df = st.session_state.products_df.copy()
-    else: # Admin/User can only see products from their company
-        display_df = st.session_state.products_df[st.session_state.products_df['company'] == current_user_company].copy()
+    st.subheader("Add New Product")
+    with st.form("add_product_form", clear_on_submit=True):
+        product_name = st.text_input("Product Name", key="add_product_name")
+        price = st.number_input("Price", min_value=0.01, format="%.2f", key="add_product_price")
+        stock = st.number_input("Stock", min_value=0, step=1, key="add_product_stock")
+        
+        if current_user_role == "Super Admin":
+            company = st.selectbox("Company", options=distinct_values('products_df', 'company') + ["New Company"], key="add_product_company")
+            if company == "New Company":
+                company = st.text_input("Enter New Company Name for Product", key="new_product_company_name").strip()
+        else: # Admin
+            company = current_user_company
+            st.text_input("Company (fixed for your role)", value=company, disabled=True)
+
+        submitted = st.form_submit_button("Add Product")
+        if submitted:
+            if product_name and price is not None and stock is not None and company:
+                if add_record('products_df', {'product_name': product_name, 'price': price, 'stock': stock, 'company': company}):
+                    st.rerun()
+            else:
+                st.warning("Please fill in all fields.")
 
-    st.subheader("Current Products")
-    if not display_df.empty:
-        st.dataframe(display_df, use_container_width=True)
-    else:
-        st.info("No products found for your company.")
+    bulk_import_ui('products_df', "Products")
 
-    st.markdown("---")
-
-    # Tabs depending on role
-    if current_user_role in ["Super Admin", "Admin"]:
-        tab1, tab2, tab3 = st.tabs(["➕ Add Product", "✏️ Update Product", "🗑️ Delete Product"])
-    else: # User role can only propose changes
-        tab1, tab2 = st.tabs(["✏️ Propose Product Update", "🗑️ Propose Product Deletion"])
+def update_product_tab():
+    current_user_role = st.session_state.user_role
+    scope = company_scope() # Admin/User can only see products from their company
 
+    st.subheader("Update Existing Product" if current_user_role in ["Super Admin", "Admin"] else "Propose Product Update")
+    if count_records('products_df', scope) > 0:
+        selected_product_id = record_picker('products_df', "Select Product to Update", "update_product_select", scope)
 
-    # --- Add Product (Admin/Super Admin only) ---
-    if current_user_role in ["Super Admin", "Admin"]:
-        with tab1: # Add Product Tab
-            st.subheader("Add New Product")
-            with st.form("add_product_form", clear_on_submit=True):
-                product_name = st.text_input("Product Name", key="add_product_name")
-                price = st.number_input("Price", min_value=0.01, format="%.2f", key="add_product_price")
-                stock = st.number_input("Stock", min_value=0, step=1, key="add_product_stock")
+        if selected_product_id:
+            current_product_data = get_store('products_df').get(selected_product_id)
+            row_version = loaded_version("update_product_form", selected_product_id, current_product_data)
+            
+            with st.form("update_product_form"):
+                updated_product_name = st.text_input("Product Name", value=current_product_data['product_name'], key="update_product_name")
+                updated_price = st.number_input("Price", min_value=0.01, format="%.2f", value=current_product_data['price'], key="update_product_price")
+                updated_stock = st.number_input("Stock", min_value=0, step=1, value=current_product_data['stock'], key="update_product_stock")
                 
                 if current_user_role == "Super Admin":
-                    company = st.selectbox("Company", options=list(st.session_state.products_df['company'].unique()) + ["New Company"], key="add_product_company")
-                    if company == "New Company":
-                        company = st.text_input("Enter New Company Name for Product", key="new_product_company_name").strip()
-                else: # Admin
-                    company = current_user_company
-                    st.text_input("Company (fixed for your role)", value=company, disabled=True)
-
-                submitted = st.form_submit_button("Add Product")
-                if submitted:
-                    if product_name and price is not None and stock is not None and company:
-                        add_record('products_df', {'product_name': product_name, 'price': price, 'stock': stock, 'company': company})
-                        st.experimental_rerun()
-                    else:
-                        st.warning("Please fill in all fields.")
+                    updated_company = st.selectbox("Company", options=distinct_values('products_df', 'company'), index=distinct_values('products_df', 'company').index(current_product_data['company']), key="update_product_company")
+                else:
+                    updated_company = current_product_data['company']
+                    st.text_input("Company (fixed for your role)", value=updated_company, disabled=True)
+                
+                if current_user_role in ["Super Admin", "Admin"]:
+                    update_submitted = st.form_submit_button("Update Product")
+                    if update_submitted:
+                        updated_data = {
+                            'product_name': updated_product_name,
+                            'price': updated_price,
+                            'stock': updated_stock,
+                            'company': updated_company,
+                            ROW_VERSION: row_version
+                        }
+                        saved = update_record('products_df', selected_product_id, updated_data)
+                        del st.session_state["update_product_form_loaded"] # The next submit builds on the current version
+                        if saved:
+                            st.rerun()
+                else: # User proposes update
+                    propose_update_submitted = st.form_submit_button("Propose Update")
+                    if propose_update_submitted:
+                        new_data = {
+                            'product_name': updated_product_name,
+                            'price': updated_price,
+                            'stock': updated_stock
+                        }
+                        # Only the changed fields are stored in the request
+                        if propose_change(selected_product_id, 'Update', new_data):
+                            st.rerun()
+        else:
+            st.info("No product selected to update.")
+    else:
+        st.info("No products to update.")
 
-    # --- Update/Propose Update Product ---
-    update_tab_index = 1 if current_user_role in ["Super Admin", "Admin"] else 0
-    with st.tabs([""] * 3 if current_user_role in ["Super Admin", "Admin"] else [""] * 2)[update_tab_index]: # Access the correct tab
-        st.subheader("Update Existing Product" if current_user_role in ["Super Admin", "Admin"] else "Propose Product Update")
-        if not display_df.empty:
-            product_options = display_df.apply(lambda row: f"{row['product_name']} (ID: {row['id'][-4:]})", axis=1).tolist()
-            product_ids_map = {f"{row['product_name']} (ID: {row['id'][-4:]})": row['id'] for _, row in display_df.iterrows()}
+def delete_product_tab():
+    current_user_role = st.session_state.user_role
+    scope = company_scope()
 
-            selected_product_option = st.selectbox("Select Product to Update", [""] + product_options, key="update_product_select")
-            selected_product_id = product_ids_map.get(selected_product_option)
+    st.subheader("Delete Product" if current_user_role in ["Super Admin", "Admin"] else "Propose Product Deletion")
+    if count_records('products_df', scope) > 0:
+        selected_product_id_delete = record_picker('products_df', "Select Product to Delete", "delete_product_select", scope)
 
-            if selected_product_id:
-                current_product_data = st.session_state.products_df[st.session_state.products_df['id'] == selected_product_id].iloc[0]
-                
-                with st.form("update_product_form"):
-                    updated_product_name = st.text_input("Product Name", value=current_product_data['product_name'], key="update_product_name")
-                    updated_price = st.number_input("Price", min_value=0.01, format="%.2f", value=current_product_data['price'], key="update_product_price")
-                    updated_stock = st.number_input("Stock", min_value=0, step=1, value=current_product_data['stock'], key="update_product_stock")
-                    
-                    if current_user_role == "Super Admin":
-                        updated_company = st.selectbox("Company", options=list(st.session_state.products_df['company'].unique()), index=list(st.session_state.products_df['company'].unique()).index(current_product_data['company']), key="update_product_company")
-                    else:
-                        updated_company = current_product_data['company']
-                        st.text_input("Company (fixed for your role)", value=updated_company, disabled=True)
-                    
-                    if current_user_role in ["Super Admin", "Admin"]:
-                        update_submitted = st.form_submit_button("Update Product")
-                        if update_submitted:
-                            updated_data = {
-                                'product_name': updated_product_name,
-                                'price': updated_price,
-                                'stock': updated_stock,
-                                'company': updated_company
-                            }
-                            update_record('products_df', selected_product_id, updated_data)
-                            st.experimental_rerun()
-                    else: # User proposes update
-                        propose_update_submitted = st.form_submit_button("Propose Update")
-                        if propose_update_submitted:
-                            old_data = current_product_data.to_dict()
-                            new_data = {
-                                'product_name': updated_product_name,
-                                'price': updated_price,
-                                'stock': updated_stock,
-                                'company': updated_company # Should be same as old data company
-                            }
-                            # Check if actual changes were made
-                            if old_data['product_name'] == new_data['product_name'] and \
-                               old_data['price'] == new_data['price'] and \
-                               old_data['stock'] == new_data['stock']:
-                                st.warning("No changes detected to propose.")
-                            else:
-                                st.session_state.product_requests_df.loc[len(st.session_state.product_requests_df)] = {
-                                    'request_id': str(uuid.uuid4()),
-                                    'product_id': selected_product_id,
-                                    'request_type': 'Update',
-                                    'old_data': old_data,
-                                    'new_data': new_data,
-                                    'requested_by_email': st.session_state.current_user,
-                                    'status': 'Pending',
-                                    'admin_notes': '',
-                                    'request_date': datetime.now().isoformat(),
-                                    'approval_date': ''
-                                }
-                                st.success("Product update request submitted for approval!")
-                                st.experimental_rerun()
-            else:
-                st.info("No product selected to update.")
-        else:
-            st.info("No products to update.")
-
-    # --- Delete/Propose Delete Product ---
-    delete_tab_index = 2 if current_user_role in ["Super Admin", "Admin"] else 1
-    with st.tabs([""] * 3 if current_user_role in ["Super Admin", "Admin"] else [""] * 2)[delete_tab_index]:
-        st.subheader("Delete Product" if current_user_role in ["Super Admin", "Admin"] else "Propose Product Deletion")
-        if not display_df.empty:
-            product_options_delete = display_df.apply(lambda row: f"{row['product_name']} (ID: {row['id'][-4:]})", axis=1).tolist()
-            product_ids_map_delete = {f"{row['product_name']} (ID: {row['id'][-4:]})": row['id'] for _, row in display_df.iterrows()}
-
-            selected_product_option_delete = st.selectbox("Select Product to Delete", [""] + product_options_delete, key="delete_product_select")
-            selected_product_id_delete = product_ids_map_delete.get(selected_product_option_delete)
-
-            if current_user_role in ["Super Admin", "Admin"]:
-                if st.button("Delete Product", key="delete_product_button"):
-                    if selected_product_id_delete:
-                        delete_record('products_df', selected_product_id_delete)
-                        st.experimental_rerun()
-                    else:
-                        st.warning("Please select a product to delete.")
-            else: # User proposes delete
-                if st.button("Propose Deletion", key="propose_delete_button"):
-                    if selected_product_id_delete:
-                        # Ensure the product exists before proposing deletion
-                        if selected_product_id_delete in st.session_state.products_df['id'].values:
-                            product_to_delete_data = st.session_state.products_df[st.session_state.products_df['id'] == selected_product_id_delete].iloc[0].to_dict()
-                            st.session_state.product_requests_df.loc[len(st.session_state.product_requests_df)] = {
-                                'request_id': str(uuid.uuid4()),
-                                'product_id': selected_product_id_delete,
-                                'request_type': 'Delete',
-                                'old_data': product_to_delete_data,
-                                'new_data': {}, # No new data for delete
-                                'requested_by_email': st.session_state.current_user,
-                                'status': 'Pending',
-                                'admin_notes': '',
-                                'request_date': datetime.now().isoformat(),
-                                'approval_date': ''
-                            }
-                            st.success("Product deletion request submitted for approval!")
-                            st.experimental_rerun()
-                        else:
-                            st.error("Selected product not found.")
-                    else:
-                        st.warning("Please select a product to propose deletion.")
-        else:
-            st.info("No products to delete.")
+        if current_user_role in ["Super Admin", "Admin"]:
+            if st.button("Delete Product", key="delete_product_button"):
+                if selected_product_id_delete:
+                    if delete_record('products_df', selected_product_id_delete):
+                        st.rerun()
+                else:
+                    st.warning("Please select a product to delete.")
+        else: # User proposes delete
+            if st.button("Propose Deletion", key="propose_delete_button"):
+                if selected_product_id_delete:
+                    if propose_change(selected_product_id_delete, 'Delete'): # No new data for delete
+                        st.rerun()
+                else:
+                    st.warning("Please select a product to propose deletion.")
+    else:
+        st.info("No products to delete.")
+
+@METRICS.timed('ui.products')
+def product_crud_ui():
+    st.header("📦 Product Management")
+
+    st.subheader("Current Products")
+    search_box('products_df', "products_search", company_scope(), "🔍 Search products by name")
+    paged_table('products_df', "products_table", company_scope(), empty_message="No products found for your company.")
+    if st.session_state.user_role in ["Super Admin", "Admin"]:
+        export_ui('products_df', "Products", company_scope())
+
+    st.markdown("---")
+
+    # Tabs depending on role, one set for the page
+    if st.session_state.user_role in ["Super Admin", "Admin"]:
+        lazy_tabs("product_tabs", {"➕ Add Product": add_product_tab, "✏️ Update Product": update_product_tab,
+                                   "🗑️ Delete Product": delete_product_tab})
+    else: # User role can only propose changes
+        lazy_tabs("product_tabs", {"✏️ Propose Product Update": update_product_tab,
+                                   "🗑️ Propose Product Deletion": delete_product_tab})
 
 
 # --- Approval Workflow UI (Admin/Super Admin only) ---
+@METRICS.timed('data.archive_old_requests')
+def archive_old_requests():
+    """Queues moving old resolved requests to the archive, at most once per ARCHIVE_INTERVAL per session.
+    One archive job runs at a time, however many sessions ask for it."""
+    last_run = st.session_state.get('last_archive_run')
+    if last_run and datetime.now() - last_run < ARCHIVE_INTERVAL:
+        return
+    st.session_state.last_archive_run = datetime.now()
+    get_job_executor(STORAGE_BACKEND, SQLITE_PATH).submit(
+        'archive', {'archive_dir': ARCHIVE_DIR, 'after_days': ARCHIVE_AFTER_DAYS},
+        current_actor()._replace(email=None), "Archive of resolved requests", key='archive')  # Not listed in Jobs
+
+@METRICS.timed('ui.archived_requests')
+def archived_requests_ui():
+    """Loads archived requests of the current user's company on demand."""
+    with st.expander("🗄️ Archived Requests"):
+        status = st.selectbox("Status", ["Approved", "Rejected"], key="archive_status")
+        if st.button("Load Archive", key="load_archive_button"):
+            try:
+                archived = query_archive(ARCHIVE_DIR, company_scope().get('company'), status=status)
+            except ImportError:
+                st.error("Reading the archive requires pyarrow.")
+                return
+            if archived.empty:
+                st.info("No archived requests found.")
+            else:
+                st.caption(f"{len(archived)} archived requests (showing up to 1000).")
+                with METRICS.span('render.dataframe'):
+                    st.dataframe(archived.head(1000), use_container_width=True, hide_index=True)
+
+BULK_OPTIONS_LIMIT = 500
+
+@METRICS.timed('ui.bulk_review')
+def bulk_review_ui(pending_scope):
+    """Approves or rejects many pending requests in one batch."""
+    with st.expander("📦 Bulk Review"):
+        store = get_store('product_requests_df')
+        pending_count = count_records('product_requests_df', pending_scope)
+        select_all = st.checkbox(f"Select all {pending_count} pending requests", key="bulk_review_all")
+        if select_all:
+            selected_ids = None
+        else:
+            options = picker_options('product_requests_df', "", pending_scope, limit=BULK_OPTIONS_LIMIT)
+            if pending_count > BULK_OPTIONS_LIMIT:
+                st.caption(f"Showing the first {BULK_OPTIONS_LIMIT} pending requests. Use \"Select all\" for the rest.")
+            selected_ids = st.multiselect("Requests", list(options), format_func=lambda request_id: options.get(request_id, request_id),
+                                          key="bulk_review_select")
+        admin_notes = st.text_area("Admin Notes/Reason (for rejection):", key="bulk_review_notes")
+
+        col_approve, col_reject = st.columns(2)
+        with col_approve:
+            approve = st.button("Approve Selected", key="bulk_approve_button")
+        with col_reject:
+            reject = st.button("Reject Selected", key="bulk_reject_button")
+        if not (approve or reject):
+            return
+        if reject and not admin_notes:
+            st.error("Please provide a reason for rejection.")
+            return
+        if selected_ids is None:
+            selected_ids = store.find(**pending_scope)[store.key].tolist()
+        if not selected_ids:
+            st.warning("Please select at least one request.")
+            return
+        status = 'Approved' if approve else 'Rejected'
+        payload = {'request_ids': selected_ids, 'status': status, 'admin_notes': admin_notes}
+        submit_job('review', payload, f"{'Approval' if approve else 'Rejection'} of {len(selected_ids)} requests",
+                   key=f"review:{digest(sorted(selected_ids), status)}")
+
+@METRICS.timed('ui.approvals')
 def approval_workflow_ui():
     st.header("📝 Product Approval Workflow")
-
-    current_user_role = st.session_state.user_role
-    current_user_company = st.session_state.user_company
+    archive_old_requests()
 
     # Filter requests based on role and company
-    if current_user_role == "Super Admin":
-        pending_requests = st.session_state.product_requests_df[
-            st.session_state.product_requests_df['status'] == 'Pending'
-        ].copy()
-    else: # Admin can only see requests for their company's products
-        # Get product IDs associated with the admin's company
-        company_product_ids = st.session_state.products_df[
-            st.session_state.products_df['company'] == current_user_company
-        ]['id'].tolist()
-        
-        pending_requests = st.session_state.product_requests_df[
-            (st.session_state.product_requests_df['status'] == 'Pending') &
-            (st.session_state.product_requests_df['product_id'].isin(company_product_ids))
-        ].copy()
+    # Admin can only see requests for their company's products
+    pending_scope = dict(company_scope(), status='Pending')
 
-
-    if not pending_requests.empty:
+    if count_records('product_requests_df', pending_scope) > 0:
         st.subheader("Pending Product Requests")
-        st.dataframe(pending_requests[['request_id', 'product_id', 'request_type', 'requested_by_email', 'request_date']], use_container_width=True)
+        request_columns = ['request_id', 'product_id', 'request_type', 'requested_by_email', 'request_date']
+        search_box('product_requests_df', "pending_requests_search", pending_scope,
+                   "🔍 Search pending requests by requester email", columns=request_columns)
+        paged_table('product_requests_df', "pending_requests_table", pending_scope, columns=request_columns)
 
-        st.markdown("---")
+        bulk_review_ui(pending_scope)
 
-        request_options = pending_requests.apply(lambda row: f"{row['request_type']} for {row['product_id'][-4:]} by {row['requested_by_email']}", axis=1).tolist()
-        request_ids_map = {opt: req_id for opt, req_id in zip(request_options, pending_requests['request_id'].tolist())}
+        st.markdown("---")
 
-        selected_request_option = st.selectbox("Select Request to Review", [""] + request_options, key="select_request_to_review")
-        selected_request_id = request_ids_map.get(selected_request_option)
+        selected_request_id = record_picker('product_requests_df', "Select Request to Review", "select_request_to_review", pending_scope)
 
         if selected_request_id:
-            request_data = pending_requests[pending_requests['request_id'] == selected_request_id].iloc[0]
+            request_data = get_store('product_requests_df').get(selected_request_id)
             st.subheader(f"Review Request: {request_data['request_type']} - Product ID: {request_data['product_id'][-4:]}")
             st.write(f"**Requested by:** {request_data['requested_by_email']}")
             st.write(f"**Request Date:** {datetime.fromisoformat(request_data['request_date']).strftime('%Y-%m-%d %H:%M:%S')}")
             st.write(f"**Request Type:** {request_data['request_type']}")
 
+            old_data, new_data = request_changes(request_data)
             if request_data['request_type'] == 'Update':
                 st.write("**Old Data:**")
-                st.json(request_data['old_data'])
+                st.json(old_data)
                 st.write("**New Data Proposed:**")
-                st.json(request_data['new_data'])
+                st.json(new_data)
             elif request_data['request_type'] == 'Delete':
                 st.write("**Product to be deleted (Old Data):**")
-                st.json(request_data['old_data'])
+                st.json(old_data)
 
             admin_notes = st.text_area("Admin Notes/Reason (for rejection):", key="admin_approval_notes")
 
             col_approve, col_reject = st.columns(2)
             with col_approve:
                 if st.button("Approve Request", key="approve_request_button"):
-                    if request_data['request_type'] == 'Update':
-                        update_record('products_df', request_data['product_id'], request_data['new_data'])
-                    elif request_data['request_type'] == 'Delete':
-                        delete_record('products_df', request_data['product_id'])
-                    
-                    # Update request status
-                    req_idx = st.session_state.product_requests_df[st.session_state.product_requests_df['request_id'] == selected_request_id].index[0]
-                    st.session_state.product_requests_df.at[req_idx, 'status'] = 'Approved'
-                    st.session_state.product_requests_df.at[req_idx, 'admin_notes'] = admin_notes
-                    st.session_state.product_requests_df.at[req_idx, 'approval_date'] = datetime.now().isoformat()
-                    st.success("Request Approved and Product Data Updated!")
-                    st.experimental_rerun()
+                    # Applies the change and resolves the request together
+                    resolved, conflicts = crud_service().resolve(current_actor(), [selected_request_id], 'Approved', admin_notes)
+                    if not resolved and (conflicts['reason'] == PRODUCT_CHANGED).any():
+                        show_current('products_df', request_data['product_id'],
+                                     "Not approved: the product was changed after this request was made. "
+                                     "Its current values are shown below, reject the request if it no longer applies.")
+                    elif report(resolved, conflicts, "Request Approved and Product Data Updated!"):
+                        st.rerun()
             with col_reject:
                 if st.button("Reject Request", key="reject_request_button"):
                     if admin_notes:
-                        req_idx = st.session_state.product_requests_df[st.session_state.product_requests_df['request_id'] == selected_request_id].index[0]
-                        st.session_state.product_requests_df.at[req_idx, 'status'] = 'Rejected'
-                        st.session_state.product_requests_df.at[req_idx, 'admin_notes'] = admin_notes
-                        st.session_state.product_requests_df.at[req_idx, 'approval_date'] = datetime.now().isoformat()
-                        st.warning("Request Rejected!")
-                        st.experimental_rerun()
+                        resolved, _ = crud_service().resolve(current_actor(), [selected_request_id], 'Rejected', admin_notes)
+                        if resolved:
+                            st.warning("Request Rejected!")
+                            st.rerun()
                     else:
                         st.error("Please provide a reason for rejection.")
         else:
@@ -518,56 +791,183 @@ def approval_workflow_ui():
     else:
         st.info("No pending product requests for your company.")
 
+    archived_requests_ui()
+    export_ui('product_requests_df', "Request History (incl. archive)", company_scope(), archive_dir=ARCHIVE_DIR)
+
+# --- Analytics UI (Admin/Super Admin only) ---
+@METRICS.timed('ui.analytics')
+def analytics_ui():
+    st.header("📊 Analytics")
+    for df_name in ('products_df', 'product_requests_df'):
+        get_store(df_name).refresh()  # Brings in other processes' writes, which update the aggregates
+    aggregates = get_company_aggregates(STORAGE_BACKEND, SQLITE_PATH).snapshot(company_scope().get('company'))
+    if aggregates.empty:
+        st.info("No products or requests for your company yet.")
+        return
+    if st.session_state.user_role != "Super Admin":
+        row = aggregates.iloc[0]
+        col_products, col_stock, col_value = st.columns(3)
+        col_products.metric("Products", f"{row['products']:,}")
+        col_stock.metric("Total Stock", f"{row['total_stock']:,}")
+        col_value.metric("Inventory Value", f"{row['inventory_value']:,.2f}")
+        col_pending, col_resolved, col_latency = st.columns(3)
+        col_pending.metric("Pending Requests", f"{row['pending_requests']:,}")
+        col_resolved.metric("Resolved Requests", f"{row['resolved_requests']:,}")
+        col_latency.metric("Avg. Approval Time", "–" if pd.isna(row['avg_approval_hours']) else f"{row['avg_approval_hours']:.1f} h")
+        return
+    # Super Admin: all companies
+    st.dataframe(aggregates, use_container_width=True, hide_index=True)
+    st.subheader("Inventory Value by Company")
+    st.bar_chart(aggregates.set_index('company')['inventory_value'])
+
+# --- Jobs Panel ---
+JOB_POLL_SECONDS = 2
+JOBS_SHOWN = 5
+JOB_ICONS = {QUEUED: "⏳", RUNNING: "⚙️", DONE: "✅", FAILED: "❌"}
+
+def read_file(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+def job_status(job, executor):
+    st.markdown(f"{JOB_ICONS[job['state']]} **{job['label']}**")
+    if job['state'] in ACTIVE_STATES:
+        total = job['total']
+        if total:
+            st.progress(min(job['done'] / total, 1.0), text=f"{job['done']:,} / {total:,}")
+        else:
+            st.caption(job['state'].capitalize())
+    elif job['state'] == DONE:
+        st.caption(job['result']['message'])
+        report = job['result'].get('report')
+        if report and os.path.exists(report):
+            st.download_button("Download report", data=lambda: read_file(report), file_name=os.path.basename(report),
+                               mime="text/csv", on_click="ignore", key=f"job_report_{job['id']}")
+    else:
+        st.caption(job['error'])
+        if st.button("Retry", key=f"job_retry_{job['id']}"):
+            executor.retry(job['id'])
+            st.rerun()
+
+def jobs_panel():
+    """The user's latest background jobs. While any is active, only this panel reruns, every
+    JOB_POLL_SECONDS; the whole page reruns when one finishes, so the views show its writes."""
+    executor = get_job_executor(STORAGE_BACKEND, SQLITE_PATH)
+
+    def render():
+        jobs = executor.jobs.recent(owner=st.session_state.current_user, limit=JOBS_SHOWN)
+        active = {job['id'] for job in jobs if job['state'] in ACTIVE_STATES}
+        if st.session_state.get('active_jobs', set()) - active:
+            st.session_state.active_jobs = active
+            st.rerun(scope="app")
+        st.session_state.active_jobs = active
+        if not jobs:
+            return
+        st.markdown("---")
+        st.subheader("Jobs")
+        for job in jobs:
+            job_status(job, executor)
+
+    polling = any(job['state'] in ACTIVE_STATES for job in executor.jobs.recent(owner=st.session_state.current_user, limit=JOBS_SHOWN))
+    st.fragment(render, run_every=JOB_POLL_SECONDS if polling else None)()
+
+# --- Performance Panel (Super Admin only) ---
+def is_profiling():
+    """True if the Super Admin switched on profiling (read before the rerun's work starts)."""
+    return st.session_state.logged_in and st.session_state.user_role == "Super Admin" and st.session_state.get('profile_rerun', False)
+
+def metrics_panel(profile_report):
+    """Sidebar panel with the span histograms of this server process and the cProfile switch."""
+    with st.sidebar.expander("⏱️ Performance"):
+        st.checkbox("Profile this rerun (cProfile)", key="profile_rerun")
+        if st.session_state.get('profile_rerun') and profile_report.get('text'):
+            st.code(profile_report['text'])
+        summary = METRICS.summary()
+        if not METRICS.enabled:
+            st.info("Timing is disabled (CRUD_METRICS=0).")
+        elif summary.empty:
+            st.caption("No timings recorded yet.")
+        else:
+            st.dataframe(summary, use_container_width=True, hide_index=True)
+            span = st.selectbox("Histogram", summary['span'], key="metrics_span")
+            st.bar_chart(METRICS.histogram(span))
+        col_download, col_reset = st.columns(2)
+        with col_download:
+            st.download_button("Prometheus", METRICS.prometheus_text(), file_name="crud_metrics.prom", key="metrics_download")
+        with col_reset:
+            if st.button("Reset", key="metrics_reset"):
+                METRICS.reset()
+                st.rerun()
+        if METRICS_EXPORT:
+            st.caption(f"Exported to {METRICS_EXPORT} every {METRICS_EXPORT_INTERVAL}s.")
+
 # --- Main App Logic ---
 
 st.set_page_config(layout="wide", page_title="Advanced Multi-Entity CRUD App")
 
 st.title("🛡️ Secure Multi-Entity CRUD App with RBAC")
 
-# --- Login/Logout UI ---
-if not st.session_state.logged_in:
-    st.sidebar.header("Login")
-    with st.sidebar.form("login_form"):
-        email = st.text_input("Email")
-        password = st.text_input("Password", type="password")
-        login_button = st.form_submit_button("Login")
-        if login_button:
-            authenticate(email, password)
-    st.info("Please log in to access the application.")
-else:
-    st.sidebar.write(f"Logged in as: **{st.session_state.current_user}**")
-    st.sidebar.write(f"Role: **{st.session_state.user_role}**")
-    st.sidebar.write(f"Company: **{st.session_state.user_company}**")
-    if st.sidebar.button("Logout"):
-        logout()
-
-    st.sidebar.markdown("---")
-
-    # --- Main Application Menus (after login) ---
-    menu_options = []
-    if st.session_state.user_role in ["Super Admin", "Admin"]:
-        menu_options.append("Users")
-    menu_options.append("Products")
-    if st.session_state.user_role in ["Super Admin", "Admin"]:
-        menu_options.append("Product Approvals")
-
-    if menu_options:
-        menu_selection = st.sidebar.radio(
-            "Select Entity",
-            menu_options
-        )
-
-        if menu_selection == "Users":
-            user_crud_ui()
-        elif menu_selection == "Products":
-            product_crud_ui()
-        elif menu_selection == "Product Approvals":
-            approval_workflow_ui()
+profile_report = {}
+with METRICS.span('rerun'), profiled(is_profiling(), profile_report): # Everything below the page setup
+    # --- Login/Logout UI ---
+    check_session()
+    if not st.session_state.logged_in:
+        st.sidebar.header("Login")
+        with st.sidebar.form("login_form"):
+            email = st.text_input("Email")
+            password = st.text_input("Password", type="password")
+            login_button = st.form_submit_button("Login")
+            if login_button:
+                authenticate(email, password)
+        st.info("Please log in to access the application.")
     else:
-        st.warning("You do not have access to any modules. Please contact your administrator.")
+        st.sidebar.write(f"Logged in as: **{st.session_state.current_user}**")
+        st.sidebar.write(f"Role: **{st.session_state.user_role}**")
+        st.sidebar.write(f"Company: **{st.session_state.user_company}**")
+        if st.sidebar.button("Logout"):
+            logout()
+
+        st.sidebar.markdown("---")
+
+        # --- Main Application Menus (after login) ---
+        menu_options = []
+        if st.session_state.user_role in ["Super Admin", "Admin"]:
+            menu_options.append("Users")
+        menu_options.append("Products")
+        if st.session_state.user_role in ["Super Admin", "Admin"]:
+            menu_options.append("Product Approvals")
+            menu_options.append("Analytics")
+
+        if menu_options:
+            menu_selection = st.sidebar.radio(
+                "Select Entity",
+                menu_options
+            )
+
+            if menu_selection == "Users":
+                user_crud_ui()
+            elif menu_selection == "Products":
+                product_crud_ui()
+            elif menu_selection == "Product Approvals":
+                approval_workflow_ui()
+            elif menu_selection == "Analytics":
+                analytics_ui()
+        else:
+            st.warning("You do not have access to any modules. Please contact your administrator.")
+        with st.sidebar:
+            jobs_panel()
+
+if st.session_state.logged_in and st.session_state.user_role == "Super Admin":
+    metrics_panel(profile_report)
+if METRICS_EXPORT:
+    METRICS.export_if_due(METRICS_EXPORT, METRICS_EXPORT_INTERVAL)
 
 st.sidebar.markdown("---")
-st.sidebar.info("This is an in-memory CRUD app. Data will reset on page refresh or app restart.")
+if st.session_state.backend.persistent:
+    shared = " shared by all server processes" if STORAGE_BACKEND == 'multiprocess' else ""
+    st.sidebar.info(f"Data is stored in SQLite ({SQLITE_PATH}){shared} and kept across restarts.")
+else:
+    st.sidebar.info("This is an in-memory CRUD app shared by all sessions. Data will reset on app restart.")
 st.sidebar.markdown("---")
 st.sidebar.subheader("Test Accounts:")
 st.sidebar.markdown("""
@@ -0,0 +1,131 @@
+import argparse
+import io
+import os
+from contextlib import nullcontext
+from datetime import datetime
+
+from archive import DEFAULT_ARCHIVE_DIR, iter_archive
+from service import Actor, CrudService
+from store import CHUNKSIZE, TABLES, open_backend
+
+# --- Streaming Export ---
+# Writes a table, scoped to a company like the UI views, to CSV, Parquet or
+# Arrow IPC. Rows are read from the store and written in bounded chunks, so
+# memory stays flat however many rows a company has. Product request exports
+# can include the Parquet archive, which is read batch by batch as well.
+# Parquet and Arrow IPC need pyarrow (an optional dependency).
+#
+#   python export.py products_df products.parquet --role Admin --company "Company A"
+#   python export.py product_requests_df requests.csv --company "Company A" --archive-dir archive
+
+EXPORT_FORMATS = {  # format -> MIME type
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+    'arrow': 'application/vnd.apache.arrow.file',
+}
+EXTENSIONS = {'.csv': 'csv', '.parquet': 'parquet', '.arrow': 'arrow', '.feather': 'arrow', '.ipc': 'arrow'}
+ARROW_TYPES = {'float64': 'float64', 'int32': 'int32', 'Int32': 'int32', 'int64': 'int64', 'Int64': 'int64'}  # Else string
+
+
+def available_formats():
+    """Returns the export formats that can be written here (Parquet and Arrow IPC need pyarrow)."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return ['csv']
+    return list(EXPORT_FORMATS)
+
+
+def format_of(path):
+    """Returns the export format for a file name, by extension."""
+    file_format = EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if file_format is None:
+        raise ValueError(f"Unknown export format for {path}, use one of {', '.join(EXTENSIONS)}")
+    return file_format
+
+
+def arrow_schema(pa, df_name):
+    """Fixed Arrow schema of a table, so that chunks with all-empty columns do not change it."""
+    dtypes = TABLES[df_name].get('dtypes', {})
+    return pa.schema([(col, getattr(pa, ARROW_TYPES.get(dtypes.get(col), 'string'))())
+                      for col in TABLES[df_name]['columns']])
+
+
+def table_chunks(backend, df_name, filters=None, chunksize=CHUNKSIZE, archive_dir=None):
+    """Yields the rows of a table matching the filters in chunks, followed by the archived
+    requests of the same company when exporting product requests with an archive_dir."""
+    filters = filters or {}
+    yield from backend.table(df_name).iter_chunks(filters, chunksize)
+    if archive_dir and df_name == 'product_requests_df':
+        yield from iter_archive(archive_dir, filters.get('company'), chunksize)
+
+
+def write_chunks(chunks, sink, file_format, df_name):
+    """Writes DataFrame chunks of a table to sink (a path or binary file object). Returns the number of rows."""
+    columns = TABLES[df_name]['columns']
+    rows = 0
+    if file_format == 'csv':
+        with open(sink, 'wb') if isinstance(sink, str) else nullcontext(sink) as f:
+            text = io.TextIOWrapper(f, encoding='utf-8', newline='')
+            header = True
+            for chunk in chunks:
+                chunk[columns].to_csv(text, header=header, index=False)
+                header = False
+                rows += len(chunk)
+            if header:  # No rows, still write the header
+                text.write(','.join(columns) + '\n')
+            text.flush()
+            text.detach()  # Leave the file itself open for the caller
+        return rows
+    import pyarrow as pa  # Optional dependency, only needed for Parquet and Arrow IPC
+    schema = arrow_schema(pa, df_name)
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    elif file_format == 'arrow':
+        writer = pa.ipc.new_file(sink, schema)
+    else:
+        raise ValueError(f"Unknown export format: {file_format}")
+    with writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pandas(chunk[columns], schema=schema, preserve_index=False))
+            rows += len(chunk)
+    return rows
+
+
+def export_table(backend, df_name, sink, file_format, filters=None, chunksize=CHUNKSIZE, archive_dir=None):
+    """Streams the rows of a table matching the filters to sink. Returns the number of rows written."""
+    return write_chunks(table_chunks(backend, df_name, filters, chunksize, archive_dir), sink, file_format, df_name)
+
+
+def export_bytes(backend, df_name, file_format, filters=None, chunksize=CHUNKSIZE, archive_dir=None):
+    """Returns the export as bytes, for downloads. Only the encoded file is held in memory, not a frame copy."""
+    buffer = io.BytesIO()
+    export_table(backend, df_name, buffer, file_format, filters, chunksize, archive_dir)
+    return buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a table of the SQLite store to CSV, Parquet or Arrow IPC.")
+    parser.add_argument('table', choices=list(TABLES))
+    parser.add_argument('path', help="Output file; the format is taken from the extension (.csv, .parquet, .arrow)")
+    parser.add_argument('--role', default='Admin')
+    parser.add_argument('--company', help="Company to export, required unless --role 'Super Admin'")
+    parser.add_argument('--db', default=os.environ.get('CRUD_SQLITE_PATH', 'crud.db'), help="SQLite database file")
+    parser.add_argument('--archive-dir', help=f"Also export archived requests from here (e.g. {DEFAULT_ARCHIVE_DIR})")
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+    args = parser.parse_args()
+    if args.role != 'Super Admin' and not args.company:
+        parser.error("--company is required unless --role 'Super Admin'")
+
+    # Nightly dumps run outside the app, so they read the persistent SQLite store
+    backend = open_backend('sqlite', args.db)
+    filters = CrudService.scope(Actor(None, args.role, args.company))
+    started = datetime.now()
+    rows = export_table(backend, args.table, args.path, format_of(args.path), filters, args.chunksize, args.archive_dir)
+    elapsed = (datetime.now() - started).total_seconds()
+    print(f"{rows} rows exported to {args.path} in {elapsed:.2f}s")
+
+
+if __name__ == '__main__':
+    main()
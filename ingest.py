@@ -0,0 +1,218 @@
+import argparse
+import os
+import uuid
+from datetime import datetime
+
+import pandas as pd
+
+from store import MAX_INT32, REQUEST_FIELDS, ROW_VERSION, create_stores
+
+# --- Bulk Ingest ---
+# Loads users, products or product requests from CSV/Parquet files in chunks.
+# Each chunk is validated with the same company/role rules the UI forms apply,
+# valid rows are appended to the store in a single batch and invalid rows are
+# returned with the reason they were rejected.
+
+DEFAULT_CHUNKSIZE = 100_000
+
+REQUEST_TYPES = ['Update', 'Delete']
+REQUEST_STATUSES = ['Pending', 'Approved', 'Rejected']
+
+
+def allowed_roles_for_creation(current_user_role):
+    """Returns the roles the current user is allowed to assign to new users."""
+    if current_user_role == "Super Admin":
+        return ["User", "Admin", "Super Admin"]
+    return ["User"]
+
+
+def read_chunks(source, chunksize=DEFAULT_CHUNKSIZE, file_format=None):
+    """Yields DataFrame chunks from a CSV or Parquet file (path or file object)."""
+    if file_format is None:
+        name = source if isinstance(source, str) else getattr(source, 'name', '')
+        file_format = 'parquet' if name.lower().endswith('.parquet') else 'csv'
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq  # Optional dependency, only needed for Parquet
+        for batch in pq.ParquetFile(source).iter_batches(batch_size=chunksize):
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(source, chunksize=chunksize, dtype=str, keep_default_na=False)
+
+
+def _blank(series):
+    """Returns a mask of missing or empty values."""
+    return series.isna() | (series.astype(str).str.strip() == '')
+
+
+def _apply_company_scope(chunk, current_user_role, current_user_company, reasons):
+    """Fixes the company for non-Super Admins, like the forms do, and rejects other companies."""
+    if current_user_role == "Super Admin":
+        reasons[_blank(chunk['company']) & (reasons == '')] = 'missing company'
+        return
+    chunk.loc[_blank(chunk['company']), 'company'] = current_user_company
+    reasons[(chunk['company'] != current_user_company) & (reasons == '')] = 'company not allowed for your role'
+
+
+def validate_users(chunk, current_user_role, current_user_company, existing_emails):
+    """Validates a chunk of users. Returns (valid, rejected)."""
+    chunk = chunk.reindex(columns=['name', 'email', 'company', 'role', 'password']).astype(object)
+    reasons = pd.Series('', index=chunk.index)
+    if current_user_role not in ["Super Admin", "Admin"]:
+        reasons[:] = 'you do not have permission to add users'
+    for col in ['name', 'email', 'role', 'password']:
+        reasons[_blank(chunk[col]) & (reasons == '')] = f'missing {col}'
+    _apply_company_scope(chunk, current_user_role, current_user_company, reasons)
+    allowed_roles = allowed_roles_for_creation(current_user_role)
+    reasons[~chunk['role'].isin(allowed_roles) & (reasons == '')] = 'role not allowed for your role'
+    duplicate = chunk['email'].isin(existing_emails) | chunk['email'].duplicated()
+    reasons[duplicate & (reasons == '')] = 'user with this email already exists'
+    return split_rejected(chunk, reasons)
+
+
+def validate_products(chunk, current_user_role, current_user_company):
+    """Validates a chunk of products. Returns (valid, rejected)."""
+    chunk = chunk.reindex(columns=['product_name', 'price', 'stock', 'company']).astype(object)
+    reasons = pd.Series('', index=chunk.index)
+    if current_user_role not in ["Super Admin", "Admin"]:
+        reasons[:] = 'you do not have permission to add products'
+    reasons[_blank(chunk['product_name']) & (reasons == '')] = 'missing product_name'
+    chunk['price'] = pd.to_numeric(chunk['price'], errors='coerce')
+    chunk['stock'] = pd.to_numeric(chunk['stock'], errors='coerce')
+    reasons[~(chunk['price'] >= 0.01) & (reasons == '')] = 'price must be at least 0.01'
+    reasons[~((chunk['stock'] >= 0) & (chunk['stock'] % 1 == 0)) & (reasons == '')] = 'stock must be a non-negative integer'
+    reasons[(chunk['stock'] > MAX_INT32) & (reasons == '')] = f'stock must be at most {MAX_INT32}'
+    _apply_company_scope(chunk, current_user_role, current_user_company, reasons)
+    valid, rejected = split_rejected(chunk, reasons)
+    valid['stock'] = valid['stock'].astype(int)
+    return valid, rejected
+
+
+def validate_product_requests(chunk, current_user_role, current_user_company, products):
+    """Validates a chunk of product requests against the products (indexed by id).
+
+    Update requests give the proposed values as new_<field> columns; the old
+    values are taken from the current product. Returns (valid, rejected).
+    """
+    new_columns = [f'new_{field}' for field in REQUEST_FIELDS]
+    chunk = chunk.reindex(columns=['product_id', 'request_type', *new_columns, 'requested_by_email',
+                                   'status', 'admin_notes', 'request_date', 'approval_date']).astype(object)
+    reasons = pd.Series('', index=chunk.index)
+    for col in ['product_id', 'request_type', 'requested_by_email']:
+        reasons[_blank(chunk[col]) & (reasons == '')] = f'missing {col}'
+    reasons[~chunk['request_type'].isin(REQUEST_TYPES) & (reasons == '')] = 'unknown request_type'
+    chunk.loc[_blank(chunk['status']), 'status'] = 'Pending'
+    reasons[~chunk['status'].isin(REQUEST_STATUSES) & (reasons == '')] = 'unknown status'
+    # Requests can only target existing products of the user's own company
+    product_company = chunk['product_id'].map(products['company'])
+    reasons[product_company.isna() & (reasons == '')] = 'product not found'
+    if current_user_role != "Super Admin":
+        reasons[(product_company != current_user_company) & (reasons == '')] = 'product not in your company'
+    chunk['company'] = product_company
+    chunk['product_version'] = chunk['product_id'].map(products[ROW_VERSION])  # Checked again on approval
+    chunk['new_price'] = pd.to_numeric(chunk['new_price'], errors='coerce')
+    chunk['new_stock'] = pd.to_numeric(chunk['new_stock'], errors='coerce')
+    invalid_stock = chunk['new_stock'].notna() & ~((chunk['new_stock'] >= 0) & (chunk['new_stock'] % 1 == 0) & (chunk['new_stock'] <= MAX_INT32))
+    reasons[invalid_stock & (reasons == '')] = 'stock must be a non-negative integer'
+    chunk.loc[_blank(chunk['new_product_name']), 'new_product_name'] = None
+    is_delete = chunk['request_type'] == 'Delete'
+    chunk.loc[is_delete, new_columns] = None
+    for field in REQUEST_FIELDS:
+        current = chunk['product_id'].map(products[field])
+        # Keep only real changes (all fields for deletes) as old/new diffs
+        changed = chunk[f'new_{field}'].notna() & (chunk[f'new_{field}'] != current)
+        chunk.loc[~changed, f'new_{field}'] = None
+        chunk[f'old_{field}'] = current.where(changed | is_delete)
+    unchanged = chunk[new_columns].isna().all(axis=1) & ~is_delete
+    reasons[unchanged & (reasons == '')] = 'no changes proposed'
+    chunk['admin_notes'] = chunk['admin_notes'].fillna('')
+    chunk['approval_date'] = chunk['approval_date'].fillna('')
+    chunk.loc[_blank(chunk['request_date']), 'request_date'] = datetime.now().isoformat()
+    return split_rejected(chunk, reasons)
+
+
+def split_rejected(chunk, reasons):
+    """Splits a chunk into valid rows and rejected rows annotated with a reason."""
+    ok = reasons == ''
+    rejected = chunk[~ok].copy()
+    rejected['reason'] = reasons[~ok]
+    return chunk[ok].copy(), rejected
+
+
+def row_ids(batch_id, row_numbers):
+    """Returns the ids of the rows of an import batch, derived from their row numbers."""
+    namespace = uuid.UUID(batch_id)
+    return pd.Series([str(uuid.uuid5(namespace, str(n))) for n in row_numbers], index=row_numbers, dtype=object)
+
+
+def ingest_file(stores, df_name, source, current_user_role, current_user_company,
+                chunksize=DEFAULT_CHUNKSIZE, file_format=None, on_accept=None, batch_id=None, on_chunk=None):
+    """Loads a CSV/Parquet file into the specified table in chunks.
+
+    `on_accept` is called with every validated chunk before it is stored, e.g.
+    to register the credentials of imported users. With a `batch_id` (a UUID)
+    the new ids are derived from it and the row numbers, so loading the same
+    file again with the same batch_id skips the rows already stored, e.g. to
+    resume an interrupted import. `on_chunk(rows read, rows added)` is called
+    after every chunk.
+    Returns (number of rows added, DataFrame of rejected rows with reasons).
+    """
+    store = stores[df_name]
+    key = store.key
+    added = 0
+    rows_read = 0
+    rejected_chunks = []
+    if df_name == 'users_df':
+        existing_emails = set(stores['users_df'].frame()['email'])
+    elif df_name == 'product_requests_df':
+        products = stores['products_df'].frame().set_index('id')
+    for chunk in read_chunks(source, chunksize, file_format):
+        chunk.index = pd.RangeIndex(rows_read, rows_read + len(chunk))  # Row numbers in the file
+        rows_read += len(chunk)
+        if batch_id is not None:
+            ids = row_ids(batch_id, chunk.index)
+            stored = ids.isin(store.get_many(ids.tolist())[key]).to_numpy()
+            added += int(stored.sum())
+            chunk = chunk[~stored]
+        if df_name == 'users_df':
+            valid, rejected = validate_users(chunk, current_user_role, current_user_company, existing_emails)
+            existing_emails.update(valid['email'])
+        elif df_name == 'products_df':
+            valid, rejected = validate_products(chunk, current_user_role, current_user_company)
+        elif df_name == 'product_requests_df':
+            valid, rejected = validate_product_requests(chunk, current_user_role, current_user_company, products)
+        else:
+            raise ValueError(f"Unknown table: {df_name}")
+        if on_accept is not None:
+            on_accept(valid)
+        if batch_id is not None:
+            valid[key] = ids[valid.index]
+        else:
+            valid[key] = [str(uuid.uuid4()) for _ in range(len(valid))]
+        added += store.insert_many(valid)
+        rejected_chunks.append(rejected)
+        if on_chunk is not None:
+            on_chunk(rows_read, added)
+    rejected = pd.concat(rejected_chunks, ignore_index=True) if rejected_chunks else pd.DataFrame()
+    return added, rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate a CSV/Parquet file for bulk ingest (dry run).")
+    parser.add_argument('table', choices=['users_df', 'products_df'])
+    parser.add_argument('path')
+    parser.add_argument('--role', default='Super Admin')
+    parser.add_argument('--company', default='Global')
+    parser.add_argument('--chunksize', type=int, default=DEFAULT_CHUNKSIZE)
+    args = parser.parse_args()
+
+    stores = create_stores()
+    started = datetime.now()
+    added, rejected = ingest_file(stores, args.table, args.path, args.role, args.company, args.chunksize)
+    elapsed = (datetime.now() - started).total_seconds()
+    print(f"{added} rows valid, {len(rejected)} rejected in {elapsed:.2f}s ({os.path.basename(args.path)})")
+    if not rejected.empty:
+        print(rejected['reason'].value_counts().to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,318 @@
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from archive import expired_requests, write_archive
+from auth import IMPORT_ITERATIONS
+from ingest import ingest_file
+from service import Actor
+
+# --- Background Jobs ---
+# Long operations (bulk imports, bulk reviews, archiving) run as jobs in a
+# bounded pool of worker threads instead of the Streamlit script thread, so the
+# page stays responsive and a rerun cannot interrupt them halfway.
+#
+# Jobs are rows of a job table (queued -> running -> done | failed), kept in
+# the SQLite file for the persistent backends, so they survive a restart and
+# are visible to every server process. A worker claims a queued job atomically,
+# records its progress as it goes, and the job is requeued if its worker stops
+# reporting (e.g. the process died). Handlers are written to be rerun safely:
+# imports derive row ids from the job id and skip rows already stored, reviews
+# continue after the last recorded batch and skip requests no longer pending.
+# Submitting a job with the key of a queued or running job returns that job.
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+ACTIVE_STATES = (QUEUED, RUNNING)
+
+JOB_WORKERS = int(os.environ.get('CRUD_JOB_WORKERS', '2'))
+JOBS_DIR = os.environ.get('CRUD_JOBS_DIR', 'jobs')  # Uploaded files and reports of jobs
+STALE_AFTER = timedelta(minutes=5)  # Running jobs without progress for this long are requeued
+RECOVER_INTERVAL = 60  # Seconds between checks for jobs to requeue
+REVIEW_BATCH = 1000  # Requests resolved per batch of a review job
+ARCHIVE_BATCH = 10_000  # Requests moved per batch of an archive job
+
+
+class JobTable:
+    """Persistent job table in a SQLite file (in memory if path is None), shared by all threads."""
+
+    def __init__(self, path=None):
+        self._conn = sqlite3.connect(path or ':memory:', check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id TEXT PRIMARY KEY, kind TEXT NOT NULL, key TEXT, state TEXT NOT NULL, "
+                "owner TEXT, role TEXT, company TEXT, label TEXT, payload TEXT, "
+                "done INTEGER NOT NULL DEFAULT 0, total INTEGER, result TEXT, error TEXT, worker TEXT, "
+                "created_at TEXT, started_at TEXT, finished_at TEXT, heartbeat TEXT)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created_at)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, created_at)")
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _job(row):
+        job = dict(row)
+        job['payload'] = json.loads(job['payload'] or 'null')
+        job['result'] = json.loads(job['result'] or 'null')
+        return job
+
+    def submit(self, kind, payload, actor, label, key=None, total=None, job_id=None):
+        """Queues a job. Returns its id, or the id of the queued/running job with the same key."""
+        job_id = job_id or str(uuid.uuid4())
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")  # Other processes cannot queue the same key in between
+            try:
+                if key is not None:
+                    row = self._conn.execute("SELECT id FROM jobs WHERE key = ? AND state IN (?, ?)",
+                                             (key, *ACTIVE_STATES)).fetchone()
+                    if row is not None:
+                        return row['id']
+                self._conn.execute(
+                    "INSERT INTO jobs (id, kind, key, state, owner, role, company, label, payload, total, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (job_id, kind, key, QUEUED, actor.email, actor.role, actor.company, label, json.dumps(payload),
+                     total, datetime.now().isoformat()))
+            finally:
+                self._conn.execute("COMMIT")
+        return job_id
+
+    def claim(self, worker):
+        """Marks the oldest queued job as running by worker and returns it, or None."""
+        now = datetime.now().isoformat()
+        rows = self._execute(
+            "UPDATE jobs SET state = ?, worker = ?, started_at = COALESCE(started_at, ?), heartbeat = ? "
+            "WHERE id = (SELECT id FROM jobs WHERE state = ? ORDER BY created_at LIMIT 1) RETURNING *",
+            (RUNNING, worker, now, now, QUEUED))
+        return self._job(rows[0]) if rows else None
+
+    def progress(self, job_id, done, total=None, result=None):
+        """Records the progress of a running job (and its partial result, to resume from)."""
+        self._execute("UPDATE jobs SET done = ?, total = COALESCE(?, total), result = COALESCE(?, result), heartbeat = ? "
+                      "WHERE id = ?", (done, total, None if result is None else json.dumps(result),
+                                       datetime.now().isoformat(), job_id))
+
+    def finish(self, job_id, result):
+        self._execute("UPDATE jobs SET state = ?, done = COALESCE(total, done), result = ?, finished_at = ? WHERE id = ?",
+                      (DONE, json.dumps(result), datetime.now().isoformat(), job_id))
+
+    def fail(self, job_id, error):
+        self._execute("UPDATE jobs SET state = ?, error = ?, finished_at = ? WHERE id = ?",
+                      (FAILED, error, datetime.now().isoformat(), job_id))
+
+    def retry(self, job_id):
+        """Queues a failed job again; it continues where it stopped. Returns False if it did not fail."""
+        return bool(self._execute("UPDATE jobs SET state = ?, error = NULL, finished_at = NULL "
+                                  "WHERE id = ? AND state = ? RETURNING id", (QUEUED, job_id, FAILED)))
+
+    def requeue(self, job_id):
+        """Queues a running job again, e.g. when its worker is gone. Returns False if it was not running."""
+        return bool(self._execute("UPDATE jobs SET state = ? WHERE id = ? AND state = ? RETURNING id",
+                                  (QUEUED, job_id, RUNNING)))
+
+    def running(self):
+        return [self._job(row) for row in self._execute("SELECT * FROM jobs WHERE state = ?", (RUNNING,))]
+
+    def get(self, job_id):
+        rows = self._execute("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        return self._job(rows[0]) if rows else None
+
+    def recent(self, owner=None, limit=10):
+        """Returns the latest jobs (of one owner), newest first."""
+        if owner is None:
+            rows = self._execute("SELECT * FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,))
+        else:
+            rows = self._execute("SELECT * FROM jobs WHERE owner = ? ORDER BY created_at DESC LIMIT ?", (owner, limit))
+        return [self._job(row) for row in rows]
+
+
+class JobExecutor:
+    """Runs the jobs of a job table in a bounded thread pool.
+
+    handlers maps a job kind to handler(service, job, progress); progress(done,
+    total=None, result=None) records how far the job got. The handler's return
+    value ({'message', 'report'}) becomes the job result, an exception fails the job.
+    """
+
+    def __init__(self, jobs, service, handlers, workers=JOB_WORKERS):
+        self.jobs = jobs
+        self.service = service
+        self.handlers = handlers
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='job')
+
+    def start(self):
+        """Requeues the jobs of workers that are gone and starts working through the queue.
+        Checks for such jobs again every RECOVER_INTERVAL while the process runs."""
+        self._recover()
+        self._wake(self._workers)
+        threading.Thread(target=self._watch, name='job-recover', daemon=True).start()
+        return self
+
+    def _watch(self):
+        while True:
+            time.sleep(RECOVER_INTERVAL)
+            try:
+                requeued = self._recover()
+            except sqlite3.Error:
+                continue  # Job file busy, try again next time
+            if requeued:
+                self._wake(min(requeued, self._workers))
+
+    def _recover(self):
+        """Requeues running jobs of dead processes on this host, or without progress for STALE_AFTER.
+        Returns the number of requeued jobs."""
+        host, _ = self.worker.rsplit(':', 1)
+        cutoff = (datetime.now() - STALE_AFTER).isoformat()
+        requeued = 0
+        for job in self.jobs.running():
+            worker_host, pid = job['worker'].rsplit(':', 1)
+            if job['heartbeat'] < cutoff or (worker_host == host and not _alive(int(pid))):
+                requeued += self.jobs.requeue(job['id'])
+        return requeued
+
+    def _wake(self, workers=1):
+        for _ in range(workers):
+            self._pool.submit(self._drain)
+
+    def submit(self, kind, payload, actor, label, key=None, total=None, job_id=None):
+        """Queues a job and returns its id (see JobTable.submit)."""
+        job_id = self.jobs.submit(kind, payload, actor, label, key, total, job_id)
+        self._wake()
+        return job_id
+
+    def retry(self, job_id):
+        if self.jobs.retry(job_id):
+            self._wake()
+            return True
+        return False
+
+    def _drain(self):
+        while (job := self.jobs.claim(self.worker)) is not None:
+            self._run(job)
+
+    def _run(self, job):
+        def progress(done, total=None, result=None):
+            self.jobs.progress(job['id'], done, total, result)
+
+        try:
+            result = self.handlers[job['kind']](self.service, job, progress)
+        except Exception as e:
+            self.jobs.fail(job['id'], f"{type(e).__name__}: {e}")
+        else:
+            self.jobs.finish(job['id'], result)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass  # Exists, owned by another user
+    return True
+
+
+def job_actor(job):
+    return Actor(job['owner'], job['role'], job['company'])
+
+
+def job_file(job_id, suffix):
+    """Returns the path of a file belonging to a job in JOBS_DIR."""
+    os.makedirs(JOBS_DIR, exist_ok=True)
+    return os.path.join(JOBS_DIR, f"{job_id}{suffix}")
+
+
+def count_rows(path, file_format):
+    """Returns the number of rows of an import file, for progress (CSV: lines, an estimate)."""
+    if file_format == 'parquet':
+        import pyarrow.parquet as pq
+        return pq.ParquetFile(path).metadata.num_rows
+    with open(path, 'rb') as f:
+        return max(sum(block.count(b'\n') for block in iter(lambda: f.read(1 << 20), b'')) - 1, 0)
+
+
+# --- Job Handlers ---
+
+def run_import(service, job, progress):
+    """Bulk-loads an uploaded file, see ingest_file. Rejected rows go to a CSV report."""
+    payload = job['payload']
+    df_name, path, file_format = payload['df_name'], payload['path'], payload['format']
+    on_accept = None
+    if df_name == 'users_df':  # Temporary passwords are hashed with a lower cost and rehashed on first login
+        def on_accept(valid_users):
+            service.credentials.add_many({row.email: {"password": row.password, "role": row.role, "company": row.company}
+                                          for row in valid_users.itertuples(index=False)}, iterations=IMPORT_ITERATIONS)
+    progress(0, count_rows(path, file_format))
+    added, rejected = ingest_file(service.backend.tables, df_name, path, job['role'], job['company'],
+                                  file_format=file_format, on_accept=on_accept, batch_id=job['id'],
+                                  on_chunk=lambda rows_read, added: progress(rows_read))
+    report = None
+    if not rejected.empty:
+        report = job_file(job['id'], '-rejected.csv')
+        rejected.drop(columns=['password'], errors='ignore').to_csv(report, index=False)
+    os.remove(path)
+    message = f"{added} records imported." + (f" {len(rejected)} rows were rejected." if report else "")
+    return {'message': message, 'report': report}
+
+
+def run_review(service, job, progress):
+    """Approves or rejects pending requests in batches. Requests that could not be applied go to a CSV report."""
+    payload = job['payload']
+    request_ids = payload['request_ids']
+    counts = job['result'] or {'resolved': 0, 'conflicts': 0}  # Of the batches done before an interruption
+    report = job_file(job['id'], '-conflicts.csv')
+    for start in range(job['done'], len(request_ids), REVIEW_BATCH):
+        resolved, conflicts = service.resolve(job_actor(job), request_ids[start:start + REVIEW_BATCH],
+                                              payload['status'], payload['admin_notes'])
+        if not conflicts.empty:
+            conflicts.to_csv(report, mode='a', header=not os.path.exists(report), index=False)
+        counts = {'resolved': counts['resolved'] + len(resolved), 'conflicts': counts['conflicts'] + len(conflicts)}
+        progress(min(start + REVIEW_BATCH, len(request_ids)), len(request_ids), counts)
+    message = f"{counts['resolved']} requests {payload['status'].lower()}."
+    if counts['conflicts']:
+        message += f" {counts['conflicts']} requests were not applied and are still pending."
+    return {'message': message, 'report': report if os.path.exists(report) else None}
+
+
+def run_archive(service, job, progress):
+    """Moves old resolved requests to the Parquet archive in batches of ARCHIVE_BATCH. Each batch is
+    read under the backend lock, written without it and deleted from the live table under the lock
+    again, so other writers only wait for the read and the delete, not for the Parquet write."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return {'message': "pyarrow is not installed, resolved requests stay in the live table.", 'report': None}
+    payload = job['payload']
+    store = service.backend.table('product_requests_df')
+    max_age = timedelta(days=payload['after_days'])
+    archived = job['done']  # Of the batches done before an interruption
+    with service.backend.lock:
+        total = archived + len(expired_requests(store, max_age))
+    progress(archived, total)
+    while True:
+        with service.backend.lock:
+            batch = expired_requests(store, max_age, limit=ARCHIVE_BATCH)
+        if batch.empty:
+            break
+        # Named after the job and position, so a rerun after an interruption rewrites the file instead of duplicating it
+        write_archive(batch, payload['archive_dir'], f"requests-{job['id']}-{archived}")
+        with service.backend.lock:  # Resolved requests are not modified, the snapshot is still current
+            store.delete_many(batch[store.key].tolist())
+        archived += len(batch)
+        progress(archived, max(total, archived))
+    return {'message': f"{archived} resolved requests archived.", 'report': None}
+
+
+JOB_HANDLERS = {'import': run_import, 'review': run_review, 'archive': run_archive}
@@ -0,0 +1,218 @@
+import cProfile
+import io
+import json
+import math
+import os
+import pstats
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
+from functools import wraps
+
+import pandas as pd
+
+# --- Timing Metrics ---
+# Process-wide latency histograms of named spans: UI functions, data helpers,
+# service calls and the store operations behind the views. A span costs two
+# perf_counter calls and a locked bucket increment; with CRUD_METRICS=0 spans
+# are skipped entirely. Histograms can be written in the Prometheus text
+# format (for the node_exporter textfile collector) or appended as JSON lines.
+
+BUCKETS_MS = [0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+METRIC_NAME = 'crud_span_duration_seconds'
+PROFILE_LINES = 30  # Functions shown in a cProfile report
+
+
+class Histogram:
+    """Counts of span durations per bucket (milliseconds), with their sum and maximum."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)  # The last bucket is +Inf
+        self.total = 0.0
+        self.max = 0.0
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def observe(self, ms):
+        self.counts[_bucket(ms)] += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, q):
+        """Upper bound of the bucket holding the q-th percentile (the maximum for +Inf)."""
+        rank = math.ceil(self.count * q / 100)
+        seen = 0
+        for bound, count in zip(BUCKETS_MS, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+
+def _bucket(ms):
+    for i, bound in enumerate(BUCKETS_MS):
+        if ms <= bound:
+            return i
+    return len(BUCKETS_MS)
+
+
+class _Span:
+    __slots__ = ('metrics', 'name', 'started')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.observe(self.name, (time.perf_counter() - self.started) * 1000)
+
+
+_NO_SPAN = nullcontext()
+
+
+class Metrics:
+    """Thread-safe registry of span histograms, shared by all sessions of the process."""
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._histograms = {}
+        self._lock = threading.Lock()
+        self._last_export = 0.0
+
+    def observe(self, name, ms):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(ms)
+
+    def span(self, name):
+        """Context manager timing its block as `name`."""
+        return _Span(self, name) if self.enabled else _NO_SPAN
+
+    def timed(self, name):
+        """Decorator timing every call of a function as `name`."""
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return fn(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.observe(name, (time.perf_counter() - started) * 1000)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def _snapshot(self):
+        """Returns copies of the histograms, sorted by name."""
+        with self._lock:
+            copies = {}
+            for name, histogram in self._histograms.items():
+                copy = copies[name] = Histogram()
+                copy.counts, copy.total, copy.max = list(histogram.counts), histogram.total, histogram.max
+        return sorted(copies.items())
+
+    def summary(self):
+        """Returns one row per span (count, total, mean, p50/p90/p99, max in ms), slowest total first."""
+        rows = [{'span': name, 'count': h.count, 'total_ms': round(h.total, 1), 'mean_ms': round(h.total / h.count, 2),
+                 'p50_ms': round(h.percentile(50), 2), 'p90_ms': round(h.percentile(90), 2), 'p99_ms': round(h.percentile(99), 2),
+                 'max_ms': round(h.max, 2)} for name, h in self._snapshot()]
+        summary = pd.DataFrame(rows, columns=['span', 'count', 'total_ms', 'mean_ms', 'p50_ms', 'p90_ms', 'p99_ms', 'max_ms'])
+        return summary.sort_values('total_ms', ascending=False, ignore_index=True)
+
+    def histogram(self, name):
+        """Returns the bucket counts of a span as a Series indexed by bucket label."""
+        histogram = dict(self._snapshot()).get(name, Histogram())
+        labels = [f"≤{bound:g} ms" for bound in BUCKETS_MS] + [f">{BUCKETS_MS[-1]:g} ms"]
+        return pd.Series(histogram.counts, index=pd.Index(labels, name='bucket'), name='count')
+
+    # --- Export ---
+
+    def prometheus_text(self):
+        """Returns the histograms in the Prometheus text exposition format (in seconds)."""
+        lines = [f"# HELP {METRIC_NAME} Duration of instrumented spans of the CRUD app.",
+                 f"# TYPE {METRIC_NAME} histogram"]
+        for name, histogram in self._snapshot():
+            cumulative = 0
+            for bound, count in zip(BUCKETS_MS + [None], histogram.counts):
+                cumulative += count
+                le = '+Inf' if bound is None else f"{bound / 1000:g}"
+                lines.append(f'{METRIC_NAME}_bucket{{span="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'{METRIC_NAME}_sum{{span="{name}"}} {histogram.total / 1000:.6f}')
+            lines.append(f'{METRIC_NAME}_count{{span="{name}"}} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    def json_lines(self):
+        """Returns one JSON line per span with its cumulative counts."""
+        stamp = datetime.now().isoformat()
+        return ''.join(json.dumps({'time': stamp, 'span': name, 'count': h.count, 'sum_ms': round(h.total, 3),
+                                   'max_ms': round(h.max, 3), 'buckets_ms': dict(zip(map(str, BUCKETS_MS + ['+Inf']), h.counts))}) + '\n'
+                       for name, h in self._snapshot())
+
+    def export(self, path):
+        """Writes the histograms to path: appended as JSON lines if it ends with .jsonl,
+        otherwise replaced atomically with the Prometheus text format."""
+        if path.endswith('.jsonl'):
+            with open(path, 'a') as f:
+                f.write(self.json_lines())
+            return
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)  # Collectors never read a half-written file
+
+    def export_if_due(self, path, interval):
+        """Exports to path if the last export is more than interval seconds ago. Returns True if it did."""
+        with self._lock:
+            if time.monotonic() - self._last_export < interval:
+                return False
+            self._last_export = time.monotonic()
+        self.export(path)
+        return True
+
+
+METRICS = Metrics(enabled=os.environ.get('CRUD_METRICS', '1') != '0')
+
+
+# --- Profiling ---
+# cProfile hooks into the whole interpreter, so only one rerun is profiled at a time.
+
+_profile_lock = threading.Lock()
+
+
+@contextmanager
+def profiled(enabled, report):
+    """Runs the block under cProfile when enabled and stores the top functions
+    by cumulative time as text in report['text'] (or a note if another rerun is being profiled)."""
+    if not enabled:
+        yield
+        return
+    if not _profile_lock.acquire(blocking=False):
+        report['text'] = "Another session is being profiled, try again."
+        yield
+        return
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+            report['text'] = out.getvalue()
+    finally:
+        _profile_lock.release()
@@ -0,0 +1,379 @@
+import fcntl
+import mmap
+import os
+import threading
+import zlib
+from contextlib import contextmanager
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+from sqlite_store import DEFAULT_PATH, MAX_PARAMS, SQLiteBackend, SQLiteCredentials
+from store import TABLES, ChangeFeed, create_store
+
+# --- Multi-Process Mode ---
+# Several server processes (e.g. behind a load balancer) share one SQLite file
+# as the durable store, and each keeps a hot in-memory copy of the tables,
+# partitioned by company and loaded one company at a time as views need it.
+#
+# Writes are serialized across processes by an exclusive lock on a lock file.
+# Each write goes to SQLite, appends the ids it changed to a change log table
+# and then advances the change counters: a small memory-mapped file holding,
+# per table, the sequence number of the last logged write and, per company
+# slot (a hash of the company), the last write to that company. Every read
+# checks the counters of the companies it covers (a memory read) and, only if
+# they moved, catches up by re-reading the logged records, so another process's
+# write invalidates only the affected tables and companies, on the next read.
+# Login credentials and the session token secret live in the shared file too.
+#
+# Needs fcntl (Unix). Select it with CRUD_STORAGE=multiprocess.
+
+TENANT_SLOTS = 1024     # Company slots per table; colliding companies only cause extra catch-ups
+LOG_RETENTION = 100_000  # Logged writes kept; a process further behind reloads its copy
+CREDENTIALS = 'credentials'
+
+
+class InterProcessLock:
+    """Reentrant lock held by at most one thread of all processes: a thread lock (`local`)
+    plus an exclusive flock on a lock file. Reads only need to exclude this process's
+    writers, so they can take `local` alone."""
+
+    def __init__(self, path):
+        self.local = threading.RLock()
+        self._file = open(path, 'a+b')
+        self._depth = 0  # Only changed by the thread holding `local`
+
+    def acquire(self):
+        self.local.acquire()
+        if self._depth == 0:
+            try:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+            except BaseException:
+                self.local.release()
+                raise
+        self._depth += 1
+        return True
+
+    def release(self):
+        self._depth -= 1
+        if self._depth == 0:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self.local.release()
+
+    def __enter__(self):
+        return self.acquire()
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class ChangeCounters:
+    """Per-channel (table) and per-company counters in a memory-mapped file shared by the processes."""
+
+    def __init__(self, path, channels, slots=TENANT_SLOTS):
+        self._channels = {channel: row for row, channel in enumerate(channels)}
+        self._slots = slots
+        size = len(channels) * (1 + slots) * 8
+        self._file = open(path, 'a+b')
+        with self._exclusive():
+            if os.fstat(self._file.fileno()).st_size != size:
+                self._file.truncate(0)  # New or laid out for other tables: start over, the log sequence only grows
+                self._file.truncate(size)
+        self._map = mmap.mmap(self._file.fileno(), size)
+        self._counts = np.frombuffer(self._map, dtype=np.int64).reshape(len(channels), 1 + slots)
+
+    @contextmanager
+    def _exclusive(self):
+        fcntl.flock(self._file.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _slot(self, company):
+        return 1 + zlib.crc32(str(company).encode()) % self._slots  # Stable across processes, unlike hash()
+
+    def read(self, channel, company=None):
+        """Returns the counter of a channel, or of one company in it."""
+        return int(self._counts[self._channels[channel], 0 if company is None else self._slot(company)])
+
+    def advance(self, channel, companies=(), to=None):
+        """Sets the counter of a channel and of the given companies to `to` (default: one more).
+        Returns the previous counter of the channel."""
+        row = self._counts[self._channels[channel]]
+        with self._exclusive():
+            previous = int(row[0])
+            row[0] = value = previous + 1 if to is None else max(previous, to)
+            for company in companies:
+                row[self._slot(company)] = value
+        return previous
+
+
+class CachedStore:
+    """Hot in-memory copy of a SQLite table, kept current with the writes of all processes.
+    Reads are served from the copy, lookups by id and writes go to SQLite. Writes must be made
+    under the backend lock (SharedStore does)."""
+
+    def __init__(self, df_name, durable, backend):
+        self.name = df_name
+        self.durable = durable
+        self.columns = durable.columns
+        self.key = durable.key
+        self.prefix_column = durable.prefix_column
+        self.partition_by = TABLES[df_name]['partition_by']
+        self._pool = backend.durable.pool
+        self._counters = backend.counters
+        self._feed = backend.feed
+        self._replica = create_store(df_name)  # Only holds the loaded companies
+        self._complete = False  # All companies loaded
+        self._applied = self._counters.read(df_name)  # Log sequence the copy is current with
+
+    @property
+    def version(self):
+        return self._counters.read(self.name)
+
+    def version_of(self, company):
+        return self._counters.read(self.name, company)
+
+    # --- Keeping the Copy Current ---
+
+    def _companies(self, filters):
+        """Returns the companies a read covers, or None for all."""
+        value = (filters or {}).get(self.partition_by)
+        if value is None:
+            return None
+        return list(value) if isinstance(value, (list, set, tuple)) else [value]
+
+    def _ensure(self, companies):
+        """Makes the copy current for the companies (all if None), loading the ones not loaded yet."""
+        if companies is None:
+            stale = self._counters.read(self.name) > self._applied
+        else:
+            stale = any(self._counters.read(self.name, company) > self._applied for company in companies)
+        if stale:
+            self._catch_up()
+        if self._complete:
+            return
+        if companies is None:
+            self._load(None)
+        else:
+            missing = [company for company in companies if company not in self._replica.partitions]
+            if missing:
+                self._load(missing)
+
+    def _load(self, companies):
+        rows = self.durable.frame() if companies is None else self.durable.find(**{self.partition_by: companies})
+        partitions = None if companies is None else [*self._replica.partitions, *companies]
+        self._replica.apply_rows(rows[self.key], rows, partitions)
+        for company in companies or ():
+            self._replica.partition(company)  # Loaded, even without rows
+        self._complete = companies is None
+
+    def refresh(self):
+        """Catches up with the writes of other processes."""
+        if self._counters.read(self.name) > self._applied:
+            self._catch_up()
+
+    def _catch_up(self, publish=True):
+        """Re-reads the records logged since the copy was last made current. Changes made by other
+        processes are published to the feed when the copy holds all companies (so the old records are known)."""
+        with self._pool.connection() as conn:
+            first, last = conn.execute("SELECT MIN(seq), MAX(seq) FROM change_log").fetchone()
+            if last is None or last <= self._applied:
+                return
+            record_ids = None
+            if first <= self._applied + 1:
+                record_ids = [row[0] for row in conn.execute(
+                    "SELECT DISTINCT record_id FROM change_log WHERE tbl = ? AND seq > ? AND seq <= ?",
+                    (self.name, self._applied, last))]
+        if record_ids is None:  # Entries this process has not seen were pruned, reread the loaded companies
+            companies = None if self._complete else list(self._replica.partitions)
+            rows = self.durable.frame() if companies is None else self.durable.find(**{self.partition_by: companies})
+            self._apply(list(dict.fromkeys(chain(self._replica.frame()[self.key], rows[self.key]))), rows, publish)
+        elif record_ids:
+            self._apply(record_ids, self.durable.get_many(record_ids), publish)
+        self._applied = last
+
+    def _apply(self, record_ids, rows, publish):
+        publish = publish and self._complete and self._feed.subscribers
+        if publish:
+            old = {record[self.key]: record for record in self._replica.get_many(record_ids).to_dict('records')}
+        self._replica.apply_rows(record_ids, rows, None if self._complete else list(self._replica.partitions))
+        if publish:
+            self._feed.publish(self.name, record_ids, old,
+                               {record[self.key]: record for record in rows.to_dict('records')})
+
+    # --- Writes ---
+
+    def _write(self, method, record_ids, companies, *args, lookup=True):
+        """Writes to SQLite, logs the changed ids, advances the counters of the table and of the
+        companies the records were in before and after, and applies the write to the copy."""
+        self.refresh()  # Other processes' writes first, so the feed gets changes in order
+        record_ids = list(record_ids)
+        companies = set(companies)
+        if lookup:
+            companies.update(self._companies_of(record_ids))
+        result = getattr(self.durable, method)(*args)
+        with self._pool.connection() as conn:
+            conn.executemany("INSERT INTO change_log (tbl, record_id) VALUES (?, ?)",
+                             [(self.name, record_id) for record_id in record_ids])
+            seq = conn.execute("SELECT MAX(seq) FROM change_log").fetchone()[0]
+            conn.execute("DELETE FROM change_log WHERE seq <= ?", (seq - LOG_RETENTION,))
+        self._counters.advance(self.name, companies, seq)
+        # SharedStore publishes this process's own writes. The copy was current before the write
+        # (under the lock nobody else writes), so the same write brings it in line without reading back.
+        if self._complete or companies <= self._replica.partitions.keys():
+            getattr(self._replica, method)(*args)
+            self._applied = seq
+        else:
+            self._catch_up(publish=False)
+        return result
+
+    def _companies_of(self, record_ids):
+        """Returns the companies of the existing records among record_ids."""
+        companies = set()
+        with self._pool.connection() as conn:
+            for i in range(0, len(record_ids), MAX_PARAMS):
+                chunk = record_ids[i:i + MAX_PARAMS]
+                companies.update(row[0] for row in conn.execute(
+                    f"SELECT DISTINCT {self.partition_by} FROM {self.durable.table} "
+                    f"WHERE {self.key} IN ({', '.join('?' * len(chunk))})", chunk))
+        return companies
+
+    def insert(self, record):
+        return self._write('insert', [record[self.key]], [record.get(self.partition_by)], record, lookup=False)
+
+    def insert_many(self, records):
+        batch = records if isinstance(records, pd.DataFrame) else pd.DataFrame(list(records))
+        if batch.empty:
+            return 0
+        companies = batch[self.partition_by].dropna() if self.partition_by in batch else []
+        return self._write('insert_many', batch[self.key], companies, batch, lookup=False)
+
+    def update(self, record_id, updated_data):
+        companies = [updated_data[self.partition_by]] if self.partition_by in updated_data else []
+        return self._write('update', [record_id], companies, record_id, updated_data)
+
+    def update_many(self, updates):
+        companies = updates[self.partition_by].dropna() if self.partition_by in updates else []
+        return self._write('update_many', updates[self.key], companies, updates)
+
+    def delete(self, record_id):
+        return self._write('delete', [record_id], [], record_id)
+
+    def delete_many(self, record_ids):
+        record_ids = list(record_ids)
+        return self._write('delete_many', record_ids, [], record_ids)
+
+    def flush(self):
+        self._replica.flush()
+
+    def compact(self):
+        self._replica.compact()
+
+    # --- Reads ---
+
+    def __len__(self):
+        return len(self.durable)
+
+    def __contains__(self, record_id):
+        return record_id in self.durable
+
+    def get(self, record_id):
+        return self.durable.get(record_id)  # Always current, e.g. for compare-and-swap checks
+
+    def get_many(self, record_ids):
+        return self.durable.get_many(record_ids)
+
+    def frame(self):
+        self._ensure(None)
+        return self._replica.frame()
+
+    def find(self, **filters):
+        self._ensure(self._companies(filters))
+        return self._replica.find(**filters)
+
+    def count(self, **filters):
+        self._ensure(self._companies(filters))
+        return self._replica.count(**filters)
+
+    def page(self, filters=None, *args, **kwargs):
+        self._ensure(self._companies(filters))
+        return self._replica.page(filters, *args, **kwargs)
+
+    def prefix_search(self, prefix, filters=None, limit=50):
+        self._ensure(self._companies(filters))
+        return self._replica.prefix_search(prefix, filters, limit)
+
+    def search(self, text, filters=None, limit=50):
+        self._ensure(self._companies(filters))
+        return self._replica.search(text, filters, limit)
+
+    def iter_chunks(self, *args, **kwargs):
+        filters = args[0] if args else kwargs.get('filters')
+        self._ensure(self._companies(filters))
+        return self._replica.iter_chunks(*args, **kwargs)
+
+    def distinct(self, column):
+        self._ensure(None)
+        return self._replica.distinct(column)
+
+
+class SharedCredentials(SQLiteCredentials):
+    """SQLiteCredentials reloaded when another process changes them. The token secret is
+    stored in the shared file, so a session token is valid in every process."""
+
+    def __init__(self, pool, counters, **kwargs):
+        self._counters = counters
+        self._seen = counters.read(CREDENTIALS)  # Credentials counter the local copy is current with, read before loading
+        super().__init__(pool, **kwargs)
+
+    def _sync(self):
+        seen = self._counters.read(CREDENTIALS)  # Before reading, so a concurrent change is picked up next time
+        if seen != self._seen:
+            self._load()
+            self._seen = seen
+
+    def _write(self, sql, rows, apply):
+        changed = super()._write(sql, rows, apply)
+        if changed and self._counters.advance(CREDENTIALS) == self._seen:
+            self._seen += 1  # Nobody else changed them in between, the local copy is current
+        return changed
+
+    def __len__(self):
+        self._sync()
+        return super().__len__()
+
+    def __contains__(self, email):
+        self._sync()
+        return super().__contains__(email)
+
+    def user(self, email):
+        self._sync()
+        return super().user(email)
+
+    def authenticate(self, email, password):
+        self._sync()
+        return super().authenticate(email, password)
+
+
+class MultiProcessBackend:
+    """Keeps all tables in one SQLite file shared by several processes, each with a hot in-memory copy."""
+
+    persistent = True
+
+    def __init__(self, path=None):
+        self.path = path or DEFAULT_PATH
+        self.durable = SQLiteBackend(self.path)
+        self.lock = InterProcessLock(f"{self.path}.lock")
+        self.feed = ChangeFeed()
+        self.counters = ChangeCounters(f"{self.path}.changes", [*TABLES, CREDENTIALS])
+        with self.durable.pool.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS change_log "
+                         "(seq INTEGER PRIMARY KEY AUTOINCREMENT, tbl TEXT NOT NULL, record_id TEXT NOT NULL)")
+        self.tables = {df_name: CachedStore(df_name, store, self) for df_name, store in self.durable.tables.items()}
+        self.credentials = SharedCredentials(self.durable.pool, self.counters)
+
+    def table(self, df_name):
+        return self.tables[df_name]
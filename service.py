@@ -0,0 +1,369 @@
+import argparse
+import asyncio
+import json
+import threading
+import uuid
+from collections import namedtuple
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+
+from auth import HARDCODED_USERS, CredentialStore, LoginBusy
+from ingest import (allowed_roles_for_creation, split_rejected, validate_product_requests, validate_products,
+                    validate_users)
+from metrics import METRICS
+from store import MAX_INT32, REQUEST_FIELDS, ROW_VERSION, SharedBackend, open_backend, resolve_requests
+
+# --- CRUD Service ---
+# The business rules of the app (who may change what, in which company, and
+# when a change has to be proposed for approval instead) independent of
+# Streamlit. The pages, integration jobs and the HTTP endpoint all go through
+# this layer. Every call takes a batch and returns the ids it applied plus a
+# DataFrame of rejected items with the reason, like the bulk ingest does.
+# Updates are compare-and-swap: an update carrying the row_version its record
+# was read with is rejected with CONFLICT if the record changed since, instead
+# of overwriting that change. The lock is only held while a batch is checked
+# and applied, never while a user edits a form.
+
+Actor = namedtuple('Actor', ['email', 'role', 'company'])
+
+MANAGER_ROLES = ["Super Admin", "Admin"]
+CONFLICT = 'the record was changed by someone else since it was loaded'
+
+
+class CrudService:
+    """RBAC-checked, batched create/update/delete/propose/resolve over a backend."""
+
+    def __init__(self, backend, credentials=None):
+        self.backend = backend
+        self.credentials = credentials if credentials is not None else getattr(backend, 'credentials', None)
+        self.lock = getattr(backend, 'lock', None) or threading.RLock()
+
+    @staticmethod
+    def scope(actor):
+        """Returns the store filters limiting an actor to their own company."""
+        return {} if actor.role == "Super Admin" else {'company': actor.company}
+
+    def _current(self, df_name, ids, actor):
+        """Returns the records with the given ids visible to the actor, indexed by key."""
+        store = self.backend.table(df_name)
+        current = store.get_many(pd.unique(pd.Series(ids, dtype=object)))  # Indexed lookups, no table scan
+        for col, value in self.scope(actor).items():
+            current = current[current[col] == value]
+        return current.set_index(store.key)
+
+    # --- Create ---
+
+    @METRICS.timed('service.create')
+    def create(self, actor, df_name, records):
+        """Adds users or products. Returns (new ids, rejected records with reasons)."""
+        batch = pd.DataFrame(list(records))
+        if df_name == 'users_df':
+            return self._create_users(actor, batch)
+        if df_name == 'products_df':
+            with self.lock:
+                valid, rejected = validate_products(batch, actor.role, actor.company)
+                return self._insert(df_name, valid), rejected
+        raise ValueError(f"Records of {df_name} cannot be created directly")
+
+    def _insert(self, df_name, valid):
+        store = self.backend.table(df_name)
+        valid[store.key] = [str(uuid.uuid4()) for _ in range(len(valid))]
+        store.insert_many(valid)
+        return valid[store.key].tolist()
+
+    def _create_users(self, actor, batch):
+        batch = batch.reindex(columns=['name', 'email', 'company', 'role', 'password'])
+        # Hash outside the lock, it is the slow part
+        passwords = batch['password'].fillna('').astype(str)
+        hashes = dict(zip(batch.index, self.credentials.hash_many(passwords.tolist()))) if len(batch) else {}
+        with self.lock:
+            users = self.backend.table('users_df')
+            existing = set(users.find(email=batch['email'].dropna().tolist())['email'])
+            existing.update(email for email in batch['email'].dropna() if email in self.credentials)
+            valid, rejected = validate_users(batch, actor.role, actor.company, existing)
+            self.credentials.register({row.email: {'password_hash': hashes[index], 'role': row.role, 'company': row.company}
+                                       for index, row in valid.iterrows()})
+            ids = self._insert('users_df', valid.drop(columns=['password']))
+        return ids, rejected.drop(columns=['password'])
+
+    # --- Update ---
+
+    @METRICS.timed('service.update')
+    def update(self, actor, df_name, updates):
+        """Applies field updates to users or products. Each update holds the record key plus the
+        fields to change (missing or empty fields stay unchanged) and optionally the row_version
+        it expects the record to have. Returns (updated ids, rejected)."""
+        store = self.backend.table(df_name)
+        batch = pd.DataFrame(list(updates)).reindex(columns=[col for col in store.columns if col != 'email'])
+        batch = batch.loc[:, batch.notna().any() | (batch.columns == store.key)]
+        with self.lock:
+            current = self._current(df_name, batch[store.key], actor)
+            reasons = pd.Series('', index=batch.index)
+            if actor.role not in MANAGER_ROLES:
+                reasons[:] = ('you do not have permission to update users' if df_name == 'users_df'
+                              else 'you can only propose product updates')
+            reasons[~batch[store.key].isin(current.index) & (reasons == '')] = 'record not found in your company'
+            if ROW_VERSION in batch:
+                expected = pd.to_numeric(batch[ROW_VERSION], errors='coerce')
+                stale = expected.notna() & (batch[store.key].map(current[ROW_VERSION]) != expected)
+                reasons[stale & (reasons == '')] = CONFLICT
+            if 'company' in batch and actor.role != "Super Admin":
+                moved = batch['company'].notna() & (batch['company'] != actor.company)
+                reasons[moved & (reasons == '')] = 'company not allowed for your role'
+            if df_name == 'users_df':
+                self._check_user_updates(actor, batch, batch[store.key].map(current['role']), reasons)
+            elif df_name == 'products_df':
+                self._check_product_updates(batch, reasons)
+            else:
+                raise ValueError(f"Records of {df_name} cannot be updated directly")
+            valid, rejected = split_rejected(batch, reasons)
+            store.update_many(valid.drop(columns=[ROW_VERSION], errors='ignore'))  # The store bumps it
+            if df_name == 'users_df':
+                for row in valid.to_dict('records'):
+                    fields = {col: row[col] for col in ['role', 'company'] if col in row and pd.notna(row[col])}
+                    if fields:
+                        self.credentials.update(current.at[row[store.key], 'email'], **fields)
+        return valid[store.key].tolist(), rejected
+
+    @staticmethod
+    def _check_user_updates(actor, batch, target_role, reasons):
+        # Admins only manage plain users and cannot promote them
+        if actor.role == "Admin":
+            reasons[(target_role != "User") & (reasons == '')] = 'you can only manage users with the User role'
+        if 'role' in batch:
+            allowed = batch['role'].isna() | batch['role'].isin(allowed_roles_for_creation(actor.role))
+            reasons[~allowed & (reasons == '')] = 'role not allowed for your role'
+
+    @staticmethod
+    def _check_product_updates(batch, reasons):
+        if 'product_name' in batch:
+            blank = batch['product_name'].notna() & (batch['product_name'].astype(str).str.strip() == '')
+            reasons[blank & (reasons == '')] = 'missing product_name'
+        if 'price' in batch:
+            given = batch['price'].notna()
+            batch['price'] = pd.to_numeric(batch['price'], errors='coerce')
+            reasons[given & ~(batch['price'] >= 0.01) & (reasons == '')] = 'price must be at least 0.01'
+        if 'stock' in batch:
+            given = batch['stock'].notna()
+            batch['stock'] = pd.to_numeric(batch['stock'], errors='coerce')
+            invalid = given & ~((batch['stock'] >= 0) & (batch['stock'] % 1 == 0))
+            reasons[invalid & (reasons == '')] = 'stock must be a non-negative integer'
+            reasons[given & (batch['stock'] > MAX_INT32) & (reasons == '')] = f'stock must be at most {MAX_INT32}'
+
+    # --- Delete ---
+
+    @METRICS.timed('service.delete')
+    def delete(self, actor, df_name, ids):
+        """Deletes users or products by id. Returns (deleted ids, rejected)."""
+        store = self.backend.table(df_name)
+        batch = pd.DataFrame({store.key: list(ids)})
+        with self.lock:
+            current = self._current(df_name, batch[store.key], actor)
+            reasons = pd.Series('', index=batch.index)
+            if actor.role not in MANAGER_ROLES:
+                reasons[:] = ('you do not have permission to delete users' if df_name == 'users_df'
+                              else 'you can only propose product deletions')
+            reasons[~batch[store.key].isin(current.index) & (reasons == '')] = 'record not found in your company'
+            if df_name == 'users_df':
+                emails = batch[store.key].map(current['email'])
+                if actor.role == "Admin":
+                    target_role = batch[store.key].map(current['role'])
+                    reasons[(target_role != "User") & (reasons == '')] = 'you can only manage users with the User role'
+                reasons[(emails == actor.email) & (reasons == '')] = 'you cannot delete yourself'
+            elif df_name != 'products_df':
+                raise ValueError(f"Records of {df_name} cannot be deleted directly")
+            valid, rejected = split_rejected(batch, reasons)
+            store.delete_many(valid[store.key].tolist())
+            if df_name == 'users_df':
+                for email in emails[valid.index]:
+                    self.credentials.remove(email)
+        return valid[store.key].tolist(), rejected
+
+    # --- Product Requests ---
+
+    @METRICS.timed('service.propose')
+    def propose(self, actor, proposals):
+        """Files product change requests for approval. Each proposal has product_id,
+        request_type ('Update' or 'Delete') and, for updates, the proposed product_name,
+        price and/or stock. Returns (request ids, rejected)."""
+        batch = pd.DataFrame(list(proposals))
+        batch = batch.rename(columns={field: f'new_{field}' for field in REQUEST_FIELDS})
+        batch['requested_by_email'] = actor.email
+        batch['status'] = 'Pending'
+        batch['request_date'] = datetime.now().isoformat()
+        with self.lock:
+            products = self._current('products_df', batch.get('product_id', pd.Series(dtype=object)).dropna(), actor)
+            valid, rejected = validate_product_requests(batch, actor.role, actor.company, products)
+            return self._insert_requests(valid), rejected
+
+    def _insert_requests(self, valid):
+        store = self.backend.table('product_requests_df')
+        valid[store.key] = [str(uuid.uuid4()) for _ in range(len(valid))]
+        store.insert_many(valid)
+        return valid[store.key].tolist()
+
+    @METRICS.timed('service.resolve')
+    def resolve(self, actor, request_ids, status, admin_notes=''):
+        """Approves or rejects pending requests of the actor's company in one batch.
+        Returns (resolved request ids, rejected) -- see resolve_requests for conflicts."""
+        request_ids = list(request_ids)
+        if actor.role not in MANAGER_ROLES:
+            return [], self._reject_ids(request_ids, 'you do not have permission to review requests')
+        if status not in ['Approved', 'Rejected']:
+            raise ValueError(f"Unknown status: {status}")
+        if status == 'Rejected' and not admin_notes:
+            return [], self._reject_ids(request_ids, 'a reason is required for rejection')
+        with self.lock:
+            resolved, conflicts = resolve_requests(self.backend.tables, request_ids, status, admin_notes,
+                                                   filters=self.scope(actor))
+        seen = set(resolved) | set(conflicts['request_id'])
+        missing = [request_id for request_id in request_ids if request_id not in seen]
+        if missing:
+            conflicts = pd.concat([conflicts, self._reject_ids(missing, 'request not pending in your company')],
+                                  ignore_index=True)
+        return resolved, conflicts
+
+    @staticmethod
+    def _reject_ids(request_ids, reason):
+        return pd.DataFrame({'request_id': request_ids, 'reason': reason})
+
+
+# --- Async API ---
+# For integration jobs: the same calls as awaitables. Each batch runs in a worker
+# thread, so the event loop keeps serving while a batch is validated and applied.
+
+class AsyncCrudService:
+    """asyncio wrapper of CrudService."""
+
+    def __init__(self, service):
+        self.service = service
+
+    async def create(self, actor, df_name, records):
+        return await asyncio.to_thread(self.service.create, actor, df_name, records)
+
+    async def update(self, actor, df_name, updates):
+        return await asyncio.to_thread(self.service.update, actor, df_name, updates)
+
+    async def delete(self, actor, df_name, ids):
+        return await asyncio.to_thread(self.service.delete, actor, df_name, ids)
+
+    async def propose(self, actor, proposals):
+        return await asyncio.to_thread(self.service.propose, actor, proposals)
+
+    async def resolve(self, actor, request_ids, status, admin_notes=''):
+        return await asyncio.to_thread(self.service.resolve, actor, request_ids, status, admin_notes)
+
+
+# --- HTTP Endpoint ---
+# Optional JSON API on a local port. POST /login with {"email", "password"}
+# returns a session token; the other calls need "Authorization: Bearer <token>":
+#   POST /users|products/create  {"records": [...]}
+#   POST /users|products/update  {"records": [...]}   (with "row_version" for compare-and-swap)
+#   POST /users|products/delete  {"ids": [...]}
+#   POST /requests/propose       {"records": [...]}
+#   POST /requests/resolve       {"ids": [...], "status": "Approved"|"Rejected", "admin_notes": "..."}
+# Responses are {"applied": [ids], "rejected": [items with a "reason"]}.
+
+HTTP_TABLES = {'users': 'users_df', 'products': 'products_df'}
+
+
+def _json_default(value):
+    return value.item() if hasattr(value, 'item') else str(value)
+
+
+def _records(df):
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+
+def make_handler(service):
+    """Returns a request handler class bound to a service."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status, body):
+            data = json.dumps(body, default=_json_default).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _actor(self):
+            token = self.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+            user, _ = service.credentials.check_token(token)
+            if user is None:
+                return None
+            return Actor(token.rsplit('|', 2)[0], user['role'], user['company'])
+
+        def do_POST(self):
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            except ValueError:
+                return self._reply(400, {'error': 'invalid JSON'})
+            if not isinstance(body, dict):
+                return self._reply(400, {'error': 'request body must be a JSON object'})
+            path = self.path.strip('/').split('/')
+            if path == ['login']:
+                try:
+                    user = service.credentials.authenticate(body.get('email', ''), body.get('password', ''))
+                except LoginBusy as e:
+                    return self._reply(503, {'error': str(e)})
+                if user is None:
+                    return self._reply(401, {'error': 'invalid email or password'})
+                return self._reply(200, {'token': service.credentials.issue_token(body['email']), **user})
+            actor = self._actor()
+            if actor is None:
+                return self._reply(401, {'error': 'missing or expired token'})
+            try:
+                if len(path) == 2 and path[0] in HTTP_TABLES and path[1] in ['create', 'update']:
+                    method = getattr(service, path[1])
+                    applied, rejected = method(actor, HTTP_TABLES[path[0]], body.get('records', []))
+                elif len(path) == 2 and path[0] in HTTP_TABLES and path[1] == 'delete':
+                    applied, rejected = service.delete(actor, HTTP_TABLES[path[0]], body.get('ids', []))
+                elif path == ['requests', 'propose']:
+                    applied, rejected = service.propose(actor, body.get('records', []))
+                elif path == ['requests', 'resolve']:
+                    applied, rejected = service.resolve(actor, body.get('ids', []), body.get('status'),
+                                                        body.get('admin_notes', ''))
+                else:
+                    return self._reply(404, {'error': f"unknown endpoint: {self.path}"})
+            except (KeyError, ValueError, TypeError, AttributeError) as e:  # Malformed records or ids
+                return self._reply(400, {'error': f"invalid request: {e}"})
+            self._reply(200, {'applied': applied, 'rejected': _records(rejected)})
+
+        def log_message(self, format, *args):
+            pass  # Keep the Streamlit console quiet
+
+    return Handler
+
+
+def start_http_server(service, host='127.0.0.1', port=8765):
+    """Serves the JSON API in a background thread. Returns the server."""
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    threading.Thread(target=server.serve_forever, name='crud-http', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the CRUD JSON API without the Streamlit UI.")
+    parser.add_argument('--storage', default='sqlite', choices=['memory', 'sqlite', 'multiprocess'])
+    parser.add_argument('--path', default=None, help="SQLite database file")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    backend = open_backend(args.storage, args.path)
+    credentials = getattr(backend, 'credentials', None)  # Stored in the file by the SQLite backends, shared with the UI
+    if credentials is None:
+        credentials = CredentialStore()
+    if len(credentials) == 0:
+        credentials.add_many(HARDCODED_USERS)
+    service = CrudService(SharedBackend(backend, credentials))
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(service))
+    print(f"Serving on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,448 @@
+import json
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import cached_property
+
+import pandas as pd
+
+from auth import CredentialStore, hash_password
+from store import CHUNKSIZE, RANK_LENGTH_BITS, ROW_VERSION, TABLES, Schema, request_diff, request_snapshot, with_row_version
+
+# --- SQLite Storage Backend ---
+# Persists all tables in a local SQLite file in WAL mode, so readers never block
+# the writer. Connections are pooled and shared across Streamlit sessions.
+# Filters are pushed down to indexed SQL, so views only load the rows they need.
+# Searched columns are mirrored into an FTS5 trigram table kept in sync by
+# triggers, so substring searches do not scan the table.
+
+DEFAULT_PATH = 'crud.db'
+POOL_SIZE = 4
+MAX_PARAMS = 500  # Ids bound per IN (...) query, below SQLite's parameter limit
+
+SQL_TYPES = {  # Everything else is TEXT
+    'price': 'REAL', 'old_price': 'REAL', 'new_price': 'REAL',
+    'stock': 'INTEGER', 'old_stock': 'INTEGER', 'new_stock': 'INTEGER',
+    'product_version': 'INTEGER', ROW_VERSION: 'INTEGER NOT NULL DEFAULT 1',  # Existing rows start at 1
+}
+
+
+def _to_sql(value):
+    """Converts a Python/numpy value to something sqlite3 can bind."""
+    if hasattr(value, 'item'):  # numpy scalar
+        return value.item()
+    if value is not None and pd.isna(value):
+        return None
+    return value
+
+
+class ConnectionPool:
+    """Fixed-size pool of SQLite connections to one database file."""
+
+    def __init__(self, path, size=POOL_SIZE):
+        self._pool = queue.Queue()
+        for _ in range(size):
+            conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._pool.put(conn)
+        self._watcher = sqlite3.connect(path, check_same_thread=False)  # Only asked for data_version
+        self._watcher_lock = threading.Lock()
+
+    def data_version(self):
+        """Returns a number that changes with every write committed to the file by any connection,
+        of this process or another one (PRAGMA data_version of a connection that never writes)."""
+        with self._watcher_lock:
+            return self._watcher.execute('PRAGMA data_version').fetchone()[0]
+
+    @contextmanager
+    def connection(self):
+        """Borrows a connection; commits on success and rolls back on error."""
+        conn = self._pool.get()
+        try:
+            with conn:
+                yield conn
+        finally:
+            self._pool.put(conn)
+
+
+class SQLiteStore:
+    """Table stored in SQLite, with the same interface as RecordStore."""
+
+    def __init__(self, pool, df_name):
+        table = TABLES[df_name]
+        self.pool = pool
+        self.table = table['table']
+        self.columns = table['columns']
+        self.key = table['key']
+        self.prefix_column = table.get('prefix_index')
+        self.search_columns = table.get('search_index')
+        self.schema = Schema(table.get('dtypes'))  # Applied to every frame read back
+        with self.pool.connection() as conn:
+            column_defs = ', '.join(
+                f"{col} {SQL_TYPES.get(col, 'TEXT')}{' PRIMARY KEY' if col == self.key else ''}"
+                for col in self.columns
+            )
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {self.table} ({column_defs})")
+            # Add columns introduced after the database file was created
+            existing = {row[1] for row in conn.execute(f"PRAGMA table_info({self.table})")}
+            for col in self.columns:
+                if col not in existing:
+                    conn.execute(f"ALTER TABLE {self.table} ADD COLUMN {col} {SQL_TYPES.get(col, 'TEXT')}")
+            for cols in table['indexes']:
+                cols = cols if isinstance(cols, tuple) else (cols,)
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_{'_'.join(cols)} "
+                             f"ON {self.table} ({', '.join(cols)})")
+            if self.prefix_column:
+                # Expression indexes so that case-insensitive prefix ranges are index scans
+                prefix = f"lower({self.prefix_column})"
+                conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_prefix ON {self.table} ({prefix})")
+                if table.get('partition_by'):
+                    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{self.table}_{table['partition_by']}_prefix "
+                                 f"ON {self.table} ({table['partition_by']}, {prefix})")
+            if self.search_columns:
+                self._create_search_table(conn)
+
+    @property
+    def version(self):
+        """Changes with every write to the file, so cached views also notice writes of other processes
+        (e.g. the standalone service.py). Writes to the other tables of the file change it too."""
+        return self.pool.data_version()
+
+    def _create_search_table(self, conn):
+        """Creates the FTS5 trigram table over the searched columns and the triggers that keep it in sync."""
+        fts = f"{self.table}_search"
+        cols = ', '.join(self.search_columns)
+        new = ', '.join(f"new.{col}" for col in self.search_columns)
+        old = ', '.join(f"old.{col}" for col in self.search_columns)
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,)).fetchone()
+        conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({cols}, content='{self.table}', "
+                     f"content_rowid='rowid', tokenize='trigram')")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {self.table} BEGIN "
+                     f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.rowid, {new}); END")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {self.table} BEGIN "
+                     f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.rowid, {old}); END")
+        conn.execute(f"CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {cols} ON {self.table} BEGIN "
+                     f"INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.rowid, {old}); "
+                     f"INSERT INTO {fts}(rowid, {cols}) VALUES (new.rowid, {new}); END")
+        if not exists:
+            conn.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")  # Index the rows already stored
+
+    def __len__(self):
+        with self.pool.connection() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+
+    def __contains__(self, record_id):
+        with self.pool.connection() as conn:
+            return conn.execute(f"SELECT 1 FROM {self.table} WHERE {self.key} = ?", (record_id,)).fetchone() is not None
+
+    def _insert_sql(self):
+        return f"INSERT INTO {self.table} ({', '.join(self.columns)}) VALUES ({', '.join('?' * len(self.columns))})"
+
+    def insert(self, record):
+        """Inserts a record."""
+        record = with_row_version(record)
+        try:
+            with self.pool.connection() as conn:
+                conn.execute(self._insert_sql(), [_to_sql(record.get(col)) for col in self.columns])
+        except sqlite3.IntegrityError:
+            raise KeyError(f"Duplicate {self.key}: {record[self.key]}")
+
+    def insert_many(self, records):
+        """Inserts a batch of records (DataFrame or list of dicts) in one transaction."""
+        batch = records if isinstance(records, pd.DataFrame) else pd.DataFrame(list(records))
+        if batch.empty:
+            return 0
+        batch = batch.reindex(columns=self.columns)
+        batch[ROW_VERSION] = batch[ROW_VERSION].fillna(1).astype('int64')
+        rows = ([_to_sql(value) for value in row] for row in batch.itertuples(index=False, name=None))
+        try:
+            with self.pool.connection() as conn:
+                conn.executemany(self._insert_sql(), rows)
+        except sqlite3.IntegrityError:
+            raise KeyError(f"Duplicate {self.key} in batch")
+        return len(batch)
+
+    def get(self, record_id):
+        """Returns the record as a Series, or None if it does not exist."""
+        df = self._query(f"WHERE {self.key} = ?", [record_id])
+        return df.iloc[0] if not df.empty else None
+
+    def get_many(self, record_ids):
+        """Returns the existing records among record_ids as a DataFrame."""
+        record_ids = list(record_ids)
+        chunks = [record_ids[i:i + MAX_PARAMS] for i in range(0, len(record_ids), MAX_PARAMS)]
+        frames = [self._query(f"WHERE {self.key} IN ({', '.join('?' * len(chunk))})", chunk) for chunk in chunks]
+        if not frames:
+            return self._query("WHERE 0")
+        return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+    def update(self, record_id, updated_data):
+        """Updates fields of a record and bumps its row_version. Returns False if not found."""
+        updates = {key: value for key, value in updated_data.items() if key not in (self.key, ROW_VERSION)}
+        if not updates:
+            return record_id in self
+        assignments = ', '.join([f"{col} = ?" for col in updates] + [f"{ROW_VERSION} = {ROW_VERSION} + 1"])
+        with self.pool.connection() as conn:
+            cursor = conn.execute(
+                f"UPDATE {self.table} SET {assignments} WHERE {self.key} = ?",
+                [_to_sql(value) for value in updates.values()] + [record_id]
+            )
+        return cursor.rowcount > 0
+
+    def update_many(self, updates):
+        """Applies a batch of updates (DataFrame with the key column) in one transaction.
+        Empty cells leave the field unchanged and every updated record gets a new row_version.
+        Returns the number of records updated."""
+        columns = [col for col in updates.columns if col not in (self.key, ROW_VERSION)]
+        if updates.empty or not columns:
+            return 0
+        assignments = ', '.join([f"{col} = COALESCE(?, {col})" for col in columns] + [f"{ROW_VERSION} = {ROW_VERSION} + 1"])
+        rows = ([_to_sql(value) for value in row] for row in updates[columns + [self.key]].itertuples(index=False, name=None))
+        with self.pool.connection() as conn:
+            updated = conn.executemany(f"UPDATE {self.table} SET {assignments} WHERE {self.key} = ?", rows).rowcount
+        return updated
+
+    def delete(self, record_id):
+        """Deletes a record. Returns False if not found."""
+        with self.pool.connection() as conn:
+            deleted = conn.execute(f"DELETE FROM {self.table} WHERE {self.key} = ?", (record_id,)).rowcount > 0
+        return deleted
+
+    def delete_many(self, record_ids):
+        """Deletes a batch of records in one transaction. Returns the number deleted."""
+        with self.pool.connection() as conn:
+            deleted = conn.executemany(f"DELETE FROM {self.table} WHERE {self.key} = ?",
+                                       [(record_id,) for record_id in record_ids]).rowcount
+        return deleted
+
+    def flush(self):
+        pass  # Writes are not buffered
+
+    def compact(self):
+        pass  # SQLite reclaims deleted rows itself
+
+    def _query(self, clause='', params=()):
+        with self.pool.connection() as conn:
+            df = pd.read_sql_query(f"SELECT {', '.join(self.columns)} FROM {self.table} {clause}", conn, params=list(params))
+        return self.schema.conform(df)
+
+    def frame(self):
+        """Returns all rows as a DataFrame."""
+        return self._query()
+
+    def _where(self, filters, search=None):
+        """Builds a WHERE clause from equality filters and substring searches."""
+        conditions, params = [], []
+        for col, value in filters.items():
+            self._check_column(col)
+            if isinstance(value, (list, set, tuple)):
+                value = list(value)
+                conditions.append(f"{col} IN ({', '.join('?' * len(value))})" if value else "0")
+                params.extend(_to_sql(v) for v in value)
+            else:
+                conditions.append(f"{col} = ?")
+                params.append(_to_sql(value))
+        for col, text in (search or {}).items():
+            if text:
+                self._check_column(col)
+                conditions.append(f"{col} LIKE ? ESCAPE '\\'")
+                escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+                params.append(f"%{escaped}%")
+        return (f"WHERE {' AND '.join(conditions)}" if conditions else ''), params
+
+    def _check_column(self, col):
+        if col not in self.columns:
+            raise ValueError(f"Unknown column for {self.table}: {col}")
+
+    def find(self, **filters):
+        """Returns the rows matching all filters (value or list of values per column)."""
+        return self._query(*self._where(filters))
+
+    def page(self, filters=None, search=None, sort_by=None, ascending=True, offset=0, limit=50):
+        """Returns (rows of one page, total matching rows), filtered, sorted and sliced in SQL."""
+        where, params = self._where(filters or {}, search)
+        with self.pool.connection() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM {self.table} {where}", params).fetchone()[0]
+        order = ''
+        if sort_by:
+            self._check_column(sort_by)
+            order = f"ORDER BY {sort_by} {'ASC' if ascending else 'DESC'}"
+        return self._query(f"{where} {order} LIMIT ? OFFSET ?", params + [int(limit), int(offset)]), total
+
+    def count(self, **filters):
+        """Returns the number of rows matching all filters."""
+        where, params = self._where(filters)
+        with self.pool.connection() as conn:
+            return conn.execute(f"SELECT COUNT(*) FROM {self.table} {where}", params).fetchone()[0]
+
+    def prefix_search(self, prefix, filters=None, limit=50):
+        """Returns up to `limit` rows whose prefix column starts with prefix, in value order."""
+        where, params = self._where(filters or {})
+        prefix = prefix.lower()
+        column = f"lower({self.prefix_column})"
+        if prefix:
+            where = f"{where} {'AND' if where else 'WHERE'} {column} >= ? AND {column} < ?"
+            params = params + [prefix, prefix + '\uffff']
+        return self._query(f"{where} ORDER BY {column} LIMIT ?", params + [int(limit)])
+
+    def search(self, text, filters=None, limit=50):
+        """Returns up to `limit` rows matching text (a substring of a searched column), best match first.
+        Ranked like TrigramIndex: whole value, value prefix, word prefix, any substring, then shorter values."""
+        query = ' '.join(str(text).lower().split())
+        if not query:
+            return self._query('LIMIT 0')
+        where, params = self._where(filters or {})
+        escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+        ranks, rank_params = [], []
+        for col in self.search_columns:
+            value = f"lower({col})"
+            ranks.append(f"((CASE WHEN {value} = ? THEN 0 WHEN {value} LIKE ? ESCAPE '\\' THEN 1 "
+                         f"WHEN {value} LIKE ? ESCAPE '\\' THEN 2 WHEN ? AND instr({value}, ?) THEN 3 ELSE 4 END) "
+                         f"<< {RANK_LENGTH_BITS}) + length({col})")
+            rank_params += [query, f"{escaped}%", f"% {escaped}%", len(query) >= 3, query]
+        rank = ranks[0] if len(ranks) == 1 else f"min({', '.join(ranks)})"
+        if len(query) >= 3:
+            # The trigram table narrows the candidates down to rows containing the query
+            match = f"rowid IN (SELECT rowid FROM {self.table}_search WHERE {self.table}_search MATCH ?)"
+            params = params + ['"' + query.replace('"', '""') + '"']
+        else:
+            match = ' OR '.join(f"lower({col}) LIKE ? ESCAPE '\\' OR lower({col}) LIKE ? ESCAPE '\\'"
+                                for col in self.search_columns)
+            params = params + [f"{escaped}%", f"% {escaped}%"] * len(self.search_columns)
+        where = f"{where} {'AND' if where else 'WHERE'} ({match})"
+        columns = ', '.join(self.columns)
+        sql = (f"SELECT {columns} FROM (SELECT {columns}, rowid, {rank} AS search_rank FROM {self.table} {where}) "
+               f"WHERE search_rank < ? ORDER BY search_rank, rowid LIMIT ?")
+        with self.pool.connection() as conn:
+            df = pd.read_sql_query(sql, conn, params=rank_params + params + [4 << RANK_LENGTH_BITS, int(limit)])
+        return self.schema.conform(df)
+
+    def iter_chunks(self, filters=None, chunksize=CHUNKSIZE):
+        """Yields the rows matching the filters in chunks of at most chunksize rows. They are read by one
+        query, which sees a snapshot of the table (WAL), so writes made while iterating do not show up."""
+        where, params = self._where(filters or {})
+        with self.pool.connection() as conn:
+            chunks = pd.read_sql_query(f"SELECT {', '.join(self.columns)} FROM {self.table} {where} ORDER BY rowid",
+                                       conn, params=params, chunksize=chunksize)
+            for chunk in chunks:
+                yield self.schema.conform(chunk)
+
+    def distinct(self, column):
+        """Returns the distinct values of a column, in order of first appearance."""
+        with self.pool.connection() as conn:
+            rows = conn.execute(f"SELECT {column} FROM {self.table} GROUP BY {column} ORDER BY MIN(rowid)").fetchall()
+        return [row[0] for row in rows]
+
+
+def _migrate_request_data(conn):
+    """Converts requests stored with old_data/new_data JSON columns into field-level diffs."""
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(product_requests)")}
+    if 'old_data' not in columns:
+        return
+    rows = conn.execute("SELECT request_id, request_type, old_data, new_data FROM product_requests").fetchall()
+    for request_id, request_type, old_data, new_data in rows:
+        old_data = json.loads(old_data) if old_data else {}
+        new_data = json.loads(new_data) if new_data else {}
+        if request_type == 'Delete':
+            diff = request_snapshot(old_data)
+        else:
+            diff = request_diff(old_data, new_data)
+        if diff:
+            conn.execute(
+                f"UPDATE product_requests SET {', '.join(f'{col} = ?' for col in diff)} WHERE request_id = ?",
+                [_to_sql(value) for value in diff.values()] + [request_id]
+            )
+    conn.execute("ALTER TABLE product_requests DROP COLUMN old_data")
+    conn.execute("ALTER TABLE product_requests DROP COLUMN new_data")
+
+
+class SQLiteBackend:
+    """Keeps all tables in one SQLite database file."""
+
+    persistent = True
+
+    def __init__(self, path=None):
+        self.path = path or DEFAULT_PATH
+        self.pool = ConnectionPool(self.path)
+        self.tables = {df_name: SQLiteStore(self.pool, df_name) for df_name in TABLES}
+        with self.pool.connection() as conn:
+            # Requests created before they carried their product's company
+            conn.execute(
+                "UPDATE product_requests SET company = "
+                "(SELECT company FROM products WHERE products.id = product_requests.product_id) "
+                "WHERE company IS NULL"
+            )
+            _migrate_request_data(conn)
+
+    @cached_property
+    def credentials(self):
+        """Login credentials, kept in the same file (see SQLiteCredentials)."""
+        return SQLiteCredentials(self.pool)
+
+    def table(self, df_name):
+        return self.tables[df_name]
+
+
+# --- Stored Credentials ---
+
+class SQLiteCredentials(CredentialStore):
+    """CredentialStore kept in the SQLite file, so added, changed and removed users survive a restart.
+    Changes are written to the file first and then to the in-memory copy logins are checked against.
+    The token secret is stored too, so session tokens stay valid across restarts."""
+
+    def __init__(self, pool, **kwargs):
+        super().__init__(**kwargs)
+        self._db = pool
+        with pool.connection() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS credentials "
+                         "(email TEXT PRIMARY KEY, password_hash TEXT NOT NULL, role TEXT, company TEXT)")
+            conn.execute("CREATE TABLE IF NOT EXISTS credential_secret (id INTEGER PRIMARY KEY CHECK (id = 1), secret BLOB)")
+            conn.execute("INSERT OR IGNORE INTO credential_secret VALUES (1, ?)", (self._secret,))
+            self._secret = conn.execute("SELECT secret FROM credential_secret").fetchone()[0]
+        self._load()
+
+    def _load(self):
+        """Replaces the in-memory copy with the stored credentials."""
+        with self._db.connection() as conn:
+            rows = conn.execute("SELECT email, password_hash, role, company FROM credentials").fetchall()
+        with self._lock:
+            self._users = {email: {'password_hash': password_hash, 'role': role, 'company': company}
+                           for email, password_hash, role, company in rows}
+
+    def _write(self, sql, rows, apply):
+        """Runs a change on the stored table and then on the in-memory copy. Returns the number of rows changed."""
+        with self._db.connection() as conn:
+            changed = conn.executemany(sql, rows).rowcount
+        if changed:
+            apply()
+        return changed
+
+    def add(self, email, password, role, company, iterations=None):
+        password_hash = self._run(hash_password, password, iterations or self.iterations)
+        details = {'password_hash': password_hash, 'role': role, 'company': company}
+        return bool(self._write("INSERT OR IGNORE INTO credentials VALUES (?, ?, ?, ?)",
+                                [(email, password_hash, role, company)],
+                                lambda: super(SQLiteCredentials, self).register({email: details})))
+
+    def register(self, users):
+        self._write("INSERT OR REPLACE INTO credentials VALUES (?, ?, ?, ?)",
+                    [(email, d['password_hash'], d['role'], d['company']) for email, d in users.items()],
+                    lambda: super(SQLiteCredentials, self).register(users))
+
+    def update(self, email, **fields):
+        fields = {col: value for col, value in fields.items() if col in ('role', 'company')}
+        if not fields:
+            return email in self
+        return bool(self._write(f"UPDATE credentials SET {', '.join(f'{col} = ?' for col in fields)} WHERE email = ?",
+                                [(*fields.values(), email)], lambda: super(SQLiteCredentials, self).update(email, **fields)))
+
+    def remove(self, email):
+        self._write("DELETE FROM credentials WHERE email = ?", [(email,)],
+                    lambda: super(SQLiteCredentials, self).remove(email))
+
+    def _replace_hash(self, email, old_hash, new_hash):
+        self._write("UPDATE credentials SET password_hash = ? WHERE email = ? AND password_hash = ?",
+                    [(new_hash, email, old_hash)],
+                    lambda: super(SQLiteCredentials, self)._replace_hash(email, old_hash, new_hash))
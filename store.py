@@ -0,0 +1,1331 @@
+import bisect
+import heapq
+import threading
+from array import array
+from collections import OrderedDict, deque, namedtuple
+from datetime import datetime
+from itertools import chain, islice
+
+import numpy as np
+import pandas as pd
+
+# --- Table Definitions ---
+# 'table' is the name used by persistent backends, 'indexes' the columns they index.
+# 'partition_by' splits the in-memory store into one partition per tenant (company).
+# 'prefix_index' is the column the record pickers search by prefix (typeahead).
+# 'search_index' are the columns of the search boxes (substring search, see TrigramIndex).
+# 'secondary_index' maps each value of a column to its records, e.g. the pending
+# requests of a company (partition) without scanning its whole request history.
+# Index entries that are tuples are composite indexes.
+# 'dtypes' are the compact column types, see Schema.
+# Every table has a row_version column, see Row Versions.
+TABLES = {
+    'users_df': {
+        'table': 'users',
+        'columns': ['id', 'name', 'email', 'company', 'role', 'row_version'],
+        'key': 'id',
+        'indexes': ['company'],
+        'partition_by': 'company',
+        'prefix_index': 'email',
+        'search_index': ['name', 'email'],
+        'dtypes': {'id': 'str', 'name': 'str', 'email': 'str', 'company': 'category', 'role': 'category',
+                   'row_version': 'int64'},
+    },
+    'products_df': {
+        'table': 'products',
+        'columns': ['id', 'product_name', 'price', 'stock', 'company', 'row_version'],
+        'key': 'id',
+        'indexes': ['company'],
+        'partition_by': 'company',
+        'prefix_index': 'product_name',
+        'search_index': ['product_name'],
+        'dtypes': {'id': 'str', 'product_name': 'str', 'price': 'float64', 'stock': 'int32', 'company': 'category',
+                   'row_version': 'int64'},
+    },
+    # Product Request Statuses: 'Pending', 'Approved', 'Rejected'
+    # 'company' is the company of the product at the time of the request.
+    # Changes are stored as field-level diffs, see REQUEST_FIELDS.
+    # 'product_version' is the row_version of the product when the request was made.
+    'product_requests_df': {
+        'table': 'product_requests',
+        'columns': ['request_id', 'product_id', 'product_version', 'company', 'request_type',
+                    'old_product_name', 'new_product_name', 'old_price', 'new_price', 'old_stock', 'new_stock',
+                    'requested_by_email', 'status', 'admin_notes', 'request_date', 'approval_date', 'row_version'],
+        'key': 'request_id',
+        'indexes': ['status', 'product_id', ('company', 'status')],
+        'partition_by': 'company',
+        'prefix_index': 'request_id',
+        'search_index': ['requested_by_email'],
+        'secondary_index': 'status',
+        'dtypes': {'request_id': 'str', 'product_id': 'str', 'product_version': 'Int64', 'company': 'category',
+                   'request_type': 'category', 'old_product_name': 'str', 'new_product_name': 'str',
+                   'old_price': 'float64', 'new_price': 'float64', 'old_stock': 'Int32', 'new_stock': 'Int32',
+                   'requested_by_email': 'str', 'status': 'category', 'admin_notes': 'str', 'request_date': 'str',
+                   'approval_date': 'str', 'row_version': 'int64'},
+    },
+}
+
+# --- Column Types ---
+# Low-cardinality strings (company, role, status, request type) are stored as
+# categoricals, stock as int32 (nullable Int32 in requests, where unchanged
+# fields are empty) and all other strings, ids included, in pandas' string
+# dtype (arrow-backed when pyarrow is installed) instead of Python objects.
+# Ids stay canonical strings rather than 128-bit binaries: they are the record
+# keys of the UI, the HTTP API and the indexes, which hold them as strings anyway.
+# Every write casts its values to these dtypes, so they never degrade to object.
+MAX_INT32 = 2**31 - 1
+
+
+# --- Row Versions ---
+# Every record carries a row_version: 1 when inserted, bumped by every update
+# (whatever the caller passes for it). A writer that read a record at version v
+# can then tell whether someone changed it since, without holding a lock
+# between reading and writing (optimistic concurrency, see CrudService.update).
+ROW_VERSION = 'row_version'
+
+
+def with_row_version(record):
+    """Returns the record with row_version 1 if it has none yet."""
+    return dict(record, **{ROW_VERSION: 1}) if _is_empty(record.get(ROW_VERSION)) else record
+
+
+class Schema:
+    """Column dtypes of a table. A categorical column has one sorted, growing set of
+    categories for the whole table, shared by its partitions, so their frames
+    concatenate without falling back to plain strings."""
+
+    def __init__(self, dtypes=None):
+        self.dtypes = {col: pd.CategoricalDtype([]) if dtype == 'category' else pd.api.types.pandas_dtype(dtype)
+                       for col, dtype in (dtypes or {}).items()}
+        self.generation = 0  # Bumped whenever categories grow
+
+    def empty(self, columns):
+        """Returns an empty frame with the schema dtypes."""
+        return pd.DataFrame({col: pd.Series(dtype=self.dtypes.get(col, object)) for col in columns})
+
+    def learn(self, col, values):
+        """Adds the values of a categorical column that are not categories yet."""
+        dtype = self.dtypes.get(col)
+        if not isinstance(dtype, pd.CategoricalDtype):
+            return
+        new = [value for value in pd.unique(pd.Series(values).dropna()) if value not in dtype.categories]
+        if new:
+            self.dtypes[col] = pd.CategoricalDtype(sorted({*dtype.categories, *new}, key=str))
+            self.generation += 1
+
+    def cast(self, col, values):
+        """Returns values as an array of the dtype of col."""
+        self.learn(col, values)
+        values = pd.Series(values)
+        return (values.astype(self.dtypes[col]) if col in self.dtypes else values).array
+
+    def apply(self, df):
+        """Returns df with the schema dtypes, casting only the columns that differ
+        (e.g. categoricals whose categories grew since)."""
+        changed = {col: self.dtypes[col] for col, dtype in df.dtypes.items() if col in self.dtypes and dtype != self.dtypes[col]}
+        return df.astype(changed) if changed else df
+
+    def conform(self, df):
+        """Learns the new categories of an incoming batch and returns it with the schema dtypes."""
+        for col in df.columns:
+            self.learn(col, df[col])
+        return self.apply(df)
+
+
+# --- Product Request Diffs ---
+# Instead of full copies of the product row, a request keeps old_<field> and
+# new_<field> only for the fields it changes (the rest stay empty). A Delete
+# request keeps the old values of all fields as a snapshot of what was deleted.
+REQUEST_FIELDS = ['product_name', 'price', 'stock']
+
+
+_MISSING = object()
+
+
+def _is_empty(value):
+    return value is None or (not isinstance(value, str) and pd.isna(value))
+
+
+def request_diff(product, new_data):
+    """Returns the old_/new_ request columns for the fields new_data changes in product."""
+    diff = {}
+    for field in REQUEST_FIELDS:
+        if field in new_data and new_data[field] != product[field]:
+            diff[f'old_{field}'] = product[field]
+            diff[f'new_{field}'] = new_data[field]
+    return diff
+
+
+def request_snapshot(product):
+    """Returns the old_ request columns holding all fields of product (for deletes)."""
+    return {f'old_{field}': product[field] for field in REQUEST_FIELDS}
+
+
+def request_changes(request):
+    """Returns ({field: old value}, {field: new value}) for the fields stored in a request."""
+    old = {field: request[f'old_{field}'] for field in REQUEST_FIELDS if not _is_empty(request[f'old_{field}'])}
+    new = {field: request[f'new_{field}'] for field in REQUEST_FIELDS if not _is_empty(request[f'new_{field}'])}
+    return old, new
+
+
+# --- Prefix Index ---
+# Sorted list of (lowercased value, record id) pairs. A prefix lookup is a
+# binary search for the first match followed by a walk over the matches in order.
+
+class PrefixIndex:
+    """Case-insensitive prefix index over one column."""
+
+    def __init__(self):
+        self._entries = []
+
+    @staticmethod
+    def _normalize(value):
+        return '' if _is_empty(value) else str(value).lower()
+
+    def add(self, value, record_id):
+        bisect.insort(self._entries, (self._normalize(value), record_id))
+
+    def add_many(self, values, record_ids):
+        self._entries.extend(zip(map(self._normalize, values), record_ids))
+        self._entries.sort()
+
+    def remove(self, value, record_id):
+        entry = (self._normalize(value), record_id)
+        pos = bisect.bisect_left(self._entries, entry)
+        if pos < len(self._entries) and self._entries[pos] == entry:
+            del self._entries[pos]
+
+    def search(self, prefix):
+        """Yields the ids of records whose value starts with prefix, in value order."""
+        prefix = self._normalize(prefix)
+        pos = bisect.bisect_left(self._entries, (prefix,))
+        while pos < len(self._entries) and self._entries[pos][0].startswith(prefix):
+            yield self._entries[pos][1]
+            pos += 1
+
+
+# --- Trigram Search Index ---
+# Maps every 3-character substring (trigram) of the lowercased values of the
+# searched columns to the records containing it. Word starts are also indexed
+# as ' x' and ' xy', so queries of one or two characters match words starting
+# with them. A query is looked up as the intersection of the posting lists of
+# its trigrams; the candidates are then checked against the query and ranked
+# (vectorized): whole value, value prefix, word prefix, then any substring,
+# shorter values first, then older records first.
+# Records get ascending document numbers, so posting lists are sorted arrays
+# that intersect with numpy. Removed records are skipped until enough of them
+# have piled up to rebuild the lists.
+
+RANK_LENGTH_BITS = 32  # A rank is match class << RANK_LENGTH_BITS | length of the matched value
+
+
+class TrigramIndex:
+    """Case-insensitive substring index over one or more columns, with ranked results."""
+
+    def __init__(self):
+        self._postings = {}  # gram -> array of document numbers, ascending
+        self._docs = []      # document number -> record id (None once removed)
+        self._texts = []     # document number -> normalized values (None once removed)
+        self._doc_of = {}    # record id -> document number
+
+    def __len__(self):
+        return len(self._doc_of)
+
+    @staticmethod
+    def normalize(value):
+        return '' if _is_empty(value) else ' '.join(str(value).lower().split())
+
+    @staticmethod
+    def _grams(texts):
+        grams = set()
+        for text in texts:
+            if text:
+                padded = f' {text} '
+                grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+                grams.update(padded[i:i + 2] for i in range(len(padded) - 1) if padded[i] == ' ')
+        return grams
+
+    def add(self, record_id, values):
+        """Indexes (or re-indexes) a record by the values of the searched columns."""
+        self.add_many([record_id], [values])
+
+    def add_many(self, record_ids, rows):
+        """Indexes a batch of records; rows holds the values of the searched columns per record."""
+        new = {}  # gram -> new document numbers, appended to the posting lists at once
+        for record_id, values in zip(record_ids, rows):
+            self._discard(record_id)  # No renumbering while `new` holds document numbers
+            texts = tuple(map(self.normalize, values))
+            doc = len(self._docs)
+            self._docs.append(record_id)
+            self._texts.append(texts)
+            self._doc_of[record_id] = doc
+            for gram in self._grams(texts):
+                docs = new.get(gram)
+                if docs is None:
+                    new[gram] = [doc]
+                else:
+                    docs.append(doc)
+        for gram, docs in new.items():
+            postings = self._postings.get(gram)
+            if postings is None:
+                self._postings[gram] = array('q', docs)
+            else:
+                postings.extend(docs)
+        self._compact()
+
+    def remove(self, record_id):
+        self._discard(record_id)
+        self._compact()
+
+    def _discard(self, record_id):
+        """Marks the document of a record as removed, it stays in the posting lists until _compact."""
+        doc = self._doc_of.pop(record_id, None)
+        if doc is not None:
+            self._docs[doc] = self._texts[doc] = None
+
+    def _compact(self):
+        if len(self._docs) - len(self._doc_of) > max(1024, len(self._doc_of)):
+            self._rebuild()
+
+    def _rebuild(self):
+        """Renumbers the live records, dropping removed ones from the posting lists."""
+        live = [(record_id, texts) for record_id, texts in zip(self._docs, self._texts) if record_id is not None]
+        self.__init__()
+        self.add_many([record_id for record_id, _ in live], [texts for _, texts in live])  # Already normalized
+
+    def search(self, text):
+        """Yields (rank, record id) of all records matching text, best (lowest rank) first."""
+        query = self.normalize(text)
+        if not query:
+            return
+        grams = {query[i:i + 3] for i in range(len(query) - 2)} if len(query) >= 3 else {' ' + query}
+        postings = sorted((self._postings.get(gram, ()) for gram in grams), key=len)
+        if not postings[0]:
+            return
+        docs = np.frombuffer(postings[0], dtype=np.int64)
+        for other in postings[1:]:
+            docs = np.intersect1d(docs, np.frombuffer(other, dtype=np.int64), assume_unique=True)
+        docs = [doc for doc in docs.tolist() if self._docs[doc] is not None]
+        if not docs:
+            return
+        # Trigrams only narrow the candidates down, check and rank them per column
+        ranks = np.full(len(docs), np.iinfo(np.int64).max)
+        for values in zip(*(self._texts[doc] for doc in docs)):
+            values = pd.Series(values, dtype='str')
+            match_class = np.select(
+                [values == query, values.str.startswith(query),
+                 (' ' + values).str.contains(' ' + query, regex=False),
+                 values.str.contains(query, regex=False) & (len(query) >= 3)],
+                [0, 1, 2, 3], 4)
+            column_ranks = (match_class.astype(np.int64) << RANK_LENGTH_BITS) | values.str.len().to_numpy(dtype=np.int64)
+            ranks = np.where(match_class < 4, np.minimum(ranks, column_ranks), ranks)
+        matched = np.flatnonzero(ranks < (4 << RANK_LENGTH_BITS))
+        order = matched[np.argsort(ranks[matched], kind='stable')]
+        for rank, i in zip(ranks[order].tolist(), order.tolist()):
+            yield rank, self._docs[docs[i]]
+
+
+# --- Indexed Record Store ---
+# Keeps a table as a pandas DataFrame plus an id -> row position map, so that
+# lookups, updates and deletes do not have to scan the whole frame.
+# Deleted rows are tombstoned in place and only physically removed when
+# enough of them have piled up (compaction), instead of copying on every delete.
+# New rows are collected in a columnar append buffer and merged into the frame
+# in batches that grow with the frame, so N inserts cost amortized O(N).
+# `version` is bumped on every mutation, so derived data can be cached per version.
+
+CHUNKSIZE = 100_000  # Rows per chunk of iter_chunks
+
+
+class RecordStore:
+    """In-memory table indexed by its key column."""
+
+    def __init__(self, columns, key='id', prefix_column=None, secondary_column=None, compact_ratio=0.25, batch_size=1024,
+                 schema=None, search_columns=None):
+        self.columns = list(columns)
+        self.key = key
+        self.schema = schema or Schema()
+        self.prefix_column = prefix_column
+        self.secondary_column = secondary_column
+        self.search_columns = list(search_columns or [])
+        self.compact_ratio = compact_ratio
+        self.batch_size = batch_size
+        self.version = 0
+        self._versioned = ROW_VERSION in self.columns
+        self._prefix = PrefixIndex() if prefix_column else None
+        self._secondary = {}  # secondary column value -> {record id: None}, in insertion order
+        self._search = None  # TrigramIndex, built on the first search
+        self._df = self.schema.empty(self.columns)
+        self._synced = self.schema.generation  # Schema generation the dtypes of _df match
+        self._index = {}   # record id -> row position (buffered rows included)
+        self._dead = set()  # row positions of deleted (tombstoned) records
+        self._buffer = {col: [] for col in self.columns}  # rows not yet merged
+        self._buffered = 0
+        self._view = None  # (version, schema generation, live rows) of the last frame() that had to copy
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, record_id):
+        return record_id in self._index
+
+    def insert(self, record):
+        """Appends a record to the buffer and indexes it by its key."""
+        record_id = record[self.key]
+        if record_id in self._index:
+            raise KeyError(f"Duplicate {self.key}: {record_id}")
+        if self._versioned:
+            record = with_row_version(record)
+        for col in self.columns:
+            self._buffer[col].append(record.get(col))
+        self._index[record_id] = len(self._df) + self._buffered
+        self._buffered += 1
+        if self._prefix is not None:
+            self._prefix.add(record.get(self.prefix_column), record_id)
+        if self.secondary_column:
+            self._secondary.setdefault(record.get(self.secondary_column), {})[record_id] = None
+        if self._search is not None:
+            self._search.add(record_id, [record.get(col) for col in self.search_columns])
+        self.version += 1
+        if self._buffered >= max(self.batch_size, len(self._df)):
+            self.flush()
+
+    def insert_many(self, records):
+        """Appends a batch of records (DataFrame or list of dicts) in one merge."""
+        batch = records if isinstance(records, pd.DataFrame) else pd.DataFrame(list(records))
+        if batch.empty:
+            return 0
+        batch = batch.reindex(columns=self.columns)
+        if self._versioned:
+            batch[ROW_VERSION] = batch[ROW_VERSION].fillna(1).astype('int64')
+        ids = batch[self.key]
+        if ids.duplicated().any() or any(record_id in self._index for record_id in ids):
+            raise KeyError(f"Duplicate {self.key} in batch")
+        if len(batch) < self.batch_size:
+            # Small batches go through the append buffer like single inserts
+            for record in batch.to_dict('records'):
+                self.insert(record)
+            return len(batch)
+        self.flush()
+        batch = self.schema.conform(batch)
+        start = len(self._df)
+        self._df = pd.concat([self._typed(), batch], ignore_index=True) if start else batch.reset_index(drop=True)
+        self._index.update(zip(ids, range(start, start + len(batch))))
+        if self._prefix is not None:
+            self._prefix.add_many(batch[self.prefix_column], ids)
+        if self.secondary_column:
+            for value, record_id in zip(batch[self.secondary_column], ids):
+                self._secondary.setdefault(value, {})[record_id] = None
+        if self._search is not None:
+            self._search.add_many(ids, batch[self.search_columns].itertuples(index=False, name=None))
+        self.version += 1
+        return len(batch)
+
+    def flush(self):
+        """Merges buffered rows into the frame."""
+        if not self._buffered:
+            return
+        batch = self.schema.conform(pd.DataFrame(self._buffer, columns=self.columns))
+        self._df = pd.concat([self._typed(), batch], ignore_index=True) if len(self._df) else batch
+        self._buffer = {col: [] for col in self.columns}
+        self._buffered = 0
+        self._view = None
+
+    def _buffered_rows(self):
+        """Returns the buffered rows as a frame, labelled with their positions like the stored rows."""
+        stored = len(self._df)
+        rows = self.schema.conform(pd.DataFrame(self._buffer, columns=self.columns))
+        rows.index = pd.RangeIndex(stored, stored + self._buffered)
+        return rows
+
+    def _rows(self, positions):
+        """Returns the rows at the given positions, in that order. Buffered rows are read from the
+        buffer instead of forcing a merge."""
+        positions = np.asarray(positions, dtype=np.int64)
+        in_buffer = positions >= len(self._df)
+        if not in_buffer.any():
+            return self._typed().iloc[positions]
+        buffered = self._buffered_rows()  # First, it may add categories the stored rows are recast to
+        rows = pd.concat([self._typed().iloc[positions[~in_buffer]], buffered.loc[positions[in_buffer]]])
+        return rows if (np.diff(positions) > 0).all() else rows.loc[positions]
+
+    def _live_positions(self):
+        """Returns the positions of the live rows (tombstones skipped, buffered rows included), in order."""
+        live = np.ones(len(self._df) + self._buffered, dtype=bool)
+        live[list(self._dead)] = False
+        return np.flatnonzero(live)
+
+    def _typed(self):
+        """Returns the frame, recast first if categories grew (possibly through other partitions)."""
+        if self._synced != self.schema.generation:
+            self._df = self.schema.apply(self._df)
+            self._synced = self.schema.generation
+        return self._df
+
+    def _position(self, record_id):
+        """Returns the frame position of a record, merging the buffer if needed."""
+        pos = self._index.get(record_id)
+        if pos is not None and pos >= len(self._df):
+            self.flush()
+        return pos
+
+    def get(self, record_id):
+        """Returns the record as a Series, or None if it does not exist."""
+        pos = self._index.get(record_id)
+        if pos is None:
+            return None
+        if pos >= len(self._df):  # Buffered: read it from the buffer instead of forcing a merge
+            return pd.Series({col: self._buffer[col][pos - len(self._df)] for col in self.columns}, dtype=object)
+        return self._df.iloc[pos]
+
+    def get_many(self, record_ids):
+        """Returns the existing records among record_ids as a DataFrame."""
+        return self._rows([pos for pos in map(self._index.get, record_ids) if pos is not None])
+
+    def update(self, record_id, updated_data):
+        """Updates fields of a record in place. Returns False if not found."""
+        pos = self._position(record_id)
+        if pos is None:
+            return False
+        if self._prefix is not None and self.prefix_column in updated_data:
+            self._prefix.remove(self._df.at[pos, self.prefix_column], record_id)
+            self._prefix.add(updated_data[self.prefix_column], record_id)
+        if self.secondary_column in updated_data:
+            del self._secondary[self._df.at[pos, self.secondary_column]][record_id]
+            self._secondary.setdefault(updated_data[self.secondary_column], {})[record_id] = None
+        values = {col: self.schema.cast(col, [value])[0] for col, value in updated_data.items()
+                  if col not in (self.key, ROW_VERSION)}
+        if self._versioned:
+            values[ROW_VERSION] = self._df.at[pos, ROW_VERSION] + 1
+        self._typed()  # New categories
+        for col, value in values.items():  # The key column is immutable, the index depends on it
+            self._df.at[pos, col] = value
+        if self._search is not None and not updated_data.keys().isdisjoint(self.search_columns):
+            self._search.add(record_id, [self._df.at[pos, col] for col in self.search_columns])
+        self.version += 1
+        return True
+
+    def update_many(self, updates):
+        """Applies a batch of updates (DataFrame with the key column) in one vectorized merge.
+
+        Empty cells leave the field unchanged, so rows may update different fields.
+        Unknown ids are skipped. Every updated record gets a new row_version.
+        Returns the number of records updated.
+        """
+        return self._merge(updates, replace=False)
+
+    def replace_many(self, rows):
+        """Overwrites whole records in place with rows (DataFrame with the key column), empty cells and
+        row_version included, e.g. with their current versions read from another store.
+        Unknown ids are skipped. Returns the number of records replaced."""
+        return self._merge(rows.reindex(columns=self.columns), replace=True)
+
+    def _merge(self, updates, replace):
+        self.flush()
+        # Look ids up one by one, mapping through the whole index dict would cost O(table size)
+        positions = pd.Series([self._index.get(record_id) for record_id in updates[self.key]], index=updates.index, dtype=object)
+        found = positions.notna()
+        updates, positions = updates[found], positions[found].astype(int).to_numpy()
+        if updates.empty:
+            return 0
+        for col in updates.columns:
+            if col == self.key or (col == ROW_VERSION and not replace):
+                continue  # The key column is immutable, the index depends on it
+            has_value = np.ones(len(updates), dtype=bool) if replace else updates[col].notna().to_numpy()
+            if not has_value.any():
+                continue
+            rows, values = positions[has_value], updates[col].to_numpy()[has_value]
+            if col in (self.prefix_column, self.secondary_column):
+                record_ids = updates[self.key].to_numpy()[has_value]
+                for old, new, record_id in zip(self._df[col].to_numpy()[rows], values, record_ids):
+                    if col == self.prefix_column and self._prefix is not None:
+                        self._prefix.remove(old, record_id)
+                        self._prefix.add(new, record_id)
+                    if col == self.secondary_column:
+                        del self._secondary[old][record_id]
+                        self._secondary.setdefault(new, {})[record_id] = None
+            values = self.schema.cast(col, values)
+            self._typed()  # New categories
+            self._df.iloc[rows, self._df.columns.get_loc(col)] = values
+        if self._versioned and not replace:
+            self._df.iloc[positions, self._df.columns.get_loc(ROW_VERSION)] = self._df[ROW_VERSION].to_numpy()[positions] + 1
+        searched = [col for col in self.search_columns if col in updates]
+        if self._search is not None and searched:
+            changed = updates[searched].notna().any(axis=1).to_numpy() | replace
+            rows = self._df[self.search_columns].iloc[positions[changed]].to_numpy()
+            self._search.add_many(updates[self.key].to_numpy()[changed], rows)
+        self.version += 1
+        return len(updates)
+
+    def _tombstone(self, record_id):
+        """Unindexes a record and marks its row as dead. Returns False if not found."""
+        pos = self._position(record_id)
+        if pos is None:
+            return False
+        if self._prefix is not None:
+            self._prefix.remove(self._df.at[pos, self.prefix_column], record_id)
+        if self.secondary_column:
+            del self._secondary[self._df.at[pos, self.secondary_column]][record_id]
+        if self._search is not None:
+            self._search.remove(record_id)
+        del self._index[record_id]
+        self._dead.add(pos)
+        return True
+
+    def _compact_if_needed(self):
+        if len(self._dead) > self.compact_ratio * (len(self._df) + self._buffered):
+            self.compact()
+
+    def delete(self, record_id):
+        """Tombstones a record. Returns False if not found."""
+        if not self._tombstone(record_id):
+            return False
+        self.version += 1
+        self._compact_if_needed()
+        return True
+
+    def delete_many(self, record_ids):
+        """Tombstones a batch of records, then drops them all in at most one compaction.
+        Returns the number deleted."""
+        deleted = sum(self._tombstone(record_id) for record_id in record_ids)
+        if deleted:
+            self.version += 1
+            self._compact_if_needed()
+        return deleted
+
+    def compact(self):
+        """Physically removes tombstoned rows and rebuilds the index."""
+        self.flush()
+        if not self._dead:
+            return
+        self._df = self._df.drop(index=list(self._dead)).reset_index(drop=True)
+        self._dead = set()
+        self._view = None
+        self._index = {record_id: pos for pos, record_id in enumerate(self._df[self.key])}
+
+    def frame(self):
+        """Returns the live rows as a DataFrame.
+
+        Reads never compact or flush: tombstoned rows are skipped and buffered
+        rows are read from the buffer. Without either this is the stored frame
+        itself, otherwise a copy kept until the next write. Treat it as read-only.
+        """
+        if not self._dead and not self._buffered:
+            return self._typed()
+        if self._view is None or self._view[:2] != (self.version, self.schema.generation):
+            rows = self._rows(self._live_positions())
+            self._view = (self.version, self.schema.generation, rows)
+        return self._view[2]
+
+    def find(self, **filters):
+        """Returns the live rows matching all filters (value or list of values per column)."""
+        if not filters:
+            return self.frame()
+        value = filters.get(self.secondary_column)
+        if value is not None:
+            # Only look at the rows listed in the secondary index for the value(s)
+            values = value if isinstance(value, (list, set, tuple)) else [value]
+            filters = {col: v for col, v in filters.items() if col != self.secondary_column}
+            df = self._rows([self._index[record_id] for v in values for record_id in self._secondary.get(v, ())])
+            return df[_matches(df, filters)] if filters else df
+        # Filter the stored and the buffered rows separately, only the matches are copied
+        buffered = self._buffered_rows() if self._buffered else None  # First, it may add categories
+        df = self._typed()
+        mask = _matches(df, filters)
+        mask[list(self._dead)] = False
+        if buffered is None:
+            return df[mask]
+        return pd.concat([df[mask], buffered[_matches(buffered, filters)]])
+
+    def distinct(self, column):
+        """Returns the distinct values of a column, in order of first appearance."""
+        return list(self.frame()[column].unique())
+
+    def iter_chunks(self, filters=None, chunksize=CHUNKSIZE):
+        """Returns an iterator over the live rows matching the filters, in chunks of at most chunksize rows.
+        The rows are snapshotted when called (copy-on-write), so writes made while iterating do not show up."""
+        return filtered_chunks(self.frame().copy(deep=False), filters or {}, chunksize)
+
+    def page(self, filters=None, search=None, sort_by=None, ascending=True, offset=0, limit=50):
+        """Returns (rows of one page, total matching rows). See page_frame."""
+        if not filters and not sort_by and not any((search or {}).values()):
+            # Unfiltered pages in stored order only read their own rows
+            return self._rows(self._live_positions()[offset:offset + limit]), len(self)
+        return page_frame(self.find(**(filters or {})), search, sort_by, ascending, offset, limit)
+
+    def count(self, **filters):
+        """Returns the number of live rows matching all filters."""
+        if not filters:
+            return len(self)
+        if list(filters) == [self.secondary_column] and not isinstance(filters[self.secondary_column], (list, set, tuple)):
+            return len(self._secondary.get(filters[self.secondary_column], ()))
+        return len(self.find(**filters))
+
+    def prefix_search(self, prefix, filters=None, limit=50):
+        """Returns up to `limit` rows whose prefix column starts with prefix, in value order."""
+        if self.secondary_column in (filters or {}):
+            # The secondary index narrows the candidates more than the prefix does
+            rows = self.find(**filters)
+            keys = rows[self.prefix_column].astype(str).str.lower()
+            keys = keys[keys.str.startswith(prefix.lower())].sort_values(kind='stable')
+            return rows.loc[keys.index[:limit]]
+        matches = self._prefix.search(prefix)
+        rows = []
+        found = 0
+        while found < limit:
+            record_ids = list(islice(matches, limit * 4))
+            if not record_ids:
+                break
+            chunk = self._rows([self._index[record_id] for record_id in record_ids])
+            if filters:
+                chunk = chunk[_matches(chunk, filters)]
+            rows.append(chunk)
+            found += len(chunk)
+        if not rows:
+            return self._typed().iloc[:0]
+        return pd.concat(rows).iloc[:limit]
+
+    def search_ranked(self, text, filters=None, limit=50):
+        """Returns [(rank, record id)] of the best `limit` records matching text in the searched columns.
+        The trigram index is built on the first search and kept up to date by every write after that."""
+        if self._search is None:
+            df = self.frame()
+            self._search = TrigramIndex()
+            self._search.add_many(df[self.key], df[self.search_columns].itertuples(index=False, name=None))
+        matches = self._search.search(text)
+        if not filters:
+            return list(islice(matches, limit))
+        # Check the filters on the rows of the matches, in rank order, until enough are found
+        found = []
+        while len(found) < limit:
+            chunk = list(islice(matches, limit * 4))
+            if not chunk:
+                break
+            rows = self._rows([self._index[record_id] for _, record_id in chunk])
+            found.extend(match for match, ok in zip(chunk, _matches(rows, filters)) if ok)
+        return found[:limit]
+
+    def search(self, text, filters=None, limit=50):
+        """Returns up to `limit` rows matching text (a substring of a searched column), best match first."""
+        matches = self.search_ranked(text, filters, limit)
+        return self._rows([self._index[record_id] for _, record_id in matches])
+
+
+def _matches(df, filters):
+    """Returns a boolean array of the rows of df matching all filters (value or list of values per column)."""
+    mask = np.ones(len(df), dtype=bool)
+    for col, value in filters.items():
+        matched = df[col].isin(value) if isinstance(value, (list, set, tuple)) else df[col] == value
+        mask &= matched.to_numpy(dtype=bool, na_value=False)
+    return mask
+
+
+def filtered_chunks(df, filters, chunksize):
+    """Yields the rows of df matching the filters, filtering one slice of chunksize rows at a time."""
+    for start in range(0, len(df), chunksize):
+        chunk = df.iloc[start:start + chunksize]
+        if filters:
+            chunk = chunk[_matches(chunk, filters)]
+        if len(chunk):
+            yield chunk
+
+
+def page_frame(df, search=None, sort_by=None, ascending=True, offset=0, limit=50):
+    """Applies text filters, sorting and offset/limit to a frame.
+
+    `search` maps columns to a case-insensitive substring they must contain.
+    Returns (rows of the requested page, total number of matching rows).
+    """
+    for col, text in (search or {}).items():
+        if text:
+            df = df[df[col].astype(str).str.contains(text, case=False, regex=False)]
+    total = len(df)
+    if sort_by:
+        df = df.sort_values(sort_by, ascending=ascending, kind='stable')
+    return df.iloc[offset:offset + limit], total
+
+
+# --- Tenant Partitioning ---
+# Splits a table into one RecordStore per company, so a company-scoped view
+# only touches that company's rows. The all-companies view is concatenated
+# from the partitions on demand.
+
+class PartitionedStore:
+    """Table partitioned by a column (the company), with the RecordStore interface."""
+
+    def __init__(self, columns, key='id', partition_by='company', prefix_column=None, secondary_column=None, schema=None,
+                 search_columns=None):
+        self.columns = list(columns)
+        self.key = key
+        self.schema = schema or Schema()
+        self.partition_by = partition_by
+        self.prefix_column = prefix_column
+        self.secondary_column = secondary_column
+        self.search_columns = list(search_columns or [])
+        self.version = 0
+        self.partitions = {}  # partition value -> RecordStore
+        self._owner = {}      # record id -> partition value
+
+    def __len__(self):
+        return len(self._owner)
+
+    def __contains__(self, record_id):
+        return record_id in self._owner
+
+    def partition(self, value):
+        """Returns the partition for a value, creating it if needed."""
+        if value not in self.partitions:
+            self.partitions[value] = RecordStore(self.columns, key=self.key, prefix_column=self.prefix_column,
+                                                 secondary_column=self.secondary_column, schema=self.schema,
+                                                 search_columns=self.search_columns)
+        return self.partitions[value]
+
+    def insert(self, record):
+        """Appends a record to the partition of its company."""
+        record_id = record[self.key]
+        if record_id in self._owner:
+            raise KeyError(f"Duplicate {self.key}: {record_id}")
+        value = record.get(self.partition_by)
+        self.partition(value).insert(record)
+        self._owner[record_id] = value
+        self.version += 1
+
+    def insert_many(self, records):
+        """Appends a batch of records, one merge per partition."""
+        batch = records if isinstance(records, pd.DataFrame) else pd.DataFrame(list(records))
+        if batch.empty:
+            return 0
+        batch = batch.reindex(columns=self.columns)
+        ids = batch[self.key]
+        if ids.duplicated().any() or any(record_id in self._owner for record_id in ids):
+            raise KeyError(f"Duplicate {self.key} in batch")
+        for value, group in batch.groupby(self.partition_by, sort=False, dropna=False):
+            self.partition(value).insert_many(group)
+        self._owner.update(zip(ids, batch[self.partition_by]))
+        self.version += 1
+        return len(batch)
+
+    def get(self, record_id):
+        """Returns the record as a Series, or None if it does not exist."""
+        if record_id not in self._owner:
+            return None
+        return self.partitions[self._owner[record_id]].get(record_id)
+
+    def get_many(self, record_ids):
+        """Returns the existing records among record_ids as a DataFrame, one lookup per partition."""
+        by_partition = {}
+        for record_id in record_ids:
+            if record_id in self._owner:
+                by_partition.setdefault(self._owner[record_id], []).append(record_id)
+        return self._concat(self.partitions[value].get_many(ids) for value, ids in by_partition.items())
+
+    def update(self, record_id, updated_data):
+        """Updates fields of a record, moving it if its company changes. Returns False if not found."""
+        if record_id not in self._owner:
+            return False
+        value = self._owner[record_id]
+        new_value = updated_data.get(self.partition_by, value)
+        self.version += 1
+        if new_value == value:
+            return self.partitions[value].update(record_id, updated_data)
+        record = self.partitions[value].get(record_id).to_dict()
+        row_version = record.get(ROW_VERSION)
+        record.update(updated_data)
+        record[self.key] = record_id
+        if ROW_VERSION in self.columns:
+            record[ROW_VERSION] = row_version + 1
+        self.partitions[value].delete(record_id)
+        self.partition(new_value).insert(record)
+        self._owner[record_id] = new_value
+        return True
+
+    def update_many(self, updates):
+        """Applies a batch of updates, one vectorized merge per partition. See RecordStore.update_many.
+        Records whose company changes are moved one by one. Returns the number of records updated."""
+        owners = pd.Series([self._owner.get(record_id) for record_id in updates[self.key]], index=updates.index, dtype=object)
+        updates, owners = updates[owners.notna()], owners[owners.notna()]
+        if updates.empty:
+            return 0
+        moved = pd.Series(False, index=updates.index)
+        if self.partition_by in updates:
+            moved = updates[self.partition_by].notna() & (updates[self.partition_by] != owners)
+            for record in updates[moved].to_dict('records'):
+                self.update(record[self.key], {col: value for col, value in record.items() if not _is_empty(value)})
+        for value, group in updates[~moved].groupby(owners[~moved], sort=False):
+            self.partitions[value].update_many(group)
+        self.version += 1
+        return len(updates)
+
+    def apply_rows(self, record_ids, rows, partitions=None):
+        """Brings the records with the given ids in line with rows, their current versions read from
+        another store: records missing from rows are deleted, the others replaced in place, or moved
+        when their company changed. Only rows of the given partitions (all if None) are kept, so a
+        partially loaded copy stays partial."""
+        if partitions is not None:
+            rows = rows[rows[self.partition_by].isin(list(partitions))]
+        values = rows[self.partition_by].astype(object).to_numpy()
+        in_place = np.array([self._owner.get(record_id, _MISSING) == value
+                             for record_id, value in zip(rows[self.key], values)], dtype=bool)
+        kept = set(rows[self.key][in_place])
+        candidates = dict.fromkeys(chain(record_ids, rows[self.key]))
+        self.delete_many([record_id for record_id in candidates if record_id in self._owner and record_id not in kept])
+        for value, group in rows[in_place].groupby(values[in_place], sort=False):
+            self.partitions[value].replace_many(group)
+        self.insert_many(rows[~in_place])
+        self.version += 1
+
+    def delete(self, record_id):
+        """Tombstones a record in its partition. Returns False if not found."""
+        if record_id not in self._owner:
+            return False
+        self.version += 1
+        return self.partitions[self._owner.pop(record_id)].delete(record_id)
+
+    def delete_many(self, record_ids):
+        """Tombstones a batch of records, one batch per partition. Returns the number deleted."""
+        by_partition = {}
+        for record_id in record_ids:
+            if record_id in self._owner:
+                by_partition.setdefault(self._owner.pop(record_id), []).append(record_id)
+        if not by_partition:
+            return 0
+        self.version += 1
+        return sum(self.partitions[value].delete_many(ids) for value, ids in by_partition.items())
+
+    def flush(self):
+        for partition in self.partitions.values():
+            partition.flush()
+
+    def compact(self):
+        for partition in self.partitions.values():
+            partition.compact()
+
+    def _concat(self, frames):
+        generation = self.schema.generation
+        frames = [df for df in frames if not df.empty]
+        if not frames:
+            return self.schema.empty(self.columns)
+        if self.schema.generation != generation:
+            # Reading a partition added categories (flushed rows), align all frames to the final ones
+            frames = [self.schema.apply(df) for df in frames]
+        if len(frames) == 1:
+            return frames[0]
+        return pd.concat(frames, ignore_index=True)
+
+    def frame(self):
+        """Returns all live rows, concatenated from the partitions."""
+        return self._concat(partition.frame() for partition in self.partitions.values())
+
+    def _select(self, filters):
+        """Splits off the partition filter. Returns (selected partitions, remaining filters)."""
+        filters = dict(filters)
+        value = filters.pop(self.partition_by, None)
+        if value is None:
+            selected = list(self.partitions.values())
+        elif isinstance(value, (list, set, tuple)):
+            selected = [self.partitions[v] for v in value if v in self.partitions]
+        else:
+            selected = [self.partitions[value]] if value in self.partitions else []
+        return selected, filters
+
+    def find(self, **filters):
+        """Returns the live rows matching all filters, only scanning the selected partitions."""
+        selected, filters = self._select(filters)
+        return self._concat(partition.find(**filters) for partition in selected)
+
+    def count(self, **filters):
+        """Returns the number of live rows matching all filters."""
+        selected, filters = self._select(filters)
+        return sum(partition.count(**filters) for partition in selected)
+
+    def prefix_search(self, prefix, filters=None, limit=50):
+        """Returns up to `limit` rows whose prefix column starts with prefix, in value order."""
+        selected, filters = self._select(filters or {})
+        matches = self._concat(partition.prefix_search(prefix, filters, limit) for partition in selected)
+        if len(selected) > 1 and not matches.empty:
+            order = matches[self.prefix_column].astype(str).str.lower().sort_values(kind='stable').index
+            matches = matches.loc[order]
+        return matches.iloc[:limit]
+
+    def search_ranked(self, text, filters=None, limit=50):
+        """Returns [(rank, record id)] of the best `limit` matches, only searching the selected partitions
+        (so each company's index is built when that company first searches)."""
+        selected, filters = self._select(filters or {})
+        return heapq.nsmallest(limit, (match for partition in selected
+                                       for match in partition.search_ranked(text, filters, limit)))
+
+    def search(self, text, filters=None, limit=50):
+        """Returns up to `limit` rows matching text, best match first. See RecordStore.search."""
+        record_ids = [record_id for _, record_id in self.search_ranked(text, filters, limit)]
+        rows = self.get_many(record_ids)
+        return rows.iloc[pd.Index(rows[self.key]).get_indexer(record_ids)]
+
+    def page(self, filters=None, search=None, sort_by=None, ascending=True, offset=0, limit=50):
+        """Returns (rows of one page, total matching rows). See page_frame."""
+        selected, rest = self._select(filters or {})
+        if len(selected) == 1 and (filters or {}).get(self.partition_by) is not None:
+            return selected[0].page(rest, search, sort_by, ascending, offset, limit)
+        return page_frame(self.find(**(filters or {})), search, sort_by, ascending, offset, limit)
+
+    def iter_chunks(self, filters=None, chunksize=CHUNKSIZE):
+        """Returns an iterator over the matching rows of the selected partitions, see RecordStore.iter_chunks."""
+        selected, filters = self._select(filters or {})
+        return chain.from_iterable([partition.iter_chunks(filters, chunksize) for partition in selected])  # Snapshots all now
+
+    def distinct(self, column):
+        """Returns the distinct values of a column, in order of first appearance."""
+        if column == self.partition_by:
+            return [value for value, partition in self.partitions.items() if len(partition)]
+        return list(pd.unique(pd.Series([v for p in self.partitions.values() for v in p.distinct(column)])))
+
+
+def create_store(df_name):
+    """Creates an empty store for one of the tables in TABLES."""
+    table = TABLES[df_name]
+    if table.get('partition_by'):
+        return PartitionedStore(columns=table['columns'], key=table['key'], partition_by=table['partition_by'],
+                                prefix_column=table.get('prefix_index'), secondary_column=table.get('secondary_index'),
+                                schema=Schema(table.get('dtypes')), search_columns=table.get('search_index'))
+    return RecordStore(columns=table['columns'], key=table['key'], prefix_column=table.get('prefix_index'),
+                       secondary_column=table.get('secondary_index'), schema=Schema(table.get('dtypes')),
+                       search_columns=table.get('search_index'))
+
+
+def create_stores():
+    """Creates empty stores for all tables, keyed by table name."""
+    return {df_name: create_store(df_name) for df_name in TABLES}
+
+
+# --- Bulk Request Review ---
+# Approving a batch of requests changes the products with one update_many (all
+# updates) and one delete_many (all deletes), and resolves the requests with one
+# more update_many, instead of one product write and one request write per request.
+
+PRODUCT_CHANGED = 'the product was changed after the request was made'
+
+
+def resolve_requests(tables, request_ids, status, admin_notes='', approval_date=None, filters=None):
+    """Approves or rejects a batch of pending product requests at once.
+
+    Only pending requests matching `filters` (e.g. the company) are considered.
+    Requests that cannot be applied unambiguously are reported instead of
+    applied: several requests for the same product in one batch (which one
+    wins would depend on their order), requests whose product is gone and
+    requests whose product changed after they were made (its row_version moved
+    on from their product_version), which would otherwise silently overwrite
+    that change. They stay pending. Returns (resolved request ids, conflicts with a 'reason' column).
+    """
+    requests_store, products = tables['product_requests_df'], tables['products_df']
+    requests = requests_store.find(**dict(filters or {}, status='Pending'))
+    requests = requests[requests[requests_store.key].isin(list(request_ids))]
+    reasons = pd.Series('', index=requests.index)
+    if status == 'Approved':
+        reasons[requests['product_id'].duplicated(keep=False)] = 'several requests for the same product'
+        current = products.get_many(requests['product_id'].unique()).set_index(products.key)[ROW_VERSION]
+        exists = requests['product_id'].isin(current.index)
+        reasons[~exists & (reasons == '')] = 'product no longer exists'
+        based_on = requests['product_version'].astype('Int64')
+        stale = (requests['product_id'].map(current).astype('Int64') != based_on).fillna(False).astype(bool)
+        reasons[stale & exists & (reasons == '')] = PRODUCT_CHANGED
+        approved = requests[reasons == '']
+        updates = approved[approved['request_type'] == 'Update']
+        products.update_many(pd.DataFrame({
+            products.key: updates['product_id'],
+            **{field: updates[f'new_{field}'] for field in REQUEST_FIELDS},
+        }))
+        products.delete_many(approved.loc[approved['request_type'] == 'Delete', 'product_id'].tolist())
+    resolved = requests.loc[reasons == '', requests_store.key]
+    requests_store.update_many(pd.DataFrame({
+        requests_store.key: resolved,
+        'status': status,
+        'admin_notes': admin_notes,
+        'approval_date': approval_date or datetime.now().isoformat(),
+    }))
+    conflicts = requests[reasons != ''].assign(reason=reasons[reasons != ''])
+    return resolved.tolist(), conflicts
+
+
+# --- Derived View Cache ---
+# Memoizes values derived from a table (pages, counts, distinct values, picker
+# options) under a key that includes the table version, so they are computed
+# once per mutation instead of on every rerun. The least recently used entries
+# are evicted once the cache is full.
+
+class ViewCache:
+    """LRU cache of derived views."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, compute):
+        """Returns the cached value for key, calling compute() on a miss."""
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return self._entries[key]
+        self.misses += 1
+        value = self._entries[key] = compute()
+        if len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return value
+
+
+# Option labels per table, built vectorized for the rows shown in a picker
+OPTION_LABELS = {
+    'users_df': lambda df: df['name'].astype(str) + " (" + df['email'].astype(str) + ")",
+    'products_df': lambda df: df['product_name'].astype(str) + " (ID: " + df['id'].str[-4:] + ")",
+    'product_requests_df': lambda df: df['request_type'].astype(str) + " for " + df['product_id'].str[-4:] + " by " + df['requested_by_email'],
+}
+
+
+def option_labels(store, df_name, prefix, filters=None, exclude=None, limit=50):
+    """Returns {record id: label} of the first `limit` prefix matches, without the rows whose
+    columns equal the values in exclude. The options of the record pickers."""
+    matches = store.prefix_search(prefix, filters, limit=limit)
+    for col, value in (exclude or {}).items():
+        matches = matches[matches[col] != value]
+    return dict(zip(matches[store.key], OPTION_LABELS[df_name](matches)))
+
+
+# --- Storage Backends ---
+# A backend owns the stores of all tables. The in-memory backend is the default;
+# the SQLite backend (sqlite_store.py) persists data and pushes queries down to SQL.
+
+class MemoryBackend:
+    """Keeps all tables in in-memory record stores."""
+
+    persistent = False
+
+    def __init__(self):
+        self.tables = create_stores()
+
+    def table(self, df_name):
+        return self.tables[df_name]
+
+
+def open_backend(kind='memory', path=None):
+    """Opens the storage backend selected by `kind` ('memory', 'sqlite' or 'multiprocess')."""
+    if kind == 'sqlite':
+        from sqlite_store import SQLiteBackend
+        return SQLiteBackend(path)
+    if kind == 'multiprocess':
+        from multiprocess import MultiProcessBackend
+        return MultiProcessBackend(path)
+    if kind != 'memory':
+        raise ValueError(f"Unknown storage backend: {kind}")
+    return MemoryBackend()
+
+
+
+# --- Change Feed ---
+# Every write through a SharedStore is published as one Change per affected
+# record, in write order, with the record before (old) and after (new) the
+# write: inserts have no old, deletes no new. Subscribers (e.g. materialized
+# aggregates) are called synchronously under the backend lock, so they see the
+# changes in the same order as the tables. Records are only looked up while
+# the feed has subscribers.
+
+Change = namedtuple('Change', ['seq', 'table', 'op', 'key', 'old', 'new'])
+INSERT, UPDATE, DELETE = 'insert', 'update', 'delete'
+
+
+class ChangeFeed:
+    """Ordered in-process feed of record changes, keeping the most recent ones for readers that poll."""
+
+    def __init__(self, history=10_000):
+        self.seq = 0
+        self.subscribers = []
+        self._history = deque(maxlen=history)
+
+    def subscribe(self, subscriber):
+        """Calls subscriber(change) for every change from now on."""
+        self.subscribers.append(subscriber)
+
+    def publish(self, table, record_ids, old, new):
+        """Publishes the changes of a write given the records ({id: dict}) before and after it."""
+        for record_id in dict.fromkeys(record_ids):
+            before, after = old.get(record_id), new.get(record_id)
+            if before is None and after is None:
+                continue  # Not found, nothing changed
+            self.seq += 1
+            change = Change(self.seq, table, INSERT if before is None else DELETE if after is None else UPDATE,
+                            record_id, before, after)
+            self._history.append(change)
+            for subscriber in self.subscribers:
+                subscriber(change)
+
+    def since(self, seq):
+        """Returns the retained changes after seq, oldest first."""
+        return [change for change in self._history if change.seq > seq]
+
+
+# --- Shared Backend ---
+# One backend per server process, shared by all sessions, instead of a copy of
+# every table per session. Writes are serialized through one lock. Readers get
+# frames that never change under them: frame() publishes a shallow copy-on-write
+# snapshot per table version, and pandas copies the data a writer touches
+# instead of modifying what readers hold.
+
+SMALL_BATCH = 32  # Writes up to this many records look the changed records up one by one
+
+
+class SharedStore:
+    """Thread-safe view of a store shared by all sessions. Writes hold `lock`, reads only
+    `read_lock` (the same lock unless the backend spans processes, see multiprocess.py)."""
+
+    def __init__(self, store, lock, name=None, feed=None, read_lock=None):
+        self._store = store
+        self._lock = lock
+        self._read_lock = read_lock or lock
+        self._snapshot = None  # (version, frame)
+        self.name = name
+        self.feed = feed
+        self.columns = store.columns
+        self.key = store.key
+        self.prefix_column = store.prefix_column
+
+    @property
+    def version(self):
+        return self._store.version
+
+    def version_of(self, company=None):
+        """Returns a version that changes with every write to the rows of a company (any row if None).
+        Stores without per-company versions return the table version."""
+        version_of = getattr(self._store, 'version_of', None)
+        return self.version if version_of is None or company is None else version_of(company)
+
+    def refresh(self):
+        """Picks up writes made by other processes, for stores that have them (see multiprocess.py)."""
+        refresh = getattr(self._store, 'refresh', None)
+        if refresh is not None:
+            with self._read_lock:
+                refresh()
+
+    def _locked(self, method, *args, **kwargs):
+        with self._read_lock:
+            result = getattr(self._store, method)(*args, **kwargs)
+        if isinstance(result, pd.DataFrame):
+            return result.copy(deep=False)  # Detached from the store, shares the data until either side writes
+        if isinstance(result, tuple):
+            return tuple(item.copy(deep=False) if isinstance(item, pd.DataFrame) else item for item in result)
+        return result
+
+    def _records(self, record_ids):
+        """Returns {id: record dict} of the existing records among record_ids."""
+        if len(record_ids) > SMALL_BATCH:
+            return {record[self.key]: record for record in self._store.get_many(record_ids).to_dict('records')}
+        records = {}
+        for record_id in record_ids:  # Single lookups avoid building a frame
+            row = self._store.get(record_id)
+            if row is not None:
+                records[record_id] = row.to_dict()
+        return records
+
+    def _write(self, method, record_ids, *args):
+        """Runs a write method, publishing the changed records to the feed if it has subscribers."""
+        with self._lock:
+            if self.feed is None or not self.feed.subscribers:
+                return getattr(self._store, method)(*args)
+            record_ids = list(record_ids)
+            old = self._records(record_ids)
+            result = getattr(self._store, method)(*args)
+            self.feed.publish(self.name, record_ids, old, self._records(record_ids))
+            return result
+
+    def __len__(self):
+        with self._read_lock:
+            return len(self._store)
+
+    def __contains__(self, record_id):
+        with self._read_lock:
+            return record_id in self._store
+
+    def frame(self):
+        """Returns an immutable snapshot of all rows, shared by readers until the next write."""
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot[0] == self._store.version:
+            return snapshot[1]
+        with self._read_lock:
+            snapshot = self._snapshot = (self._store.version, self._store.frame().copy(deep=False))
+        return snapshot[1]
+
+    def get(self, record_id):
+        return self._locked('get', record_id)
+
+    def get_many(self, record_ids):
+        return self._locked('get_many', record_ids)
+
+    def find(self, **filters):
+        return self._locked('find', **filters)
+
+    def page(self, *args, **kwargs):
+        return self._locked('page', *args, **kwargs)
+
+    def count(self, **filters):
+        return self._locked('count', **filters)
+
+    def prefix_search(self, *args, **kwargs):
+        return self._locked('prefix_search', *args, **kwargs)
+
+    def search(self, *args, **kwargs):
+        return self._locked('search', *args, **kwargs)
+
+    def iter_chunks(self, filters=None, chunksize=CHUNKSIZE):
+        with self._read_lock:  # Only while the rows are snapshotted, not while the chunks are read
+            return self._store.iter_chunks(filters, chunksize)
+
+    def distinct(self, column):
+        return self._locked('distinct', column)
+
+    def insert(self, record):
+        return self._write('insert', [record[self.key]], record)
+
+    def insert_many(self, records):
+        if not isinstance(records, pd.DataFrame):
+            records = list(records)
+        ids = records[self.key] if isinstance(records, pd.DataFrame) else [record[self.key] for record in records]
+        return self._write('insert_many', ids, records)
+
+    def update(self, record_id, updated_data):
+        return self._write('update', [record_id], record_id, updated_data)
+
+    def update_many(self, updates):
+        return self._write('update_many', updates[self.key], updates)
+
+    def delete(self, record_id):
+        return self._write('delete', [record_id], record_id)
+
+    def delete_many(self, record_ids):
+        record_ids = list(record_ids)
+        return self._write('delete_many', record_ids, record_ids)
+
+    def flush(self):
+        return self._locked('flush')
+
+    def compact(self):
+        return self._locked('compact')
+
+
+class SharedBackend:
+    """Wraps a backend for sharing across sessions. `lock` serializes writes and can be
+    held around multi-step operations; `credentials` is the login CredentialStore;
+    `feed` publishes every write (see ChangeFeed)."""
+
+    def __init__(self, backend, credentials=None):
+        # Backends shared by several processes bring their own lock, feed and credentials
+        self.lock = getattr(backend, 'lock', None) or threading.RLock()
+        self.persistent = backend.persistent
+        self.feed = getattr(backend, 'feed', None) or ChangeFeed()
+        read_lock = getattr(self.lock, 'local', self.lock)
+        self.tables = {df_name: SharedStore(store, self.lock, df_name, self.feed, read_lock)
+                       for df_name, store in backend.tables.items()}
+        self.credentials = credentials if credentials is not None else getattr(backend, 'credentials', None)
+
+    def table(self, df_name):
+        return self.tables[df_name]
@@ -0,0 +1,89 @@
+import threading
+import time
+
+import pytest
+
+import auth
+from auth import SESSION_TTL, CredentialStore, LoginBusy, hash_password, needs_rehash, verify_password
+from sqlite_store import SQLiteBackend, SQLiteCredentials
+
+
+# --- Password Hashing ---
+
+def test_hashes_are_salted_and_carry_their_cost():
+    first, second = hash_password('secret', 1000), hash_password('secret', 1000)
+    assert first != second and first.startswith('pbkdf2_sha256$1000$')
+    assert verify_password('secret', first) and verify_password('secret', second)
+    assert not verify_password('Secret', first)
+    assert not verify_password('secret', 'plain text') and not verify_password('secret', None)
+    assert not needs_rehash(first, 1000) and needs_rehash(first, 2000)
+
+
+def test_login_rehashes_passwords_of_another_cost():
+    credentials = CredentialStore(iterations=2000)
+    credentials.add('user@a.com', 'secret', 'User', 'Company A', iterations=1000)  # Like an import
+    assert credentials.authenticate('user@a.com', 'wrong') is None
+    assert credentials._users['user@a.com']['password_hash'].startswith('pbkdf2_sha256$1000$')
+    assert credentials.authenticate('user@a.com', 'secret') == {'role': 'User', 'company': 'Company A'}
+    assert credentials._users['user@a.com']['password_hash'].startswith('pbkdf2_sha256$2000$')
+    assert credentials.authenticate('user@a.com', 'secret') == {'role': 'User', 'company': 'Company A'}
+    assert credentials.authenticate('nobody@a.com', 'secret') is None
+
+
+# --- Session Tokens ---
+
+def test_session_tokens_expire_refresh_and_follow_the_user(monkeypatch):
+    credentials = CredentialStore(iterations=1000)
+    credentials.add('user@a.com', 'secret', 'User', 'Company A')
+    now = time.time()
+    monkeypatch.setattr(auth.time, 'time', lambda: now)
+    token = credentials.issue_token('user@a.com')
+    assert credentials.check_token(token) == ({'role': 'User', 'company': 'Company A'}, token)
+    assert credentials.check_token(token.replace('user@a.com', 'admin@a.com')) == (None, None)
+    assert credentials.check_token('garbage') == (None, None) and credentials.check_token(None) == (None, None)
+    assert CredentialStore(iterations=1000).check_token(token) == (None, None)  # Signed with another secret
+
+    now += SESSION_TTL * 0.75
+    user, refreshed = credentials.check_token(token)
+    assert user is not None and refreshed != token
+    now += SESSION_TTL * 0.5
+    assert credentials.check_token(token) == (None, None)  # Expired
+    credentials.update('user@a.com', role='Admin')
+    assert credentials.check_token(refreshed)[0] == {'role': 'Admin', 'company': 'Company A'}
+    credentials.remove('user@a.com')
+    assert credentials.check_token(refreshed) == (None, None)
+
+
+# --- Stored Credentials ---
+
+def test_sqlite_credentials_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'crud.db')
+    credentials = SQLiteCredentials(SQLiteBackend(path).pool, iterations=1000)
+    credentials.add_many({'old@a.com': {'password': 'old', 'role': 'User', 'company': 'Company A'}})
+    credentials.add('new@a.com', 'secret', 'User', 'Company A')
+    credentials.update('new@a.com', role='Admin')
+    credentials.remove('old@a.com')
+    token = credentials.issue_token('new@a.com')
+
+    restarted = SQLiteCredentials(SQLiteBackend(path).pool, iterations=1000)
+    assert restarted.authenticate('new@a.com', 'secret') == {'role': 'Admin', 'company': 'Company A'}
+    assert restarted.authenticate('old@a.com', 'old') is None  # Removed accounts stay removed
+    assert len(restarted) == 1
+    assert restarted.check_token(token)[0] == {'role': 'Admin', 'company': 'Company A'}
+
+
+# --- Login Verification ---
+
+def test_slow_verification_is_busy_and_keeps_its_permit(monkeypatch):
+    monkeypatch.setattr(auth, 'VERIFY_TIMEOUT', 0.05)
+    credentials = CredentialStore(iterations=1000, workers=1, max_pending=1)
+    release = threading.Event()
+    try:
+        with pytest.raises(LoginBusy):
+            credentials._run(release.wait)
+        with pytest.raises(LoginBusy):  # The timed-out verification still runs and holds the only permit
+            credentials._run(lambda: True)
+    finally:
+        release.set()
+    credentials._pool.submit(lambda: None).result()  # The permit is released when the verification ends
+    assert credentials._run(lambda: 'done') == 'done'
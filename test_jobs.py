@@ -0,0 +1,168 @@
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+from functools import partial
+
+import pandas as pd
+import pytest
+
+import ingest
+import jobs
+from auth import CredentialStore
+from jobs import DONE, FAILED, JOB_HANDLERS, QUEUED, RUNNING, JobExecutor, JobTable
+from service import Actor, CrudService
+from store import SharedBackend, open_backend
+
+ADMIN_A = Actor('admin@a.com', 'Admin', 'Company A')
+
+
+class Interrupted(Exception):
+    """Stands in for the process dying in the middle of a job."""
+
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'JOBS_DIR', str(tmp_path / 'jobs'))
+    return CrudService(SharedBackend(open_backend('memory'), CredentialStore(iterations=1000)))
+
+
+def interrupted_after(calls):
+    """Returns handlers whose jobs stop with Interrupted at the given call of progress."""
+    def wrap(handler):
+        def interrupted(service, job, progress):
+            count = iter(range(calls, 0, -1))
+
+            def report(*args):
+                progress(*args)
+                if next(count) == 1:
+                    raise Interrupted()
+            return handler(service, job, report)
+        return interrupted
+    return {kind: wrap(handler) for kind, handler in JOB_HANDLERS.items()}
+
+
+def run_queued(table, service, handlers=JOB_HANDLERS):
+    """Runs the queued jobs in this thread, like a worker of the executor."""
+    JobExecutor(table, service, handlers)._drain()
+
+
+def add_products(service, n):
+    ids, _ = service.create(ADMIN_A, 'products_df', [{'product_name': f"Widget {i}", 'price': 1.0, 'stock': 1}
+                                                      for i in range(n)])
+    return ids
+
+
+# --- Job Table ---
+
+def test_job_table_states_and_keys():
+    table = JobTable()
+    job_id = table.submit('review', {'n': 1}, ADMIN_A, "Review", key='review:1', total=3)
+    assert table.submit('review', {'n': 2}, ADMIN_A, "Again", key='review:1') == job_id  # Same key while queued
+    job = table.claim('host:1')
+    assert (job['id'], job['state'], job['payload']) == (job_id, RUNNING, {'n': 1})
+    assert table.claim('host:1') is None
+    table.progress(job_id, 2, result={'resolved': 2})
+    assert table.get(job_id)['done'] == 2 and table.get(job_id)['result'] == {'resolved': 2}
+    table.fail(job_id, 'Interrupted: ')
+    assert not table.retry('nope') and table.retry(job_id)
+    assert table.get(job_id)['state'] == QUEUED and table.get(job_id)['done'] == 2  # Resumes from here
+    table.claim('host:1')
+    table.finish(job_id, {'message': 'done'})
+    assert table.get(job_id)['state'] == DONE and table.get(job_id)['done'] == 3
+    assert table.submit('review', {}, ADMIN_A, "New", key='review:1') != job_id  # Finished jobs do not block the key
+    assert [job['label'] for job in table.recent(ADMIN_A.email)] == ["New", "Review"]
+
+
+# --- Resuming Jobs ---
+
+def test_interrupted_review_resumes_after_the_last_batch(service, monkeypatch):
+    monkeypatch.setattr(jobs, 'REVIEW_BATCH', 2)
+    request_ids, _ = service.propose(ADMIN_A, [{'product_id': product_id, 'request_type': 'Update', 'stock': 5}
+                                               for product_id in add_products(service, 5)])
+    table = JobTable()
+    job_id = table.submit('review', {'request_ids': request_ids, 'status': 'Approved', 'admin_notes': ''},
+                          ADMIN_A, "Approval")
+    run_queued(table, service, interrupted_after(1))
+    job = table.get(job_id)
+    assert (job['state'], job['done'], job['result']) == (FAILED, 2, {'resolved': 2, 'conflicts': 0})
+    requests = service.backend.table('product_requests_df')
+    assert requests.count(company='Company A', status='Pending') == 3
+
+    table.retry(job_id)
+    run_queued(table, service)
+    job = table.get(job_id)
+    assert job['state'] == DONE and job['result']['message'] == "5 requests approved."
+    assert requests.count(company='Company A', status='Approved') == 5
+
+
+def test_interrupted_import_skips_the_rows_already_stored(service, monkeypatch, tmp_path):
+    monkeypatch.setattr(jobs, 'ingest_file', partial(ingest.ingest_file, chunksize=4))
+    path = tmp_path / 'products.csv'
+    pd.DataFrame({'product_name': [f"Widget {i}" for i in range(10)], 'price': 2.0, 'stock': 1}).to_csv(path, index=False)
+    table = JobTable()
+    job_id = table.submit('import', {'df_name': 'products_df', 'path': str(path), 'format': 'csv'}, ADMIN_A, "Import")
+    run_queued(table, service, interrupted_after(3))  # The first call only sets the total
+    products = service.backend.table('products_df')
+    assert table.get(job_id)['state'] == FAILED and len(products) == 8
+
+    table.retry(job_id)
+    run_queued(table, service)
+    job = table.get(job_id)
+    assert job['state'] == DONE and job['result']['message'] == "10 records imported."
+    assert sorted(products.frame()['product_name']) == sorted(f"Widget {i}" for i in range(10))
+    assert not path.exists()
+
+
+def test_archive_job_moves_requests_in_batches(service, monkeypatch, tmp_path):
+    pytest.importorskip('pyarrow')
+    monkeypatch.setattr(jobs, 'ARCHIVE_BATCH', 3)
+    old = (datetime.now() - timedelta(days=90)).isoformat()
+    service.backend.table('product_requests_df').insert_many([
+        {'request_id': f'r{i}', 'product_id': 'p', 'company': 'Company A', 'request_type': 'Delete',
+         'status': 'Approved' if i < 7 else 'Pending', 'request_date': old, 'approval_date': old if i < 7 else ''}
+        for i in range(9)])
+    progress = []
+    job = {'id': 'job', 'done': 0, 'payload': {'archive_dir': str(tmp_path / 'archive'), 'after_days': 30}}
+    result = jobs.run_archive(service, job, lambda *args: progress.append(args))
+    assert result['message'] == "7 resolved requests archived."
+    assert progress == [(0, 7), (3, 7), (6, 7), (7, 7)]
+    assert sorted(service.backend.table('product_requests_df').frame()['request_id']) == ['r7', 'r8']
+    assert len(os.listdir(tmp_path / 'archive' / 'company=Company%20A')) == 3
+
+
+# --- Recovering Jobs ---
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_recover_requeues_jobs_of_dead_or_silent_workers(service):
+    table = JobTable()
+    executor = JobExecutor(table, service, JOB_HANDLERS)
+    host = executor.worker.rsplit(':', 1)[0]
+    dead, silent, busy, alive = (table.submit('review', {}, ADMIN_A, label) for label in "abcd")
+    table.claim(f"{host}:{dead_pid()}")
+    table.claim('elsewhere:1')
+    table.claim('elsewhere:2')
+    table.claim(executor.worker)
+    stale = (datetime.now() - jobs.STALE_AFTER - timedelta(seconds=1)).isoformat()
+    table._execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (stale, silent))
+    assert executor._recover() == 2
+    assert [table.get(job_id)['state'] for job_id in (dead, silent, busy, alive)] == [QUEUED, QUEUED, RUNNING, RUNNING]
+
+
+def test_executor_recovers_stale_jobs_while_running(service, monkeypatch):
+    monkeypatch.setattr(jobs, 'RECOVER_INTERVAL', 0.05)
+    table = JobTable()
+    executor = JobExecutor(table, service, {'noop': lambda service, job, progress: {'message': 'ok', 'report': None}})
+    executor.start()
+    job_id = table.submit('noop', {}, ADMIN_A, "Noop")  # Not through the executor, nobody is woken
+    table.claim(f"{executor.worker.rsplit(':', 1)[0]}:{dead_pid()}")  # Claimed by a process that died since
+    deadline = time.monotonic() + 5
+    while table.get(job_id)['state'] != DONE and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert table.get(job_id)['state'] == DONE
@@ -0,0 +1,126 @@
+import sqlite3
+import threading
+
+import multiprocess
+from analytics import CompanyAggregates
+from multiprocess import ChangeCounters, InterProcessLock, MultiProcessBackend, SharedCredentials
+from store import SharedBackend
+
+
+def shared(path):
+    """Returns a new backend instance on the file, as another server process would open it."""
+    return SharedBackend(MultiProcessBackend(str(path)))
+
+
+def product(record_id, company, stock=1):
+    return {'id': record_id, 'product_name': f"Product {record_id}", 'price': 2.0, 'stock': stock, 'company': company}
+
+
+def credentials(path, iterations=2000):
+    """Returns the credentials of a new backend instance on the file, as another process would see them."""
+    backend = MultiProcessBackend(str(path))
+    return SharedCredentials(backend.durable.pool, backend.counters, iterations=iterations)
+
+
+def stored_hash(path, email):
+    with sqlite3.connect(path) as conn:
+        return conn.execute("SELECT password_hash FROM credentials WHERE email = ?", (email,)).fetchone()[0]
+
+
+# --- Locks and Counters ---
+
+def test_inter_process_lock_excludes_other_instances(tmp_path):
+    first, second = InterProcessLock(str(tmp_path / 'crud.db.lock')), InterProcessLock(str(tmp_path / 'crud.db.lock'))
+    acquired = threading.Event()
+
+    def other_process():
+        with second:
+            acquired.set()
+
+    with first:
+        with first:  # Reentrant
+            thread = threading.Thread(target=other_process)
+            thread.start()
+            assert not acquired.wait(0.2)
+        assert not acquired.wait(0.1)  # Still held by the outer block
+    assert acquired.wait(5)
+    thread.join()
+
+
+def test_change_counters_are_shared_through_the_file(tmp_path):
+    path = str(tmp_path / 'crud.db.changes')
+    first, second = ChangeCounters(path, ['products_df', 'users_df']), ChangeCounters(path, ['products_df', 'users_df'])
+    assert first.advance('products_df', ['Company A']) == 0
+    assert second.read('products_df') == 1 and second.read('products_df', 'Company A') == 1
+    assert second.read('products_df', 'Company B') == 0 and second.read('users_df') == 0
+    assert second.advance('products_df', ['Company B'], to=10) == 1
+    assert first.advance('products_df', to=5) == 10  # Never moves back
+    assert first.read('products_df') == 10 and first.read('products_df', 'Company B') == 10
+
+
+# --- Cross-Process Cache Invalidation ---
+
+def test_writes_of_another_process_invalidate_only_their_companies(tmp_path):
+    writer, reader = shared(tmp_path / 'crud.db'), shared(tmp_path / 'crud.db')
+    writer.table('products_df').insert_many([product('a1', 'Company A'), product('a2', 'Company A'),
+                                             product('b1', 'Company B')])
+    products = reader.table('products_df')
+    assert products.count(company='Company A') == 2  # Loads Company A into the reader's copy
+    version_a, version_b = products.version_of('Company A'), products.version_of('Company B')
+
+    writer.table('products_df').update('a1', {'stock': 5})
+    assert products.version_of('Company A') != version_a and products.version_of('Company B') == version_b
+    assert products.find(company='Company A').set_index('id').loc['a1', 'stock'] == 5
+    writer.table('products_df').delete('a2')
+    writer.table('products_df').update('b1', {'company': 'Company A'})
+    assert sorted(products.find(company='Company A')['id']) == ['a1', 'b1']
+    assert products.count(company='Company B') == 0
+    assert products.search('product b1', {'company': 'Company A'})['id'].tolist() == ['b1']
+
+
+def test_process_behind_the_pruned_log_reloads(tmp_path, monkeypatch):
+    monkeypatch.setattr(multiprocess, 'LOG_RETENTION', 2)
+    writer, reader = shared(tmp_path / 'crud.db'), shared(tmp_path / 'crud.db')
+    writer.table('products_df').insert(product('a1', 'Company A'))
+    assert reader.table('products_df').count(company='Company A') == 1
+    for i in range(5):
+        writer.table('products_df').insert(product(f"a{i + 2}", 'Company A', stock=i))
+    writer.table('products_df').delete('a1')
+    assert sorted(reader.table('products_df').find(company='Company A')['id']) == ['a2', 'a3', 'a4', 'a5', 'a6']
+
+
+def test_change_feed_carries_writes_of_other_processes(tmp_path):
+    writer, reader = shared(tmp_path / 'crud.db'), shared(tmp_path / 'crud.db')
+    writer.table('products_df').insert(product('a1', 'Company A', stock=3))
+    aggregates = CompanyAggregates().attach(reader)  # Loads all companies, so old records are known
+    writer.table('products_df').update('a1', {'stock': 7})
+    writer.table('products_df').insert(product('b1', 'Company B', stock=1))
+    reader.table('products_df').refresh()
+    figures = aggregates.snapshot().set_index('company')
+    assert figures.loc['Company A', 'total_stock'] == 7 and figures.loc['Company B', 'products'] == 1
+
+
+# --- Shared Credentials ---
+
+def test_credential_changes_reach_other_processes(tmp_path):
+    path = tmp_path / 'crud.db'
+    first, second = credentials(path), credentials(path)
+    first.add('user@a.com', 'secret', 'User', 'Company A')
+    assert second.authenticate('user@a.com', 'secret') == {'role': 'User', 'company': 'Company A'}
+    token = second.issue_token('user@a.com')
+    first.update('user@a.com', role='Admin')
+    assert second.check_token(token)[0] == {'role': 'Admin', 'company': 'Company A'}
+    second.remove('user@a.com')
+    assert first.check_token(token) == (None, None)
+    assert first.authenticate('user@a.com', 'secret') is None
+
+
+def test_rehash_on_login_is_written_to_the_shared_file(tmp_path):
+    path = tmp_path / 'crud.db'
+    first, second = credentials(path), credentials(path)
+    first.add('user@a.com', 'secret', 'User', 'Company A', iterations=1000)  # Like an import
+    assert second.authenticate('user@a.com', 'secret') == {'role': 'User', 'company': 'Company A'}
+    assert stored_hash(path, 'user@a.com').startswith('pbkdf2_sha256$2000$')
+    assert first.authenticate('user@a.com', 'secret')
+    assert first._users['user@a.com']['password_hash'] == stored_hash(path, 'user@a.com')
+    assert not second.authenticate('user@a.com', 'wrong')
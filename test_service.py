@@ -0,0 +1,174 @@
+import json
+import urllib.error
+import urllib.request
+
+import pytest
+
+from auth import CredentialStore
+from service import CONFLICT, Actor, CrudService, start_http_server
+from store import PRODUCT_CHANGED, ROW_VERSION, SharedBackend, open_backend
+
+ADMIN_A = Actor('admin@a.com', 'Admin', 'Company A')
+ADMIN_B = Actor('admin@b.com', 'Admin', 'Company B')
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def service(request, tmp_path):
+    backend = SharedBackend(open_backend(request.param, str(tmp_path / 'crud.db')), CredentialStore(iterations=1000))
+    return CrudService(backend)
+
+
+def add_products(service, actor, names, stock=10):
+    ids, rejected = service.create(actor, 'products_df',
+                                   [{'product_name': name, 'price': 5.0, 'stock': stock} for name in names])
+    assert rejected.empty
+    return ids
+
+
+def version(service, product_id):
+    return int(service.backend.table('products_df').get(product_id)[ROW_VERSION])
+
+
+# --- Compare-and-Swap Updates ---
+
+def test_update_with_current_version_applies_and_bumps_it(service):
+    [product_id] = add_products(service, ADMIN_A, ['Mouse'])
+    applied, rejected = service.update(ADMIN_A, 'products_df', [{'id': product_id, 'stock': 3, ROW_VERSION: 1}])
+    assert applied == [product_id] and rejected.empty
+    assert version(service, product_id) == 2
+
+
+def test_stale_update_is_rejected_as_conflict(service):
+    [product_id] = add_products(service, ADMIN_A, ['Mouse'])
+    service.update(ADMIN_A, 'products_df', [{'id': product_id, 'stock': 3, ROW_VERSION: 1}])
+    applied, rejected = service.update(ADMIN_A, 'products_df', [{'id': product_id, 'stock': 4, ROW_VERSION: 1}])
+    assert applied == []
+    assert rejected['reason'].tolist() == [CONFLICT]
+    assert int(service.backend.table('products_df').get(product_id)['stock']) == 3
+    assert version(service, product_id) == 2
+
+
+def test_update_without_version_is_last_writer_wins(service):
+    [product_id] = add_products(service, ADMIN_A, ['Mouse'])
+    service.update(ADMIN_A, 'products_df', [{'id': product_id, 'stock': 3}])
+    applied, _ = service.update(ADMIN_A, 'products_df', [{'id': product_id, 'stock': 4}])
+    assert applied == [product_id]
+    assert version(service, product_id) == 3
+
+
+def test_conflicts_are_per_record_in_a_batch(service):
+    fresh, stale = add_products(service, ADMIN_A, ['Fresh', 'Stale'])
+    service.update(ADMIN_A, 'products_df', [{'id': stale, 'stock': 1}])
+    applied, rejected = service.update(ADMIN_A, 'products_df', [{'id': fresh, 'stock': 2, ROW_VERSION: 1},
+                                                                 {'id': stale, 'stock': 2, ROW_VERSION: 1}])
+    assert applied == [fresh]
+    assert rejected['id'].tolist() == [stale] and rejected['reason'].tolist() == [CONFLICT]
+
+
+def test_other_companies_records_are_not_found(service):
+    [product_id] = add_products(service, ADMIN_A, ['Mouse'])
+    applied, rejected = service.update(ADMIN_B, 'products_df', [{'id': product_id, 'stock': 1, ROW_VERSION: 1}])
+    assert applied == []
+    assert rejected['reason'].tolist() == ['record not found in your company']
+
+
+# --- Resolving Product Requests ---
+
+def propose(service, actor, product_id, **changes):
+    request_type = 'Update' if changes else 'Delete'
+    [request_id], rejected = service.propose(actor, [{'product_id': product_id, 'request_type': request_type, **changes}])
+    assert rejected.empty
+    return request_id
+
+
+def status(service, request_id):
+    return service.backend.table('product_requests_df').get(request_id)['status']
+
+
+def test_approving_applies_updates_and_deletes(service):
+    keep, drop = add_products(service, ADMIN_A, ['Keep', 'Drop'])
+    update, delete = propose(service, ADMIN_A, keep, stock=7), propose(service, ADMIN_A, drop)
+    resolved, conflicts = service.resolve(ADMIN_A, [update, delete], 'Approved')
+    assert sorted(resolved) == sorted([update, delete]) and conflicts.empty
+    products = service.backend.table('products_df')
+    assert int(products.get(keep)['stock']) == 7 and version(service, keep) == 2
+    assert drop not in products
+    assert status(service, update) == status(service, delete) == 'Approved'
+
+
+def test_request_for_a_changed_product_stays_pending(service):
+    [product_id] = add_products(service, ADMIN_A, ['Mouse'])
+    request_id = propose(service, ADMIN_A, product_id, stock=7)
+    service.update(ADMIN_A, 'products_df', [{'id': product_id, 'price': 9.0}])
+    resolved, conflicts = service.resolve(ADMIN_A, [request_id], 'Approved')
+    assert resolved == []
+    assert conflicts['reason'].tolist() == [PRODUCT_CHANGED]
+    assert status(service, request_id) == 'Pending'
+    assert int(service.backend.table('products_df').get(product_id)['stock']) == 10
+
+
+def test_several_requests_for_one_product_are_not_approved(service):
+    mouse, pad = add_products(service, ADMIN_A, ['Mouse', 'Pad'])
+    first, second = propose(service, ADMIN_A, mouse, stock=1), propose(service, ADMIN_A, mouse, stock=2)
+    other = propose(service, ADMIN_A, pad, stock=3)
+    resolved, conflicts = service.resolve(ADMIN_A, [first, second, other], 'Approved')
+    assert resolved == [other]
+    assert sorted(conflicts['request_id']) == sorted([first, second])
+    assert set(conflicts['reason']) == {'several requests for the same product'}
+    # One at a time they apply; the second was based on the version before the first
+    assert service.resolve(ADMIN_A, [first], 'Approved')[0] == [first]
+    assert service.resolve(ADMIN_A, [second], 'Approved')[1]['reason'].tolist() == [PRODUCT_CHANGED]
+
+
+def test_request_for_a_deleted_product(service):
+    [product_id] = add_products(service, ADMIN_A, ['Mouse'])
+    request_id = propose(service, ADMIN_A, product_id, stock=7)
+    service.delete(ADMIN_A, 'products_df', [product_id])
+    resolved, conflicts = service.resolve(ADMIN_A, [request_id], 'Approved')
+    assert resolved == [] and conflicts['reason'].tolist() == ['product no longer exists']
+
+
+def test_rejecting_needs_a_reason_and_leaves_the_product(service):
+    [product_id] = add_products(service, ADMIN_A, ['Mouse'])
+    request_id = propose(service, ADMIN_A, product_id, stock=7)
+    assert service.resolve(ADMIN_A, [request_id], 'Rejected')[1]['reason'].tolist() == ['a reason is required for rejection']
+    resolved, _ = service.resolve(ADMIN_A, [request_id], 'Rejected', 'too many')
+    assert resolved == [request_id]
+    request = service.backend.table('product_requests_df').get(request_id)
+    assert request['status'] == 'Rejected' and request['admin_notes'] == 'too many'
+    assert int(service.backend.table('products_df').get(product_id)['stock']) == 10
+
+
+def test_resolved_and_foreign_requests_are_not_pending(service):
+    [product_id] = add_products(service, ADMIN_A, ['Mouse'])
+    request_id = propose(service, ADMIN_A, product_id, stock=7)
+    assert service.resolve(ADMIN_B, [request_id], 'Approved')[1]['reason'].tolist() == ['request not pending in your company']
+    service.resolve(ADMIN_A, [request_id], 'Approved')
+    assert service.resolve(ADMIN_A, [request_id], 'Approved')[1]['reason'].tolist() == ['request not pending in your company']
+
+
+# --- HTTP API ---
+
+def test_http_api_rejects_malformed_bodies(service):
+    service.credentials.add_many({'admin@a.com': {'password': 'secret', 'role': 'Admin', 'company': 'Company A'}})
+    server = start_http_server(service, port=0)
+
+    def post(path, body, token=None):
+        request = urllib.request.Request(f"http://127.0.0.1:{server.server_address[1]}/{path}", data=body.encode(),
+                                         headers={'Authorization': f"Bearer {token}"} if token else {})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as e:
+            return e.code, json.load(e)
+
+    try:
+        assert post('login', 'null')[0] == 400
+        token = post('login', json.dumps({'email': 'admin@a.com', 'password': 'secret'}))[1]['token']
+        for body in ['[1]', 'null', '"records"', '{"records": 5}']:
+            status, reply = post('products/create', body, token)
+            assert status == 400 and 'error' in reply
+        assert post('products/delete', '{"ids": 3}', token)[0] == 400
+        assert post('products/create', '{"records": [{"product_name": "Mouse", "price": 5, "stock": 1}]}', token)[0] == 200
+    finally:
+        server.shutdown()
@@ -0,0 +1,160 @@
+import pandas as pd
+import pytest
+
+from sqlite_store import SQLiteBackend
+from store import SharedBackend, TrigramIndex, ViewCache, create_store, open_backend
+
+
+def products(n, company='Company A', prefix='Widget'):
+    return pd.DataFrame({'id': [f'p{i}' for i in range(n)], 'product_name': [f'{prefix} {i}' for i in range(n)],
+                         'price': 1.0, 'stock': 1, 'company': company})
+
+
+# --- Trigram Index ---
+
+def ids(index, text):
+    return [record_id for _, record_id in index.search(text)]
+
+
+def test_trigram_index_ranks_exact_then_prefix_then_word_then_substring():
+    index = TrigramIndex()
+    index.add_many(['sub', 'word', 'prefix', 'exact'], [['xmousex'], ['blue mouse'], ['mouse pad'], ['Mouse']])
+    assert ids(index, 'mouse') == ['exact', 'prefix', 'word', 'sub']
+
+
+def test_trigram_index_short_queries_match_word_starts():
+    index = TrigramIndex()
+    index.add_many(['a', 'b'], [['ab cd'], ['xab']])
+    assert ids(index, 'ab') == ['a']
+
+
+def test_trigram_index_reindex_and_remove():
+    index = TrigramIndex()
+    index.add('r1', ['old name'])
+    index.add('r1', ['new name'])
+    index.add('r2', ['other'])
+    assert ids(index, 'old') == []
+    assert ids(index, 'new') == ['r1']
+    index.remove('r1')
+    assert ids(index, 'name') == []
+    assert len(index) == 1
+
+
+def test_trigram_index_rebuild_during_batch_reindex():
+    index = TrigramIndex()
+    n = 1500
+    index.add_many([f'r{i}' for i in range(n)], [[f'widget {i}'] for i in range(n)])
+    for step in range(3):  # Enough removed documents to renumber the index in the middle of a batch
+        index.add_many([f'r{i}' for i in range(n)], [[f'gadget{step} {i}'] for i in range(n)])
+        assert len(ids(index, f'gadget{step} 1499')) == 1
+        assert ids(index, 'widget') == []
+    assert len(index) == n
+    assert len(ids(index, 'gadget2')) == n
+
+
+def test_store_search_after_bulk_renames():
+    store = create_store('products_df')
+    store.insert_many(products(1500))
+    for step in range(3):
+        store.update_many(pd.DataFrame({'id': [f'p{i}' for i in range(1500)],
+                                        'product_name': [f'Renamed{step} {i}' for i in range(1500)]}))
+        assert store.search(f'renamed{step} 7', {'company': 'Company A'}, limit=1)['product_name'].tolist() == [f'Renamed{step} 7']
+    assert store.search('widget', {'company': 'Company A'}).empty
+    store.delete_many([f'p{i}' for i in range(1000)])
+    assert len(store.search('renamed2', limit=2000)) == 500
+
+
+# --- Row Versions ---
+
+def test_every_write_bumps_row_version():
+    store = create_store('products_df')
+    store.insert({'id': 'a', 'product_name': 'A', 'price': 1.0, 'stock': 1, 'company': 'Company A'})
+    store.insert_many(products(2000, company='Company B'))  # Large batch, merged directly
+    assert store.get('a')['row_version'] == 1
+    assert (store.find(company='Company B')['row_version'] == 1).all()
+    store.update('a', {'stock': 2, 'row_version': 40})  # Whatever the caller passes
+    assert store.get('a')['row_version'] == 2
+    store.update_many(pd.DataFrame({'id': ['a', 'p0'], 'stock': [3, 3]}))
+    assert store.get('a')['row_version'] == 3
+    assert store.get('p0')['row_version'] == 2
+    store.update('p1', {'company': 'Company A'})  # Moves to another partition
+    assert store.get('p1')['row_version'] == 2
+    assert store.get('p1')['company'] == 'Company A'
+
+
+# --- Indexing and Compaction ---
+
+def test_record_store_buffers_indexes_and_compacts():
+    store = create_store('products_df').partition('Company A')
+    store.insert_many(products(10))  # Small batch, stays in the append buffer
+    assert store.get('p3')['product_name'] == 'Widget 3'
+    assert store.get_many(['p9', 'nope', 'p0'])['id'].tolist() == ['p9', 'p0']
+    with pytest.raises(KeyError):
+        store.insert({'id': 'p1', 'product_name': 'Dup', 'company': 'Company A'})
+    assert store.delete_many(['p1', 'p2', 'p3', 'nope']) == 3  # More than compact_ratio dead: compacted
+    assert not store._dead
+    assert len(store) == 7 and 'p2' not in store
+    assert store.get('p4')['product_name'] == 'Widget 4'  # Index rebuilt after the rows moved
+    assert store.prefix_search('widget 1', limit=5)['id'].tolist() == []
+    assert store.prefix_search('widget', limit=3)['id'].tolist() == ['p0', 'p4', 'p5']
+    store.update('p4', {'product_name': 'Gadget'})
+    assert store.prefix_search('gad')['id'].tolist() == ['p4']
+    assert store.find(product_name='Widget 4').empty
+
+
+def test_reads_skip_tombstones_and_read_the_buffer():
+    store = create_store('products_df')
+    store.insert_many(products(2000))
+    store.delete('p5')
+    store.insert({'id': 'new', 'product_name': 'Widget new', 'price': 1.0, 'stock': 2, 'company': 'Company A'})
+    rows, total = store.page({'company': 'Company A'}, offset=1995, limit=10)
+    assert total == 2000
+    assert rows['id'].tolist() == ['p1996', 'p1997', 'p1998', 'p1999', 'new']
+    assert store.page({'company': 'Company A'}, sort_by='product_name', ascending=False, limit=1)[0]['id'].tolist() == ['new']
+    assert len(store.find(company='Company A')) == 2000 and 'p5' not in set(store.find(company='Company A')['id'])
+    assert store.find(company='Company A', stock=2)['id'].tolist() == ['new']
+    assert store.search('widget new', {'company': 'Company A'})['id'].tolist() == ['new']
+    assert store.get_many(['new', 'p5', 'p7'])['id'].tolist() == ['new', 'p7']
+    partition = store.partition('Company A')
+    assert partition._dead and partition._buffered  # Nothing compacted or flushed by the reads
+
+
+def test_secondary_index_follows_updates_and_deletes():
+    store = create_store('product_requests_df')
+    store.insert_many([{'request_id': f'r{i}', 'product_id': 'p', 'company': 'Company A', 'request_type': 'Update',
+                        'status': 'Pending'} for i in range(5)])
+    store.update('r0', {'status': 'Approved'})
+    store.delete('r1')
+    assert store.count(company='Company A', status='Pending') == 3
+    assert sorted(store.find(company='Company A', status='Pending')['request_id']) == ['r2', 'r3', 'r4']
+    assert store.find(status='Approved')['request_id'].tolist() == ['r0']
+
+
+def test_partitioned_store_keeps_companies_apart():
+    store = create_store('products_df')
+    store.insert_many(products(3, 'Company A'))
+    store.insert_many(products(3, 'Company B', prefix='Gadget').assign(id=lambda df: 'b' + df['id']))
+    assert store.count(company='Company A') == 3
+    assert store.find(company='Company B')['product_name'].tolist() == ['Gadget 0', 'Gadget 1', 'Gadget 2']
+    store.update('p0', {'company': 'Company B'})
+    assert store.count(company='Company A') == 2 and store.count(company='Company B') == 4
+    assert store.get('p0')['company'] == 'Company B'
+    store.delete('bp1')
+    assert len(store) == 5
+    assert store.prefix_search('gadget', {'company': 'Company B'})['id'].tolist() == ['bp0', 'bp2']
+    assert set(store.distinct('company')) == {'Company A', 'Company B'}
+
+
+# --- SQLite Backend ---
+
+def test_sqlite_version_notices_writes_of_other_processes(tmp_path):
+    path = str(tmp_path / 'crud.db')
+    app, other = SharedBackend(open_backend('sqlite', path)), SQLiteBackend(path)  # Another process, e.g. service.py
+    cache = ViewCache()
+    count = lambda: cache.get(('products_df', app.table('products_df').version_of('Company A')),
+                              lambda: app.table('products_df').count(company='Company A'))
+    assert count() == 0
+    other.table('products_df').insert({'id': 'p1', 'product_name': 'Mouse', 'company': 'Company A'})
+    assert count() == 1
+    app.table('products_df').insert({'id': 'p2', 'product_name': 'Pad', 'company': 'Company A'})
+    assert count() == 2